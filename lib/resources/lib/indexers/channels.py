@@ -67,10 +67,11 @@ class channels:
             ('16', 'TCM +1', '5275')
         ]
 
-        threads = []
-        for i in channels: threads.append(workers.Thread(self.sky_list, i[0], i[1], i[2]))
-        [i.start() for i in threads]
-        [i.join() for i in threads]
+        dt1, dt2 = self.sky_slot()
+        urls = [self.sky_now_link % i[2] for i in channels] + [self.sky_programme_link % (i[2], dt1, dt2) for i in channels]
+        pages = dict([(i['url'], r) for i, r in client.request_many([{'url': i, 'timeout': '10'} for i in urls], timeout=30)])
+
+        for i in channels: self.sky_list(i[0], i[1], i[2], pages)
 
         threads = []
         for i in range(0, len(self.items)): threads.append(workers.Thread(self.items_list, self.items[i]))
@@ -86,22 +87,27 @@ class channels:
         return self.list
 
 
-    def sky_list(self, num, channel, id):
+    def sky_slot(self):
+        dt1 = (self.uk_datetime).strftime('%Y-%m-%d')
+        dt2 = int((self.uk_datetime).strftime('%H'))
+        if (dt2 < 6): dt2 = 0
+        elif (dt2 >= 6 and dt2 < 12): dt2 = 1
+        elif (dt2 >= 12 and dt2 < 18): dt2 = 2
+        elif (dt2 >= 18): dt2 = 3
+        return str(dt1), str(dt2)
+
+
+    def sky_list(self, num, channel, id, pages):
         try:
             url = self.sky_now_link % id
-            result = client.request(url, timeout='10')
+            result = pages.get(url)
             result = json.loads(result)
             match = result['listings'][id][0]['url']
 
-            dt1 = (self.uk_datetime).strftime('%Y-%m-%d')
-            dt2 = int((self.uk_datetime).strftime('%H'))
-            if (dt2 < 6): dt2 = 0
-            elif (dt2 >= 6 and dt2 < 12): dt2 = 1
-            elif (dt2 >= 12 and dt2 < 18): dt2 = 2
-            elif (dt2 >= 18): dt2 = 3
+            dt1, dt2 = self.sky_slot()
 
-            url = self.sky_programme_link % (id, str(dt1), str(dt2))
-            result = client.request(url, timeout='10')
+            url = self.sky_programme_link % (id, dt1, dt2)
+            result = pages.get(url)
             result = json.loads(result)
             result = result['listings'][id]
             result = [i for i in result if i['url'] == match][0]
@@ -843,9 +843,12 @@ class episodes:
         except:
             pass
 
-        def items_list(i):
+        def cached(i):
+            return [x for x in self.blist if x['tvdb'] == i['tvdb'] and x['snum'] == i['snum'] and x['enum'] == i['enum']]
+
+        def items_list(i, pages):
             try:
-                item = [x for x in self.blist if x['tvdb'] == i['tvdb'] and x['snum'] == i['snum'] and x['enum'] == i['enum']][0]
+                item = cached(i)[0]
                 item['action'] = 'episodes'
                 self.list.append(item)
                 return
@@ -854,7 +857,7 @@ class episodes:
 
             try:
                 url = self.tvdb_info_link % (i['tvdb'], lang)
-                data = urllib2.urlopen(url, timeout=10).read()
+                data = pages[url]
 
                 zip = zipfile.ZipFile(StringIO.StringIO(data))
                 result = zip.read('%s.xml' % lang)
@@ -1026,10 +1029,10 @@ class episodes:
 
         items = items[:100]
 
-        threads = []
-        for i in items: threads.append(workers.Thread(items_list, i))
-        [i.start() for i in threads]
-        [i.join() for i in threads]
+        urls = set([self.tvdb_info_link % (i['tvdb'], lang) for i in items if not cached(i)])
+        pages = dict([(i['url'], r) for i, r in client.request_many([{'url': i, 'timeout': '10'} for i in urls]) if r])
+
+        for i in items: items_list(i, pages)
 
 
         try:
@@ -0,0 +1,355 @@
+# -*- coding: utf-8 -*-
+
+'''
+    Covenant Add-on
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+
+import os,re,sys,copy,time,glob,random,shutil,tempfile,threading,optparse
+
+try: from sqlite3 import dbapi2 as database
+except: from pysqlite2 import dbapi2 as database
+
+from resources.lib.modules import headless
+from resources.lib.modules import scrape
+
+
+usage = '''%prog [options]
+
+Scrape the titles in resources/bench/titles with a fixed set of providers,
+answering every request from the cassettes in resources/bench, and print
+covenant-scrape's --report plus the time spent in sourcesFilter. Each run
+starts from an empty profile, so nothing comes from the provider cache and
+numbers from two checkouts compare.
+
+--filter scrapes nothing: it runs sourcesFilter and the implementation it
+replaced (legacyfilter.py) on the same generated source lists, fails if
+their output differs in any way and prints how long each takes.
+
+--processes N scrapes nothing either: it times the same parsing bound
+provider calls on the scraper's threads and on N worker processes
+(scrapers.processes), forking included.
+
+--cache has 100 provider threads store their results at once, through
+providercache and through the per thread connections it replaced, and
+prints how long until every write is committed and how many were lost.'''
+
+
+fixtures = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), 'bench')
+
+providers = ['releasebb', 'primewire', 'putlocker', 'solarmovie']
+
+# Resolver hosts and a debrid account as if urlresolver were installed, so
+# hoster links and debrid only providers get through whatever the machine has
+hosts = ['openload.co', 'oload.tv', 'streamango.com', 'thevideo.me', 'vidzi.tv', 'vidoza.net', 'vshare.eu', 'daclips.in', 'gorillavid.in', 'movpod.in']
+debrid_hosts = ['rapidgator.net', 'nitroflare.com', 'uploaded.net', 'openload.co']
+
+
+# Settings sourcesFilter reads, in the combinations --filter checks
+filter_settings = [{}, {'hosts.quality': '1', 'hosts.captcha': 'false'}, {'hosts.quality': '2', 'HEVC': 'true', 'sources.extrainfo': 'true'},
+                   {'hosts.quality': '3', 'hosts.sort.provider': 'true', 'prem.identify': '9'}, {'hosts.quality': '4', 'providers.lang': 'German'}]
+
+
+class _debrid:
+    def __init__(self, name='Real-Debrid', domains=debrid_hosts):
+        self.name = name
+        self.domains = domains
+
+    def isUniversal(self):
+        return True
+
+    def valid_url(self, url, host):
+        return host in self.domains
+
+
+def main(argv=None):
+    parser = optparse.OptionParser(usage=usage)
+    parser.add_option('-s', '--settings', help='Kodi style settings.xml to read settings from, e.g. to set scrapers.processes', metavar='FILE')
+    parser.add_option('-j', '--titles', type='int', default=1, help='titles scraped at once (default 1)')
+    parser.add_option('-f', '--filter', action='store_true', default=False, help='compare sourcesFilter with the implementation it replaced instead of scraping')
+    parser.add_option('-p', '--processes', type='int', default=0, help='compare provider calls on threads and on N worker processes instead of scraping', metavar='N')
+    parser.add_option('-c', '--cache', action='store_true', default=False, help='compare provider cache writes from 100 threads with the old way instead of scraping')
+    options, args = parser.parse_args(argv)
+
+    cassettes = sorted(glob.glob(os.path.join(fixtures, '*.cassette')))
+
+    profile = tempfile.mkdtemp()
+    try:
+        headless.install(options.settings, profile)
+
+        from resources.lib.modules import hostregistry
+        from resources.lib.modules import debrid
+        from resources.lib.modules import sources
+
+        hostregistry.resolver_hosts = hosts
+        debrid.debrid_resolvers = [_debrid()]
+
+        if options.filter: return compare()
+        if options.processes > 0: return modes(options.processes)
+        if options.cache: return writers()
+
+        spent = []
+        sources.sources.sourcesFilter = _timed(sources.sources.sourcesFilter, spent)
+
+        argv = ['--input', os.path.join(fixtures, 'titles'), '--output', os.devnull, '--providers', ','.join(providers), '--titles', str(options.titles), '--report']
+        for i in cassettes: argv += ['--replay', i]
+        r = scrape.main(argv)
+
+        sys.stderr.write('sourcesFilter %.3f s over %d calls\n' % (sum(spent), len(spent)))
+        return r
+    finally:
+        shutil.rmtree(profile, ignore_errors=True)
+
+
+def compare(sizes=(300, 2000), seeds=3, repeat=10):
+    '''
+    Run the current and the legacy sourcesFilter on the same generated lists
+    under every filter_settings combination, with no, one and two debrid
+    accounts, and report any difference in the sources, their order or their
+    labels. Then time both on the largest list.
+    '''
+    from resources.lib.modules import sources
+    from resources.lib.modules import legacyfilter
+
+    item = sources.sources()
+    accounts = [[], [_debrid()], [_debrid(), _debrid('Premiumize', ['uploaded.net', 'vidzi.tv', 'streamango.com'])]]
+
+    checked = 0 ; differ = 0
+    for n in sizes:
+        for seed in range(seeds):
+            generated = _generate(n, seed)
+            for settings in filter_settings:
+                for resolvers in accounts:
+                    old = _filter(legacyfilter.sourcesFilter, item, generated, settings, resolvers)[0]
+                    new = _filter(sources.sources.sourcesFilter.im_func, item, generated, settings, resolvers)[0]
+                    checked += 1
+                    if old == new: continue
+                    differ += 1
+                    at = min([i for i in range(min(len(old), len(new))) if not old[i] == new[i]] or [min(len(old), len(new))])
+                    sys.stdout.write('differs: %d sources, seed %d, %s, %d debrid: %d vs %d sources, first at %d\n' % (n, seed, settings, len(resolvers), len(old), len(new), at))
+
+    sys.stdout.write('%d of %d comparisons identical\n' % (checked - differ, checked))
+
+    generated = _generate(max(sizes), seeds)
+    for settings in [{}, {'hosts.captcha': 'false', 'sources.extrainfo': 'true'}]:
+        old = min([_filter(legacyfilter.sourcesFilter, item, generated, settings, accounts[1])[1] for i in range(repeat)])
+        new = min([_filter(sources.sources.sourcesFilter.im_func, item, generated, settings, accounts[1])[1] for i in range(repeat)])
+        sys.stdout.write('%d sources %s: legacy %.1f ms, current %.1f ms\n' % (max(sizes), settings, old * 1000, new * 1000))
+
+    return 1 if differ else 0
+
+
+def modes(count, calls=40, rows=1500):
+    '''
+    Run calls provider calls that parse a generated results page, as most
+    providers' sources() do, on the scraper's threads and then on count
+    worker processes, and print both times. Fails if any result differs.
+    '''
+    from resources.lib.modules import sources
+    from resources.lib.modules import processes
+    from resources.lib.modules import workers
+
+    provider = _parser(_listing(rows))
+    expected = provider.sources(None, hosts, debrid_hosts)
+
+    threads = sources.sources().getThreadCount()
+    t = time.time()
+    jobs = _run(workers.Pool(threads), provider, calls)
+    threaded = time.time() - t
+    differ = len([i for i in jobs if not i.result == expected])
+
+    processPool = processes.pool(count)
+    remote = processes.remote(processPool, 'bench', provider)
+    t = time.time()
+    processPool.start()
+    jobs = _run(workers.Pool(count), remote, calls)
+    forked = time.time() - t
+    processPool.close()
+    differ += len([i for i in jobs if not i.result == expected])
+
+    try:
+        import multiprocessing
+        cpus = multiprocessing.cpu_count()
+    except:
+        cpus = 0
+
+    sys.stdout.write('%d calls of %d sources on %d cpus: %d threads %.2f s, %d processes %.2f s\n' % (calls, len(expected), cpus, threads, threaded, count, forked))
+    if differ: sys.stdout.write('%d calls returned other sources\n' % differ)
+
+    return 1 if differ else 0
+
+
+def _run(pool, provider, calls):
+    jobs = [pool.submit(provider.sources, None, hosts, debrid_hosts) for i in range(calls)]
+    pool.start()
+    while not pool.wait(): pass
+    return jobs
+
+
+class _parser:
+    def __init__(self, page):
+        self.page = page
+
+    def sources(self, url, hostDict, hostprDict):
+        from resources.lib.modules import client
+        from resources.lib.modules import cleantitle
+
+        sources = []
+        for row in client.parseDOM(self.page, 'tr', attrs={'class': 'result'}):
+            name = client.replaceHTMLCodes(client.parseDOM(row, 'a')[0])
+            if not cleantitle.get(name).startswith(cleantitle.get('Dunkirk')): continue
+            link = client.parseDOM(row, 'a', ret='href')[0]
+            host = re.findall('//(?:www\.)?([^/]+)', link)[0]
+            if not host in hostDict and not host in hostprDict: continue
+            quality = '1080p' if '1080p' in name else '720p' if '720p' in name else 'SD'
+            sources.append({'source': host, 'quality': quality, 'language': 'en', 'url': link, 'direct': False, 'debridonly': not host in hostDict})
+        return sources
+
+
+def _listing(n):
+    r = random.Random(0)
+    names = hosts + debrid_hosts + ['example.net']
+    titles = ['Dunkirk 2017 1080p BluRay x264', 'Dunkirk.2017.720p.WEB-DL.DD5.1', 'Dunkirk &amp; More (2017) HDRip', 'Another Film 2017 HDRip']
+    rows = ['<tr class="result"><td><a href="http://www.%s/%d">%s</a></td><td>%d MB</td></tr>' % (r.choice(names), i, r.choice(titles), r.randint(300, 9000)) for i in range(n)]
+    return '<html><body><table>%s</table></body></html>' % '\n'.join(rows)
+
+
+def writers(count=100, titles=3, size=20):
+    '''
+    count providers finishing at once, each looking up and then storing a
+    url and a size source list for titles titles, as getMovieSource does:
+    first through providercache, then with a connection per thread and
+    repr payloads as before it. Lost writes are the ones that hit a locked
+    database; the old code dropped them silently.
+    '''
+    from resources.lib.modules import control
+    from resources.lib.modules import providercache
+
+    sources = _generate(size, 0)
+
+    control.makeFile(control.dataPath)
+    legacy = os.path.join(control.dataPath, 'legacy.db')
+    dbcon = database.connect(legacy)
+    dbcon.execute("CREATE TABLE IF NOT EXISTS rel_url (""source TEXT, ""imdb_id TEXT, ""season TEXT, ""episode TEXT, ""rel_url TEXT, ""UNIQUE(source, imdb_id, season, episode)"");")
+    dbcon.execute("CREATE TABLE IF NOT EXISTS rel_src (""source TEXT, ""imdb_id TEXT, ""season TEXT, ""episode TEXT, ""hosts TEXT, ""added TEXT, ""UNIQUE(source, imdb_id, season, episode)"");")
+    dbcon.commit()
+    dbcon.close()
+
+    def cached(source):
+        for i in range(titles):
+            imdb = 'tt%07d' % i
+            providercache.lookup(source, imdb)
+            providercache.get_url(source, imdb)
+            providercache.set_url(source, imdb, '', '', '/title/%d' % i)
+            providercache.set_sources(source, imdb, '', '', sources)
+
+    def connected(source):
+        try: dbcon = database.connect(legacy)
+        except: return
+        dbcur = dbcon.cursor()
+        for i in range(titles):
+            imdb = 'tt%07d' % i
+            try: dbcur.execute("SELECT * FROM rel_src WHERE source = '%s' AND imdb_id = '%s' AND season = '%s' AND episode = '%s'" % (source, imdb, '', ''))
+            except: pass
+            try: dbcur.execute("SELECT * FROM rel_url WHERE source = '%s' AND imdb_id = '%s' AND season = '%s' AND episode = '%s'" % (source, imdb, '', ''))
+            except: pass
+            try:
+                dbcur.execute("DELETE FROM rel_url WHERE source = '%s' AND imdb_id = '%s' AND season = '%s' AND episode = '%s'" % (source, imdb, '', ''))
+                dbcur.execute("INSERT INTO rel_url Values (?, ?, ?, ?, ?)", (source, imdb, '', '', repr('/title/%d' % i)))
+                dbcon.commit()
+            except:
+                pass
+            try:
+                dbcur.execute("DELETE FROM rel_src WHERE source = '%s' AND imdb_id = '%s' AND season = '%s' AND episode = '%s'" % (source, imdb, '', ''))
+                dbcur.execute("INSERT INTO rel_src Values (?, ?, ?, ?, ?, ?)", (source, imdb, '', '', repr(sources), time.strftime('%Y-%m-%d %H:%M')))
+                dbcon.commit()
+            except:
+                pass
+
+    lost = 0
+    for name, target, path in [('providercache', cached, control.providercacheFile), ('connection per thread', connected, legacy)]:
+        start = threading.Event()
+        threads = [threading.Thread(target=_after, args=(start, target, 'provider%d' % n)) for n in range(count)]
+        for i in threads: i.start()
+        t = time.time()
+        start.set()
+        for i in threads: i.join()
+        providercache.flush()
+        spent = time.time() - t
+
+        dbcon = database.connect(path)
+        stored = dbcon.execute("SELECT COUNT(*) FROM rel_src").fetchone()[0]
+        dbcon.close()
+        if target == cached: lost = count * titles - stored
+
+        sys.stdout.write('%s: %d writers, %.2f s, %d of %d source lists stored\n' % (name, count, spent, stored, count * titles))
+
+    return 1 if lost else 0
+
+
+def _after(event, target, *args):
+    event.wait()
+    target(*args)
+
+
+def _filter(function, item, generated, settings, resolvers):
+    from resources.lib.modules import debrid
+
+    keys = set(sum([i.keys() for i in filter_settings], []))
+    for k in keys: headless.settings_store[k] = settings.get(k, '')
+
+    # Host answers are cached per process, so start over with each set of accounts
+    debrid.debrid_resolvers = resolvers
+    debrid.host_map.clear()
+    debrid.host_loaded = True
+
+    item.sources = copy.deepcopy(generated)
+    random.seed(0)
+    t = time.time()
+    r = function(item)
+    return r, time.time() - t
+
+
+def _generate(n, seed):
+    '''
+    n sources as providers return them: hoster, premium, captcha, high
+    quality and unknown hosts, every quality, and the optional keys
+    sourcesFilter looks at.
+    '''
+    r = random.Random(seed)
+    names = hosts + debrid_hosts + ['gvideo', 'cdn', 'uptobox.com', 'example.net']
+    items = []
+    for i in range(n):
+        item = {'source': r.choice(names), 'quality': r.choice(['4K', '1440p', '1080p', '720p', 'HD', 'SD', 'SCR', 'CAM']), 'language': r.choice(['en', 'en', 'en', 'de']),
+                'url': 'http://example.net/%d.%s' % (i, r.choice(['mkv', 'mp4', 'avi', 'html'])), 'direct': r.random() < 0.2, 'debridonly': r.random() < 0.3,
+                'provider': 'provider%d' % r.randint(0, 30), 'info': r.choice(['', 'HEVC', '3D | 1.20 GB', '0', ' ', None])}
+        if r.random() < 0.1: item['memberonly'] = True
+        if r.random() < 0.1: item['checkquality'] = True
+        if r.random() < 0.02: item['local'] = True
+        items.append(item)
+    return items
+
+
+def _timed(function, spent):
+    def timed(*args):
+        t = time.time()
+        try: return function(*args)
+        finally: spent.append(time.time() - t)
+    return timed
+
+
+if __name__ == '__main__':
+    sys.exit(main())
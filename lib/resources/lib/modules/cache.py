@@ -20,6 +20,7 @@ import hashlib
 import re
 import time
 from resources.lib.modules import control
+from resources.lib.modules import workers
 
 try:
     from sqlite3 import dbapi2 as db, OperationalError
@@ -32,6 +33,8 @@ This module is used to get/set cache for every action done in the system
 
 cache_table = 'cache'
 
+flights = workers.Flights()
+
 def get(function, duration, *args):
     # type: (function, int, object) -> object or None
     """
@@ -48,19 +51,25 @@ def get(function, duration, *args):
             if _is_cache_valid(cache_result['date'], duration):
                 return ast.literal_eval(cache_result['value'].encode('utf-8'))
 
-        fresh_result = repr(function(*args))
+        # Threads missing the same key at once share one call of function
+        fresh_result = flights.call(key, _refresh, key, function, args)
         if not fresh_result:
             # If the cache is old, but we didn't get fresh result, return the old cache
             if cache_result:
                 return cache_result
             return None
 
-        cache_insert(key, fresh_result)
         return ast.literal_eval(fresh_result.encode('utf-8'))
     except Exception:
         return None
 
 
+def _refresh(key, function, args):
+    fresh_result = repr(function(*args))
+    if fresh_result: cache_insert(key, fresh_result)
+    return fresh_result
+
+
 def timeout(function, *args):
     try:
         key = _hash_function(function, args)
@@ -172,6 +181,12 @@ def cache_clear():
     except:
         pass
 
+    try:
+        from resources.lib.modules import httpcache
+        httpcache.clear()
+    except:
+        pass
+
 def cache_clear_meta():
     try:
         cursor = _get_connection_cursor_meta()
@@ -187,18 +202,9 @@ def cache_clear_meta():
         pass
 
 def cache_clear_providers():
-    try:
-        cursor = _get_connection_cursor_providers()
-
-        for t in ['rel_src', 'rel_url']:
-            try:
-                cursor.execute("DROP TABLE IF EXISTS %s" % t)
-                cursor.execute("VACUUM")
-                cursor.commit()
-            except:
-                pass
-    except:
-        pass
+    # providercache holds the providers database open and knows its tables
+    from resources.lib.modules import providercache
+    providercache.clear()
 
 def cache_clear_search():
     try:
@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+
+'''
+    Covenant Add-on
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+
+import json,gzip,base64,threading,urllib,urllib2,mimetools,StringIO
+
+from resources.lib.modules import client
+
+
+# Record the traffic of client.request into a gzipped JSON lines cassette, or
+# serve a cassette back without touching the network. Both work by swapping
+# client.urlopen, so nothing changes while neither is active.
+
+# Request headers that can change what a site answers; User-Agent is random
+relevant_headers = ['Cookie', 'Referer', 'X-requested-with', 'Content-type', 'Accept-language']
+
+# Read when a request does not say how much client.request would read
+body_limit = 5242880
+
+lock = threading.Lock()
+recorder = None
+player = None
+posted = None
+
+
+def record(path):
+    '''
+    Send client traffic to the network as usual and append every exchange to
+    the cassette at path.
+    '''
+    global recorder
+    stop()
+    recorder = gzip.open(path, 'ab')
+    client.urlopen = _record
+
+
+def replay(*paths):
+    '''
+    Answer client traffic from the cassettes at paths. Repeated requests get
+    the recorded answers in order, then the last one again; anything not
+    recorded fails as a network error would. A post that was not recorded
+    gets an answer recorded for another post to the same URL, since posts
+    carrying a timestamp or nonce never repeat.
+    '''
+    global player, posted
+    stop()
+    player, posted = {}, {}
+    for path in paths:
+        f = gzip.open(path, 'rb')
+        try:
+            for line in f:
+                i = json.loads(line)
+                answers = player.setdefault(_key(i['method'], i['url'], i['post']), [])
+                answers.append(i)
+                if i['post']: posted.setdefault((i['method'], i['url']), answers)
+        finally:
+            f.close()
+    client.urlopen = _replay
+
+
+def stop():
+    global recorder, player, posted
+    client.urlopen = client.open_url
+    with lock:
+        if not recorder == None: recorder.close()
+        recorder = None
+    player, posted = None, None
+
+
+def _key(method, url, post):
+    return (method, url, post or None)
+
+
+def _request(request):
+    if isinstance(request, basestring): request = urllib2.Request(request)
+    headers = dict(request.header_items())
+    return request, {'method': request.get_method(), 'url': request.get_full_url(), 'post': request.get_data(),
+                     'headers': dict([(k, v) for k, v in headers.items() if k in relevant_headers])}
+
+
+def _text(s):
+    try: return {'body': s.decode('utf-8')}
+    except: return {'body64': base64.b64encode(s)}
+
+
+def _record(request, data=None, timeout=30, opener=None):
+    request, item = _request(request)
+    if not data == None: item['post'] = data
+
+    try:
+        response = client.open_url(request, data, timeout, opener)
+        error = False
+    except urllib2.HTTPError as response:
+        error = True
+
+    # As much as the live call reads, so file_size and chunk probes of video links stay small
+    try: body = response.read(getattr(request, 'read_limit', body_limit))
+    except: body = ''
+    try: response.close()
+    except: pass
+
+    headers = response.info()
+    # Stored decoded, so the replayed headers must not claim otherwise
+    if headers.getheader('Content-Encoding') == 'gzip':
+        try:
+            body = gzip.GzipFile(fileobj=StringIO.StringIO(body)).read()
+            del headers['Content-Encoding']
+            headers['Content-Length'] = str(len(body))
+        except:
+            pass
+
+    item.update({'status': response.code, 'msg': getattr(response, 'msg', ''), 'error': error, 'final': response.geturl(), 'response_headers': ''.join(headers.headers).decode('latin-1')})
+    item.update(_text(body))
+
+    with lock:
+        if not recorder == None:
+            recorder.write(json.dumps(item) + '\n')
+            recorder.flush()
+
+    return _response(item)
+
+
+def _replay(request, data=None, timeout=30, opener=None):
+    request, item = _request(request)
+    if not data == None: item['post'] = data
+
+    answers = (player or {}).get(_key(item['method'], item['url'], item['post']))
+    if not answers and item['post']: answers = (posted or {}).get((item['method'], item['url']))
+    if not answers: raise urllib2.URLError('not in cassette: %s' % item['url'])
+
+    with lock:
+        answer = answers.pop(0) if len(answers) > 1 else answers[0]
+
+    return _response(answer, request)
+
+
+def _response(item, request=None):
+    '''
+    The recorded answer as urllib2 would give it. With request, its
+    cookiejar takes the answer's cookies, as the live cookie processor does.
+    '''
+    body = base64.b64decode(item['body64']) if 'body64' in item else item['body'].encode('utf-8')
+    headers = mimetools.Message(StringIO.StringIO(item['response_headers'].encode('latin-1')))
+
+    response = urllib.addinfourl(StringIO.StringIO(body), headers, item['final'], item['status'])
+    response.msg = item['msg']
+
+    jar = getattr(request, 'cookiejar', None)
+    if not jar == None: jar.extract_cookies(response, request)
+
+    if item['error']:
+        raise urllib2.HTTPError(item['final'], item['status'], item['msg'], headers, StringIO.StringIO(body))
+
+    return response
@@ -18,20 +18,170 @@
 '''
 
 
-import re,sys,cookielib,urllib,urllib2,urlparse,gzip,StringIO,HTMLParser,time,random,base64
+import re,sys,socket,cookielib,urllib,urllib2,urlparse,gzip,zlib,StringIO,HTMLParser,time,random,base64,threading
 
 
 from resources.lib.modules import workers
+from resources.lib.modules import keepalive
+from resources.lib.modules import hostguard
+from resources.lib.modules import httploop
 from resources.lib.modules import dom_parser
 from resources.lib.modules import utils
 from resources.lib.modules import log_utils
 
 try:
     from resources.lib.modules import cache
+    from resources.lib.modules import httpcache
     LOCAL_RUN = False
 except:
     LOCAL_RUN = True
 
+
+
+def _ssl_context():
+    # These releases verify certificates and fail on many provider sites
+    if (2, 7, 8) < sys.version_info < (2, 7, 12):
+        try:
+            import ssl; ssl_context = ssl.create_default_context()
+            ssl_context.check_hostname = False
+            ssl_context.verify_mode = ssl.CERT_NONE
+            return ssl_context
+        except:
+            pass
+
+
+# Connections stay open and are reused per host; a scrape otherwise repeats
+# the TCP and TLS handshakes for every search, detail and embed page
+keepalive_max_per_host = 6
+keepalive_max_idle = 30
+
+ssl_context = _ssl_context()
+
+keepalive_handlers = [keepalive.HTTPHandler(keepalive_max_per_host, keepalive_max_idle), keepalive.HTTPSHandler(keepalive_max_per_host, keepalive_max_idle, ssl_context)]
+
+
+
+class NoRedirectHandler(urllib2.HTTPRedirectHandler):
+    def http_error_302(self, req, fp, code, msg, headers):
+        infourl = urllib.addinfourl(fp, headers, req.get_full_url())
+        infourl.status = code
+        infourl.code = code
+        return infourl
+    http_error_300 = http_error_302
+    http_error_301 = http_error_302
+    http_error_303 = http_error_302
+    http_error_307 = http_error_302
+
+
+class RedirectHandler(urllib2.HTTPRedirectHandler):
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        new = urllib2.HTTPRedirectHandler.redirect_request(self, req, fp, code, msg, headers, newurl)
+        if not new == None:
+            for i in ['cookiejar', 'connect_timeout', 'deadline']:
+                if hasattr(req, i): setattr(new, i, getattr(req, i))
+        return new
+
+
+class RequestCookieProcessor(urllib2.BaseHandler):
+    '''
+    Cookie handling for a shared opener: each request carries its own jar as
+    request.cookiejar, so concurrent calls never see each other's cookies.
+    '''
+    def http_request(self, request):
+        jar = getattr(request, 'cookiejar', None)
+        if not jar == None: jar.add_cookie_header(request)
+        return request
+
+    def http_response(self, request, response):
+        jar = getattr(request, 'cookiejar', None)
+        if not jar == None: jar.extract_cookies(response, request)
+        return response
+
+    https_request = http_request
+    https_response = http_response
+
+
+# One opener per (proxy, redirect) built on first use and shared by every
+# thread; nothing is installed globally, so calls cannot leak into each other
+openers = {}
+openers_lock = threading.Lock()
+
+
+def get_opener(proxy=None, redirect=True):
+    key = (proxy, redirect)
+    try: return openers[key]
+    except KeyError: pass
+
+    handlers = list(keepalive_handlers)
+    if not proxy == None: handlers += [urllib2.ProxyHandler({'http':'%s' % (proxy)})]
+    handlers += [RequestCookieProcessor(), RedirectHandler() if redirect == True else NoRedirectHandler()]
+
+    opener = urllib2.build_opener(*handlers)
+    opener.proxy, opener.redirect = proxy, redirect
+
+    with openers_lock:
+        return openers.setdefault(key, opener)
+
+
+def open_url(request, data=None, timeout=30, opener=None):
+    host = hostguard.host(request)
+    hostguard.acquire(host, timeout)
+
+    opener = opener or get_opener()
+
+    try:
+        if engine == 'loop' and getattr(opener, 'proxy', None) == None:
+            response = httploop.open(request, data, timeout, getattr(opener, 'redirect', True), ssl_context)
+        else:
+            response = opener.open(request, data, timeout)
+    except urllib2.HTTPError as e:
+        # request() tells a cloudflare check from a real 503 and records the latter
+        if not _cloudflare(e): hostguard.record(host, e.code, e.info())
+        raise
+    except urllib2.URLError as e:
+        if isinstance(e.reason, hostguard.ConnectError): hostguard.record(host)
+        raise
+
+    hostguard.record(host, response.code, response.info())
+    return response
+
+
+def _cloudflare(response):
+    try: return response.code == 503 and 'cloudflare' in response.info().getheader('Server', '').lower()
+    except: return False
+
+
+# Swapped by modules/cassette.py to record or replay traffic
+urlopen = open_url
+
+# 'loop' sends requests without a proxy through the shared modules/httploop
+# engine thread instead of a blocking socket per calling thread
+engine = None
+
+# Longest wait for a connection, DNS lookup and TLS handshake included,
+# when a call gives a single timeout
+connect_timeout = 10
+
+# Bytes read per step when decoding a body as it arrives
+stream_chunk = 16 * 1024
+
+_transfer = threading.local()
+
+# Concurrent identical requests share one fetch
+flights = workers.Flights()
+
+# host -> base url of a stand-in server, e.g. {'rlsbb.ru': 'http://127.0.0.1:8000'}
+host_map = {}
+
+
+def map_host(host, target):
+    '''
+    Send every request for host to target instead, keeping the path and
+    passing the original host in the Host header. Used to point providers at
+    a local server serving recorded pages.
+    '''
+    host_map[host.lower()] = target.rstrip('/')
+
 def request(url,
             close=True,
             redirect=True,
@@ -46,40 +196,120 @@ def request(url,
             cookie=None,
             compression=True,
             output='',
-            timeout='30'):
+            timeout='30',
+            cached=None,
+            stop_when=None):
+    '''
+    cached turns on the HTTP cache for plain GETs read whole: True follows
+    the response's Cache-Control and Expires, a number of seconds keeps the
+    response fresh that long whatever the headers say.
+
+    timeout is the wait for the first byte, and for each read after it, in
+    seconds. Connecting gets at most connect_timeout of that. A tuple gives
+    (connect, first byte, total) instead; the total bounds the whole call.
+
+    stop_when, a regex or a callable taking the text read so far, ends the
+    download as soon as it matches and returns what has arrived; use it when
+    only the start of a large page is needed. transfer() tells the bytes
+    read and saved.
+
+    Identical calls made while one is in flight wait for its answer rather
+    than fetching again.
+    '''
+    # One spelling per timeout, so '30', 30 and (10, 30, None) share a flight
+    try: timeout = _timeouts(timeout)
+    except: pass
+
+    args = (url, close, redirect, error, proxy, post, headers, mobile, XHR, limit, referer, cookie, compression, output, timeout, cached, stop_when)
+    _transfer.last = (0, 0)
+    if not url or workers.cancelled(): return
+    try: key = repr([sorted(i.items()) if isinstance(i, dict) else i for i in args])
+    except: return _request(*args)
+    return flights.call(key, _request, *args)
+
+
+def request_many(requests, concurrency=10, timeout=None):
+    '''
+    Fetch requests on at most concurrency threads and yield (request,
+    result) pairs in the order they finish. Each request is a url or a dict
+    of request() arguments, and is yielded back as given.
+
+    timeout is shared by the whole batch: no request runs longer, and once
+    it passes whatever is still running is cancelled and yielded with None.
+    The same happens when the job calling this is cancelled or the generator
+    is closed early.
+    '''
+    deadline = None if timeout == None else time.time() + float(timeout)
+
+    pool = workers.Pool(concurrency)
+    pending = []
+    for i in requests:
+        kwargs = dict(i) if isinstance(i, dict) else {'url': i}
+        pending.append((pool.submit(_request_one, kwargs, timeout, deadline), i))
+    pool.start()
+
+    stopped = False
+    try:
+        while pending:
+            if not stopped and (workers.cancelled() or (not deadline == None and time.time() >= deadline)):
+                pool.cancel()
+                stopped = True
+
+            with pool.changed:
+                finished = [i for i in pending if not i[0].is_alive()]
+                if not finished:
+                    wait = 0.25 if deadline == None or stopped else max(0.01, min(0.25, deadline - time.time()))
+                    pool.changed.wait(wait)
+
+            for i in finished:
+                pending.remove(i)
+                yield i[1], i[0].result
+    finally:
+        pool.cancel()
+
+
+def _request_one(kwargs, timeout, deadline):
+    if not deadline == None and time.time() >= deadline: return None
+
+    # Capped at the batch timeout rather than at what is left of it, so the
+    # same request gets the same flight key however late it starts; the
+    # batch cancels it at the deadline all the same
+    if not timeout == None:
+        connect, read, total = _timeouts(kwargs.get('timeout', '30'))
+        kwargs['timeout'] = (connect, read, float(timeout) if total == None else min(total, float(timeout)))
+    return request(**kwargs)
+
+
+def _request(url, close, redirect, error, proxy, post, headers, mobile, XHR, limit, referer, cookie, compression, output, timeout, cached, stop_when):
     try:
         if not url:
             return
 
-        handlers = []
+        if workers.cancelled():
+            return
+
+        connect_timeout, read_timeout, total_timeout = _timeouts(timeout)
+        deadline = None if total_timeout == None else time.time() + total_timeout
 
-        if not proxy == None:
-            handlers += [urllib2.ProxyHandler({'http':'%s' % (proxy)}), urllib2.HTTPHandler]
-            opener = urllib2.build_opener(*handlers)
-            opener = urllib2.install_opener(opener)
+        _opener = get_opener(proxy, redirect == True)
 
+        cookies = None
         if output == 'cookie' or output == 'extended' or not close == True:
             cookies = cookielib.LWPCookieJar()
-            handlers += [urllib2.HTTPHandler(), urllib2.HTTPSHandler(), urllib2.HTTPCookieProcessor(cookies)]
-            opener = urllib2.build_opener(*handlers)
-            opener = urllib2.install_opener(opener)
-
-        if (2, 7, 8) < sys.version_info < (2, 7, 12):
-            try:
-                import ssl; ssl_context = ssl.create_default_context()
-                ssl_context.check_hostname = False
-                ssl_context.verify_mode = ssl.CERT_NONE
-                handlers += [urllib2.HTTPSHandler(context=ssl_context)]
-                opener = urllib2.build_opener(*handlers)
-                opener = urllib2.install_opener(opener)
-            except:
-                pass
 
         if url.startswith('//'): url = 'http:' + url
         _headers = {}
         try: _headers.update(headers)
         except: pass
 
+        if host_map:
+            u = urlparse.urlparse(url)
+            h = u.netloc.lower()
+            if h.startswith('www.') and not h in host_map: h = h[4:]
+            if h in host_map:
+                _headers['Host'] = u.netloc
+                url = host_map[h] + url[len('%s://%s' % (u.scheme, u.netloc)):]
+
         if 'User-Agent' in _headers.keys():
             pass
         elif not mobile == True:
@@ -107,28 +337,6 @@ def request(url,
             _headers['Accept-Encoding'] = 'gzip'
 
         if redirect == False:
-
-            #old implementation
-            #class NoRedirection(urllib2.HTTPErrorProcessor):
-            #    def http_response(self, request, response): return response
-
-            #opener = urllib2.build_opener(NoRedirection)
-            #opener = urllib2.install_opener(opener)
-
-            class NoRedirectHandler(urllib2.HTTPRedirectHandler):
-                def http_error_302(self, req, fp, code, msg, headers):
-                    infourl = urllib.addinfourl(fp, headers, req.get_full_url())
-                    infourl.status = code
-                    infourl.code = code
-                    return infourl
-                http_error_300 = http_error_302
-                http_error_301 = http_error_302
-                http_error_303 = http_error_302
-                http_error_307 = http_error_302
-
-            opener = urllib2.build_opener(NoRedirectHandler())
-            urllib2.install_opener(opener)
-
             try: del _headers['Referer']
             except: pass
 
@@ -138,14 +346,34 @@ def request(url,
 
         url = utils.byteify(url)
 
+        stored = None
+        if cached and not LOCAL_RUN and post == None and limit == None and stop_when == None and close == True and output in ['', 'extended']:
+            cache_key = httpcache.key(url, _headers)
+            cache_ttl = None if cached == True else cached
+            stored = httpcache.get(cache_key)
+            if not stored == None:
+                if stored['fresh']: return _stored_result(stored, output, _headers)
+                if stored['etag']: _headers['If-None-Match'] = stored['etag']
+                if stored['modified']: _headers['If-Modified-Since'] = stored['modified']
+        else:
+            cached = None
+
         request = urllib2.Request(url, data=post)
         _add_request_header(request, _headers)
+        request.cookiejar = cookies
+        request.connect_timeout, request.deadline = connect_timeout, deadline
+        request.read_limit = _read_limit(output, limit)
 
 
         try:
-            response = urllib2.urlopen(request, timeout=int(timeout))
+            response = urlopen(request, timeout=read_timeout, opener=_opener)
+            workers.register(response)
         except urllib2.HTTPError as response:
 
+            if response.code == 304 and not stored == None:
+                httpcache.revalidated(cache_key, response.info(), cache_ttl)
+                return _stored_result(stored, output, _headers)
+
             if response.code == 503:
                 cf_result = response.read(5242880)
                 try: encoding = response.info().getheader('Content-Encoding')
@@ -168,12 +396,18 @@ def request(url,
 
                     request = urllib2.Request(url, data=post)
                     _add_request_header(request, _headers)
+                    request.cookiejar = cookies
+                    request.connect_timeout, request.deadline = connect_timeout, deadline
+                    request.read_limit = _read_limit(output, limit)
 
-                    response = urllib2.urlopen(request, timeout=int(timeout))
+                    response = urlopen(request, timeout=read_timeout, opener=_opener)
                 else:
+                    if _cloudflare(response): hostguard.record(hostguard.host(request), response.code, response.info())
+                    workers.fail()
                     log_utils.log('Request-Error (%s): %s' % (str(response.code), url), log_utils.LOGDEBUG)
                     if error == False: return
             else:
+                if response.code >= 500: workers.fail()
                 log_utils.log('Request-Error (%s): %s' % (str(response.code), url), log_utils.LOGDEBUG)
                 if error == False: return
 
@@ -210,17 +444,7 @@ def request(url,
             response.close()
             return content
 
-        if limit == '0':
-            result = response.read(224 * 1024)
-        elif not limit == None:
-            result = response.read(int(limit) * 1024)
-        else:
-            result = response.read(5242880)
-
-        try: encoding = response.info().getheader('Content-Encoding')
-        except: encoding = None
-        if encoding == 'gzip':
-            result = gzip.GzipFile(fileobj=StringIO.StringIO(result)).read()
+        result = _read(response, limit, stop_when, deadline)
 
 
         if 'sucuri_cloudproxy_js' in result:
@@ -230,29 +454,26 @@ def request(url,
 
             request = urllib2.Request(url, data=post)
             _add_request_header(request, _headers)
+            request.cookiejar = cookies
+            request.connect_timeout, request.deadline = connect_timeout, deadline
+            request.read_limit = _read_limit(output, limit)
 
-            response = urllib2.urlopen(request, timeout=int(timeout))
-
-            if limit == '0':
-                result = response.read(224 * 1024)
-            elif not limit == None:
-                result = response.read(int(limit) * 1024)
-            else:
-                result = response.read(5242880)
+            response = urlopen(request, timeout=read_timeout, opener=_opener)
 
-            try: encoding = response.info().getheader('Content-Encoding')
-            except: encoding = None
-            if encoding == 'gzip':
-                result = gzip.GzipFile(fileobj=StringIO.StringIO(result)).read()
+            result = _read(response, limit, stop_when, deadline)
 
         if 'Blazingfast.io' in result and 'xhr.open' in result:
             netloc = '%s://%s' % (urlparse.urlparse(url).scheme, urlparse.urlparse(url).netloc)
             ua = _headers['User-Agent']
             #_headers['Cookie'] = cache.get(bfcookie().get, 168, netloc, ua, timeout)
             _headers['Cookie'] = bfcookie().get()
+            cached = None
 
             result = _basic_request(url, headers=_headers, post=post, timeout=timeout, limit=limit)
 
+        if cached and response.code == 200:
+            httpcache.insert(cache_key, url, response.code, response.info(), result, cache_ttl)
+
         if output == 'extended':
             try: response_headers = dict([(item[0].title(), item[1]) for item in response.info().items()])
             except: response_headers = response.headers
@@ -267,10 +488,29 @@ def request(url,
             if close == True: response.close()
             return result
     except Exception as e:
+        workers.fail()
         log_utils.log('Request-Error: (%s) => %s' % (str(e), url), log_utils.LOGDEBUG)
         return
 
 
+def _read_limit(output, limit):
+    '''
+    Bytes of body worth fetching for output, for engines that read the
+    whole body up front. Outputs that only look at the status keep enough
+    for the cloudflare check.
+    '''
+    if output in ['geturl', 'headers', 'chunk', 'file_size']: return 16 * 1024
+    if limit == '0': return 224 * 1024
+    if limit: return int(limit) * 1024
+    return 5242880
+
+
+def _stored_result(stored, output, headers):
+    if output == 'extended':
+        return (stored['body'], str(stored['code']), stored['headers'], headers, '')
+    return stored['body']
+
+
 def _basic_request(url, headers=None, post=None, timeout='30', limit=None):
     try:
         try: headers.update(headers)
@@ -278,9 +518,10 @@ def _basic_request(url, headers=None, post=None, timeout='30', limit=None):
 
         request = urllib2.Request(url, data=post)
         _add_request_header(request, headers)
-        response = urllib2.urlopen(request, timeout=int(timeout))
+        response = urlopen(request, timeout=_timeouts(timeout)[1])
         return _get_result(response, limit)
     except:
+        workers.fail()
         return
 
 
@@ -294,7 +535,7 @@ def _add_request_header(_request, headers):
 
         referer = headers.get('Referer') if 'Referer' in headers else '%s://%s' % (scheme, _request.get_host())
 
-        _request.add_unredirected_header('Host', _request.get_host())
+        _request.add_unredirected_header('Host', headers.get('Host', _request.get_host()))
         _request.add_unredirected_header('Referer', referer)
         for key in headers: _request.add_header(key, headers[key])
     except:
@@ -302,21 +543,103 @@ def _add_request_header(_request, headers):
 
 
 def _get_result(response, limit=None):
-    if limit == '0':
-        result = response.read(224 * 1024)
-    elif limit:
-        result = response.read(int(limit) * 1024)
-    else:
-        result = response.read(5242880)
+    return _read(response, limit)
+
+
+def _timeouts(timeout):
+    '''
+    (connect, first byte, total) seconds for request's timeout argument.
+    '''
+    if isinstance(timeout, (tuple, list)):
+        timeout = [None if i == None else float(i) for i in timeout] + [None, None]
+        return timeout[0], timeout[1] or 30, timeout[2]
+    timeout = float(timeout)
+    return float(min(connect_timeout, timeout)), timeout, None
+
+
+def _read(response, limit=None, stop_when=None, deadline=None):
+    '''
+    The body of response, up to limit KB (224 KB for '0', else 5 MB) of
+    what is sent, decoding gzip and deflate as it arrives. stop_when, a
+    regex or a callable taking the text so far, ends the transfer as soon
+    as it matches; past deadline it fails with socket.timeout. Byte counts
+    are left for transfer().
+    '''
+    size = _read_limit('', limit)
+
+    try: encoding = (response.info().getheader('Content-Encoding') or '').lower()
+    except: encoding = ''
+
+    try: length = int(response.info().getheader('Content-Length'))
+    except: length = None
+
+    if encoding == 'gzip': decoder = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    elif encoding == 'deflate': decoder = _inflater()
+    else: decoder = None
+
+    if stop_when == None and decoder == None and deadline == None:
+        result = response.read(size)
+        _transfer.last = (len(result), 0)
+        return result
+
+    if isinstance(stop_when, basestring): stop_when = re.compile(stop_when)
+
+    parts = [] ; read = 0 ; decoded = 0 ; checked = 0 ; stopped = False
+    while read < size and not stopped:
+        if not deadline == None and time.time() > deadline:
+            raise socket.timeout('transfer took longer than its deadline')
+        data = response.read(min(stream_chunk, size - read))
+        if not data: break
+        read += len(data)
+
+        if not decoder == None:
+            try: data = decoder.decompress(data)
+            except zlib.error:
+                # Labelled compressed but sent as is; anything later is a corrupt body
+                if not read == len(data): raise
+                decoder = None
+        parts.append(data)
+        decoded += len(data)
+
+        if stop_when == None or not data:
+            continue
+        elif hasattr(stop_when, 'search'):
+            # Only the new text and enough before it for a match to straddle chunks
+            window = ''.join(parts[-2:]) if len(parts) > 1 else data
+            stopped = not stop_when.search(window) == None
+        elif decoded >= checked * 1.25 + stream_chunk:
+            # The whole text gets handed over, so check as it grows by a quarter
+            checked = decoded
+            stopped = bool(stop_when(''.join(parts)))
+
+    saved = (length - read) if stopped and not length == None else 0
+    _transfer.last = (read, saved)
+
+    return ''.join(parts)
+
+
+class _inflater:
+    '''
+    Servers send deflate both raw and with a zlib header; the first chunk
+    tells which.
+    '''
+    def __init__(self):
+        self.decoder = None
+
+    def decompress(self, data):
+        if self.decoder == None:
+            self.decoder = zlib.decompressobj()
+            try: return self.decoder.decompress(data)
+            except zlib.error: self.decoder = zlib.decompressobj(-zlib.MAX_WBITS)
+        return self.decoder.decompress(data)
 
-    try:
-        encoding = response.info().getheader('Content-Encoding')
-    except:
-        encoding = None
-    if encoding == 'gzip':
-        result = gzip.GzipFile(fileobj=StringIO.StringIO(result)).read()
 
-    return result
+def transfer():
+    '''
+    (bytes read, bytes left unread because stop_when matched) for the last
+    body the calling thread read; saved is 0 when the length was unknown.
+    '''
+    return getattr(_transfer, 'last', (0, 0))
 
 def parseDOM(html, name='', attrs=None, ret=False):
     if attrs: attrs = dict((key, re.compile(value + ('$' if value else ''))) for key, value in attrs.iteritems())
@@ -386,7 +709,7 @@ class cfcookie:
             _add_request_header(request, headers)
 
             try:
-                response = urllib2.urlopen(request, timeout=int(timeout))
+                response = urlopen(request, timeout=int(timeout))
             except urllib2.HTTPError as response:
                 result = response.read(5242880)
                 try: encoding = response.info().getheader('Content-Encoding')
@@ -422,14 +745,12 @@ class cfcookie:
                 time.sleep(6)
 
             cookies = cookielib.LWPCookieJar()
-            handlers = [urllib2.HTTPHandler(), urllib2.HTTPSHandler(), urllib2.HTTPCookieProcessor(cookies)]
-            opener = urllib2.build_opener(*handlers)
-            opener = urllib2.install_opener(opener)
 
             try:
                 request = urllib2.Request(query)
                 _add_request_header(request, headers)
-                response = urllib2.urlopen(request, timeout=int(timeout))
+                request.cookiejar = cookies
+                response = urlopen(request, timeout=int(timeout))
             except:
                 pass
 
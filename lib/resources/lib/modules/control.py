@@ -120,6 +120,16 @@ bookmarksFile = os.path.join(dataPath, 'bookmarks.db')
 
 providercacheFile = os.path.join(dataPath, 'providers.13.db')
 
+providermanifestFile = os.path.join(dataPath, 'providers.1.json')
+
+hostregistryFile = os.path.join(dataPath, 'hosts.1.json')
+
+httpcacheFile = os.path.join(dataPath, 'http.1.db')
+
+hostguardFile = os.path.join(dataPath, 'hostguard.1.json')
+
+dnscacheFile = os.path.join(dataPath, 'dns.1.json')
+
 metacacheFile = os.path.join(dataPath, 'meta.5.db')
 
 searchFile = os.path.join(dataPath, 'search.1.db')
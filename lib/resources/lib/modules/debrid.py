@@ -17,6 +17,12 @@
     along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
+import threading,time
+
+try: from sqlite3 import dbapi2 as database
+except: from pysqlite2 import dbapi2 as database
+
+from resources.lib.modules import control
 from resources.lib.modules import log_utils
 
 try:
@@ -34,10 +40,100 @@ except:
     debrid_resolvers = []
 
 
+# host -> names of the debrid resolvers that accept it, shared by every consumer in this process
+host_map = {}
+host_lock = threading.Lock()
+host_loaded = False
+
+# How long a persisted host answer is trusted, in seconds
+host_ttl = 24 * 3600
+
+
 def status():
     return debrid_resolvers != []
 
 
+def valid_hosts(host):
+    '''
+    Names of the debrid resolvers that accept links on host. Resolver plugin
+    code runs once per host; later lookups are a dict hit.
+    '''
+    global host_loaded
+
+    if not debrid_resolvers: return []
+
+    try: return host_map[host]
+    except KeyError: pass
+
+    with host_lock:
+        if not host_loaded:
+            host_loaded = True
+            _load_hosts()
+        if host in host_map: return host_map[host]
+
+    names = []
+    for d in debrid_resolvers:
+        try:
+            if d.valid_url('', host): names.append(d.name)
+        except:
+            pass
+
+    with host_lock:
+        host_map[host] = names
+        _pending.append(host)
+    return names
+
+
+def valid(host, debrid=None):
+    names = valid_hosts(host)
+    if debrid == None: return names != []
+    return debrid in names
+
+
+_pending = []
+
+
+def _key():
+    return ','.join(sorted([d.name for d in debrid_resolvers]))
+
+
+def _load_hosts():
+    if control.setting('debrid.hostcache') == 'false': return
+    try:
+        dbcon = database.connect(control.providercacheFile)
+        dbcur = dbcon.cursor()
+        dbcur.execute("SELECT host, debrid FROM rel_debrid WHERE resolvers = ? AND added > ?", (_key(), int(time.time()) - host_ttl))
+        for host, names in dbcur.fetchall():
+            host_map[host] = [i for i in names.split(',') if i]
+    except:
+        pass
+
+
+def save_hosts():
+    '''
+    Persist host answers learned in this process so the next invocation
+    can skip the resolver calls.
+    '''
+    global _pending
+
+    if control.setting('debrid.hostcache') == 'false': return
+    with host_lock:
+        hosts, _pending = _pending, []
+        rows = [(i, ','.join(host_map[i])) for i in hosts]
+    if not rows: return
+
+    try:
+        control.makeFile(control.dataPath)
+        dbcon = database.connect(control.providercacheFile)
+        dbcur = dbcon.cursor()
+        dbcur.execute("CREATE TABLE IF NOT EXISTS rel_debrid (""host TEXT, ""resolvers TEXT, ""debrid TEXT, ""added INTEGER, ""UNIQUE(host, resolvers)"");")
+        key = _key() ; now = int(time.time())
+        dbcur.executemany("INSERT OR REPLACE INTO rel_debrid Values (?, ?, ?, ?)", [(i[0], key, i[1], now) for i in rows])
+        dbcon.commit()
+    except:
+        pass
+
+
 def resolver(url, debrid):
     try:
         debrid_resolver = [resolver for resolver in debrid_resolvers if resolver.name == debrid][0]
@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+
+'''
+    Covenant Add-on
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+
+import os,json,time,socket,threading
+
+
+'''
+Host name lookups shared by every connection the keepalive handlers open.
+Answers are kept ttl seconds and failures negative_ttl seconds; a lookup
+already running for a host is waited on rather than repeated, and never
+for longer than the connect timeout. save() keeps the most used hosts on
+disk so a cold plugin start skips their lookups.
+'''
+
+ttl = 300
+negative_ttl = 60
+
+# Hosts kept by save(), and how long a saved answer is trusted
+persist_limit = 100
+persist_ttl = 6 * 3600
+
+lock = threading.Lock()
+entries = {}
+pending = {}
+loaded = False
+
+
+def resolve(host, port, timeout=None):
+    '''
+    getaddrinfo results for host with port filled in. Raises socket.gaierror
+    for hosts that do not resolve and socket.timeout when the lookup takes
+    longer than timeout.
+    '''
+    host = host.lower()
+
+    with lock:
+        _load()
+        entry = _fresh(host)
+        if entry == None:
+            event = pending.get(host)
+            if event == None:
+                event = pending[host] = threading.Event()
+                t = threading.Thread(target=_lookup, args=(host, event))
+                t.daemon = True
+                t.start()
+
+    if entry == None:
+        event.wait(timeout)
+        with lock: entry = _fresh(host)
+        if entry == None: raise socket.timeout('lookup of %s timed out' % host)
+
+    if entry['addresses'] == None: raise socket.gaierror(socket.EAI_NONAME, 'lookup of %s failed' % host)
+
+    entry['hits'] += 1
+    return [(i[0], i[1], i[2], i[3], tuple([i[4][0], port] + list(i[4][2:]))) for i in entry['addresses']]
+
+
+def forget(host):
+    '''
+    Drop host's answer, e.g. when none of its addresses would connect.
+    '''
+    with lock: entries.pop(host.lower(), None)
+
+
+def forked():
+    '''
+    Start over on pending lookups in a forked process; the threads running
+    them, and any that held lock, stayed in the parent.
+    '''
+    global lock
+
+    lock = threading.Lock()
+    pending.clear()
+
+
+def _fresh(host):
+    entry = entries.get(host)
+    if not entry == None and entry['expires'] > time.time(): return entry
+
+
+def _lookup(host, event):
+    try:
+        addresses = socket.getaddrinfo(host, 80, 0, socket.SOCK_STREAM)
+        addresses = [(i[0], i[1], i[2], i[3], tuple(i[4])) for i in addresses]
+        expires = time.time() + ttl
+    except:
+        addresses = None
+        expires = time.time() + negative_ttl
+
+    with lock:
+        hits = entries.get(host, {}).get('hits', 0)
+        entries[host] = {'addresses': addresses, 'expires': expires, 'resolved': time.time(), 'hits': hits}
+        del pending[host]
+    event.set()
+
+
+def _path():
+    try:
+        from resources.lib.modules import control
+        control.makeFile(control.dataPath)
+        return control.dnscacheFile
+    except:
+        return None
+
+
+def _load():
+    global loaded
+
+    if loaded: return
+    loaded = True
+
+    try:
+        f = open(_path(), 'r')
+        try: data = json.load(f)
+        finally: f.close()
+    except:
+        return
+
+    now = time.time()
+    for host, i in data.items():
+        if now - i['resolved'] > persist_ttl: continue
+        addresses = [(a[0], a[1], a[2], a[3], tuple(a[4])) for a in i['addresses']]
+        entries[str(host)] = {'addresses': addresses, 'expires': i['resolved'] + persist_ttl, 'resolved': i['resolved'], 'hits': 0}
+
+
+def save():
+    '''
+    Write the persist_limit most used resolved hosts to disk.
+    '''
+    try:
+        with lock:
+            _load()
+            hosts = sorted([i for i in entries.items() if not i[1]['addresses'] == None], key=lambda i: -i[1]['hits'])
+            data = dict([(k, {'addresses': v['addresses'], 'resolved': v['resolved']}) for k, v in hosts[:persist_limit]])
+
+        path = _path()
+        f = open(path + '.tmp', 'w')
+        try: json.dump(data, f)
+        finally: f.close()
+        try: os.rename(path + '.tmp', path)
+        except OSError: os.remove(path) ; os.rename(path + '.tmp', path)
+    except:
+        pass
@@ -0,0 +1,286 @@
+# -*- coding: utf-8 -*-
+
+'''
+    Covenant Add-on
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+
+import os,sys,time,types,logging,threading
+from xml.dom import minidom
+
+
+# Stand-ins for the Kodi python modules so the scrapers can run from a plain
+# interpreter. Only what the add-on touches is provided; dialogs and
+# playback do nothing, settings come from a Kodi style settings.xml.
+
+addon_id = 'plugin.video.covenant'
+addon_name = 'Covenant'
+addon_path = os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))))
+
+home = os.path.join(os.path.expanduser('~'), '.covenant')
+
+settings_file = None
+settings_store = {}
+settings_lock = threading.Lock()
+
+
+def install(settings=None, profile=None):
+    '''
+    Register the stand-ins under the xbmc module names. Does nothing inside
+    Kodi, where the real modules import.
+    '''
+    global home, settings_file
+
+    try:
+        import xbmc
+        return getattr(xbmc, 'headless', False)
+    except ImportError:
+        pass
+
+    if not profile == None: home = os.path.abspath(profile)
+    settings_file = settings or os.path.join(home, 'addon_data', addon_id, 'settings.xml')
+    _loadSettings()
+
+    for name, attrs in [('xbmc', _xbmc), ('xbmcaddon', _xbmcaddon), ('xbmcgui', _xbmcgui), ('xbmcplugin', _xbmcplugin), ('xbmcvfs', _xbmcvfs)]:
+        module = types.ModuleType(name)
+        module.__dict__.update(attrs())
+        module.headless = True
+        sys.modules[name] = module
+
+    return True
+
+
+def translatePath(path):
+    # special://profile, special://home and friends all live under home
+    if path.startswith('special://'):
+        path = path[len('special://'):].split('/')
+        if path[0] in ['profile', 'masterprofile', 'home', 'userdata']: path = path[1:]
+        path = os.path.join(home, *path)
+    return path
+
+
+def _loadSettings():
+    settings_store.clear()
+    try:
+        for i in minidom.parse(settings_file).getElementsByTagName('setting'):
+            value = i.getAttribute('value') if i.hasAttribute('value') else ''.join([x.data for x in i.childNodes if x.nodeType == x.TEXT_NODE])
+            settings_store[i.getAttribute('id')] = value
+    except:
+        pass
+
+
+def _saveSettings():
+    try:
+        doc = minidom.Document()
+        root = doc.createElement('settings')
+        doc.appendChild(root)
+        for k in sorted(settings_store):
+            i = doc.createElement('setting')
+            i.setAttribute('id', k) ; i.setAttribute('value', settings_store[k])
+            root.appendChild(i)
+        if not os.path.exists(os.path.dirname(settings_file)): os.makedirs(os.path.dirname(settings_file))
+        f = open(settings_file, 'w')
+        try: f.write(doc.toprettyxml(encoding='utf-8'))
+        finally: f.close()
+    except:
+        pass
+
+
+class _nothing(object):
+    '''
+    Accepts any call and attribute; every method returns None.
+    '''
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: None
+
+
+class Addon(object):
+    def __init__(self, id=None):
+        self.id = id or addon_id
+
+    def getSetting(self, id):
+        return settings_store.get(id, '')
+
+    def setSetting(self, id, value):
+        with settings_lock:
+            settings_store[id] = value
+            _saveSettings()
+
+    def getLocalizedString(self, id):
+        return u''
+
+    def getAddonInfo(self, id):
+        return {'id': self.id, 'name': addon_name, 'version': '0', 'path': addon_path,
+                'profile': 'special://profile/addon_data/%s/' % self.id,
+                'icon': os.path.join(addon_path, 'icon.png'), 'fanart': os.path.join(addon_path, 'fanart.jpg')}.get(id, '')
+
+    def openSettings(self):
+        pass
+
+
+class Window(object):
+    properties = {}
+
+    def __init__(self, id=10000):
+        self.id = id
+
+    def getProperty(self, key):
+        return self.properties.get((self.id, key), '')
+
+    def setProperty(self, key, value):
+        self.properties[(self.id, key)] = value
+
+    def clearProperty(self, key):
+        self.properties.pop((self.id, key), None)
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: None
+
+
+class Dialog(_nothing):
+    def yesno(self, *args, **kwargs):
+        return False
+
+    def select(self, *args, **kwargs):
+        return -1
+
+
+class DialogProgress(_nothing):
+    def iscanceled(self):
+        return False
+
+
+class Keyboard(_nothing):
+    def isConfirmed(self):
+        return False
+
+    def getText(self):
+        return ''
+
+
+class Player(_nothing):
+    def isPlaying(self):
+        return False
+
+    def isPlayingVideo(self):
+        return False
+
+
+class File(object):
+    def __init__(self, path, mode='r'):
+        self.f = open(path, 'wb' if mode == 'w' else 'rb')
+
+    def read(self, *args):
+        return self.f.read(*args)
+
+    def write(self, data):
+        self.f.write(data) ; return True
+
+    def size(self):
+        return os.fstat(self.f.fileno()).st_size
+
+    def close(self):
+        self.f.close()
+
+
+def _log(msg, level=0):
+    logging.getLogger(addon_id).log({0: logging.DEBUG, 1: logging.INFO, 2: logging.INFO, 3: logging.WARNING, 4: logging.ERROR, 5: logging.CRITICAL, 6: logging.CRITICAL}.get(level, logging.DEBUG), msg)
+
+
+def _mkdir(path):
+    try: os.makedirs(path)
+    except: pass
+    return os.path.isdir(path)
+
+
+def _delete(path):
+    try: os.remove(path) ; return True
+    except: return False
+
+
+def _rmdir(path):
+    try: os.rmdir(path) ; return True
+    except: return False
+
+
+def _listdir(path):
+    names = os.listdir(path)
+    return [i for i in names if os.path.isdir(os.path.join(path, i))], [i for i in names if not os.path.isdir(os.path.join(path, i))]
+
+
+def _xbmc():
+    return {
+        'LOGDEBUG': 0, 'LOGINFO': 1, 'LOGNOTICE': 2, 'LOGWARNING': 3, 'LOGERROR': 4, 'LOGSEVERE': 5, 'LOGFATAL': 6, 'LOGNONE': 7,
+        'PLAYLIST_MUSIC': 0, 'PLAYLIST_VIDEO': 1, 'ISO_639_1': 0, 'ISO_639_2': 1, 'ENGLISH_NAME': 2,
+        'abortRequested': False,
+        'log': _log,
+        'sleep': lambda ms: time.sleep(ms / 1000.0),
+        'translatePath': translatePath,
+        'makeLegalFilename': lambda path: path,
+        'executebuiltin': lambda *args: None,
+        'executeJSONRPC': lambda *args: '{"result": {}}',
+        'getInfoLabel': lambda *args: '',
+        'getCondVisibility': lambda *args: False,
+        'getLocalizedString': lambda id: u'',
+        'getSkinDir': lambda: 'skin.estuary',
+        'getLanguage': lambda *args: 'English',
+        'convertLanguage': lambda language, format: 'en',
+        'Player': Player,
+        'PlayList': _nothing,
+        'Keyboard': Keyboard,
+        'Monitor': _nothing}
+
+
+def _xbmcaddon():
+    return {'Addon': Addon}
+
+
+def _xbmcgui():
+    return {
+        'NOTIFICATION_INFO': 'info', 'NOTIFICATION_WARNING': 'warning', 'NOTIFICATION_ERROR': 'error',
+        'Window': Window,
+        'WindowDialog': _nothing,
+        'Dialog': Dialog,
+        'DialogProgress': DialogProgress,
+        'DialogProgressBG': DialogProgress,
+        'ControlButton': _nothing,
+        'ControlImage': _nothing,
+        'ListItem': _nothing,
+        'getCurrentWindowId': lambda: 10000,
+        'getCurrentWindowDialogId': lambda: 9999}
+
+
+def _xbmcplugin():
+    return {
+        'addDirectoryItem': lambda *args, **kwargs: True,
+        'endOfDirectory': lambda *args, **kwargs: None,
+        'setContent': lambda *args, **kwargs: None,
+        'setProperty': lambda *args, **kwargs: None,
+        'setResolvedUrl': lambda *args, **kwargs: None}
+
+
+def _xbmcvfs():
+    return {
+        'File': File,
+        'exists': os.path.exists,
+        'mkdir': _mkdir,
+        'mkdirs': _mkdir,
+        'delete': _delete,
+        'rmdir': _rmdir,
+        'listdir': _listdir}
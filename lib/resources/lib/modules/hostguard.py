@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+
+'''
+    Covenant Add-on
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+
+import os,json,time,socket,urllib2,urlparse,threading
+
+from resources.lib.modules import workers
+
+
+'''
+Per host token bucket and circuit breaker for client.open_url. Requests to
+a host in rate_limits wait for a token, and a host answering 429 or 503
+with Retry-After is left alone that long. After failure_threshold connect
+failures or 5xx answers in a row the host fails fast for cooldown seconds,
+then one request is let through to probe it. Open circuits are kept on disk so the next
+plugin invocation does not rediscover a dead mirror the slow way.
+'''
+
+# Requests per second and burst by host, from each API's published limit;
+# hosts not listed get default_rate, None for no limit
+default_rate = None
+rate_limits = {
+    'api.trakt.tv': (1000 / 300.0, 1000),   # 1000 calls per 5 minutes
+    'api.themoviedb.org': (4, 40),          # 40 calls per 10 seconds
+    'api.tvmaze.com': (2, 20),              # 20 calls per 10 seconds
+}
+
+# Longest a 429 or 503 Retry-After holds a host
+max_pause = 60
+
+failure_threshold = 5
+cooldown = 300
+
+# How long other requests fail fast while one probes a cooled down host
+probe_window = 30
+
+lock = threading.Lock()
+buckets = {}
+paused = {}
+circuits = None
+
+
+class CircuitOpen(urllib2.URLError):
+    pass
+
+
+class ConnectError(socket.error):
+    '''
+    Raised by the HTTP engines when a host could not be reached at all: its
+    name did not resolve or the connect failed or timed out. These are the
+    errors record() is told about; a host that answers slowly is not down.
+    '''
+    pass
+
+
+def host(request):
+    url = request if isinstance(request, basestring) else request.get_full_url()
+    return urlparse.urlparse(url).netloc.lower()
+
+
+def acquire(host, timeout=None):
+    '''
+    Wait for a token for host. Raises CircuitOpen when the host is failing,
+    or when the wait would outlast timeout.
+    '''
+    now = time.time()
+
+    with lock:
+        _load()
+        c = circuits.get(host)
+        if not c == None and c[1] > now:
+            raise CircuitOpen('circuit open for %s, %d s left' % (host, c[1] - now))
+        if not c == None and c[0] >= failure_threshold:
+            c[1] = now + probe_window
+
+        wait = max(paused.get(host, 0) - now, 0)
+
+        limit = rate_limits.get(host, default_rate)
+        if not limit == None:
+            rate, burst = limit
+            b = buckets.setdefault(host, [burst, now])
+            b[0] = min(burst, b[0] + (now - b[1]) * rate) - 1
+            b[1] = now
+            wait = max(-b[0] / float(rate), wait)
+
+    if not timeout == None and wait > float(timeout):
+        raise CircuitOpen('rate limited for %s, %d s wait' % (host, wait))
+
+    deadline = now + wait
+    while time.time() < deadline:
+        if workers.cancelled(): break
+        time.sleep(min(0.25, deadline - time.time()))
+
+
+def record(host, code=None, headers=None):
+    '''
+    Outcome of a request to host: an HTTP status, or None when it could not
+    connect. Cancelled jobs tell nothing about the host and are ignored.
+    '''
+    if workers.cancelled(): return
+
+    if code in [429, 503]:
+        try:
+            retry = min(int(headers.getheader('Retry-After')), max_pause)
+            with lock: paused[host] = time.time() + retry
+        except:
+            pass
+
+    failed = code == None or code >= 500
+
+    with lock:
+        _load()
+        c = circuits.get(host)
+        if not failed:
+            if c == None: return
+            del circuits[host]
+            changed = c[0] >= failure_threshold
+        else:
+            c = circuits.setdefault(host, [0, 0])
+            c[0] += 1
+            changed = c[0] >= failure_threshold
+            if changed: c[1] = time.time() + cooldown
+
+        if changed: _save()
+
+
+def reset(host=None):
+    with lock:
+        _load()
+        if host == None: circuits.clear()
+        else: circuits.pop(host, None)
+        _save()
+
+
+def _path():
+    try:
+        from resources.lib.modules import control
+        control.makeFile(control.dataPath)
+        return control.hostguardFile
+    except:
+        return None
+
+
+def _load():
+    global circuits
+
+    if not circuits == None: return
+    circuits = {}
+
+    try:
+        f = open(_path(), 'r')
+        try: data = json.load(f)
+        finally: f.close()
+        now = time.time()
+        circuits.update(dict([(str(k), v) for k, v in data.items() if v[1] > now]))
+    except:
+        pass
+
+
+def _save():
+    # Only open circuits are worth keeping; counts below the threshold are per process
+    try:
+        path = _path()
+        data = dict([(k, v) for k, v in circuits.items() if v[0] >= failure_threshold])
+        f = open(path + '.tmp', 'w')
+        try: json.dump(data, f)
+        finally: f.close()
+        try: os.rename(path + '.tmp', path)
+        except OSError: os.remove(path) ; os.rename(path + '.tmp', path)
+    except:
+        pass
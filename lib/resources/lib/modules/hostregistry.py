@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+
+'''
+    Covenant Add-on
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+
+import json,threading
+
+from resources.lib.modules import control
+
+
+premium = ['1fichier.com', 'oboom.com', 'rapidgator.net', 'rg.to', 'uploaded.net', 'uploaded.to', 'ul.to', 'filefactory.com', 'nitroflare.com', 'turbobit.net', 'uploadrocket.net']
+
+captcha = ['hugefiles.net', 'kingfiles.net', 'openload.io', 'openload.co', 'oload.tv', 'thevideo.me', 'vidup.me', 'streamin.to', 'torba.se']
+
+hq = ['gvideo', 'google.com', 'openload.io', 'openload.co', 'oload.tv', 'thevideo.me', 'rapidvideo.com', 'raptu.com', 'filez.tv', 'uptobox.com', 'uptobox.com', 'uptostream.com', 'xvidstage.com', 'streamango.com']
+
+blocked = []
+
+PREMIUM, CAPTCHA, HQ, BLOCKED = 1, 2, 4, 8
+
+resolver_hosts = None
+lock = threading.Lock()
+
+
+class hostlist(list):
+    '''
+    A list of host names that answers "host in hosts" from a frozenset and
+    subdomains from a reversed-label suffix index. Providers still get a
+    plain list to iterate, index, concatenate or extend.
+    '''
+    def __init__(self, hosts=()):
+        list.__init__(self, hosts)
+        self._reindex()
+
+    def _reindex(self):
+        self.members = frozenset(self)
+        self.suffixes = dict([(tuple(reversed(i.split('.'))), i) for i in self.members])
+
+    def __contains__(self, host):
+        return host in self.members
+
+    def match(self, host):
+        '''
+        The registered host that host is, or is a subdomain of, else None.
+        '''
+        matches = self.matches(host)
+        return matches[0] if matches else None
+
+    def matches(self, host):
+        '''
+        Every registered host that host is or is a subdomain of, longest
+        first.
+        '''
+        try: labels = tuple(reversed(host.lower().split('.')))
+        except: return []
+        return [self.suffixes[labels[:n]] for n in range(len(labels), 0, -1) if labels[:n] in self.suffixes]
+
+    def append(self, host):
+        list.append(self, host) ; self._reindex()
+
+    def extend(self, hosts):
+        list.extend(self, hosts) ; self._reindex()
+
+    def insert(self, i, host):
+        list.insert(self, i, host) ; self._reindex()
+
+    def remove(self, host):
+        list.remove(self, host) ; self._reindex()
+
+    def pop(self, *args):
+        r = list.pop(self, *args) ; self._reindex() ; return r
+
+    def __iadd__(self, hosts):
+        list.extend(self, hosts) ; self._reindex() ; return self
+
+    def __setitem__(self, i, host):
+        list.__setitem__(self, i, host) ; self._reindex()
+
+    def __delitem__(self, i):
+        list.__delitem__(self, i) ; self._reindex()
+
+    def __setslice__(self, i, j, hosts):
+        list.__setslice__(self, i, j, hosts) ; self._reindex()
+
+    def __delslice__(self, i, j):
+        list.__delslice__(self, i, j) ; self._reindex()
+
+
+class registry:
+    def __init__(self, hosts):
+        self.hostDict = hostlist(hosts)
+        self.hostprDict = hostlist(premium)
+        self.hostcapDict = hostlist(captcha)
+        self.hosthqDict = hostlist(hq)
+        self.hostblockDict = hostlist(blocked)
+
+        self.flagDict = {}
+        for flag, hosts in [(PREMIUM, premium), (CAPTCHA, captcha), (HQ, hq), (BLOCKED, blocked)]:
+            for i in hosts: self.flagDict[i] = self.flagDict.get(i, 0) | flag
+
+        self.flagged = hostlist(self.flagDict.keys())
+        self.flagCache = {}
+
+    def flags(self, host):
+        '''
+        PREMIUM | CAPTCHA | HQ | BLOCKED bits of host and of every host it is
+        a subdomain of, so a flagged domain flags all its subdomains.
+        '''
+        try: return self.flagCache[host]
+        except: pass
+        flags = 0
+        for i in self.flagged.matches(host): flags |= self.flagDict[i]
+        try: self.flagCache[host] = flags
+        except: pass
+        return flags
+
+
+def load():
+    '''
+    A fresh registry; the resolver host list behind it is computed once per
+    urlresolver version and kept on disk.
+    '''
+    global resolver_hosts
+
+    with lock:
+        if resolver_hosts == None:
+            resolver_hosts = _resolverHosts()
+
+    return registry(resolver_hosts)
+
+
+def _version():
+    try: return control.addon('script.module.urlresolver').getAddonInfo('version')
+    except: return None
+
+
+def _resolverHosts():
+    version = _version()
+
+    if not version == None:
+        try:
+            f = open(control.hostregistryFile, 'r')
+            try: data = json.load(f)
+            finally: f.close()
+            if data['version'] == version: return data['hosts']
+        except:
+            pass
+
+    try:
+        import urlresolver
+        hosts = urlresolver.relevant_resolvers(order_matters=True)
+        hosts = [i.domains for i in hosts if not '*' in i.domains]
+        hosts = [i.lower() for i in reduce(lambda x, y: x+y, hosts)]
+    except:
+        return []
+
+    seen = set() ; unique = []
+    for i in hosts:
+        if i in seen: continue
+        seen.add(i) ; unique.append(i)
+
+    if not version == None:
+        try:
+            control.makeFile(control.dataPath)
+            f = open(control.hostregistryFile, 'w')
+            try: json.dump({'version': version, 'hosts': unique}, f)
+            finally: f.close()
+        except:
+            pass
+
+    return unique
@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+
+'''
+    Covenant Add-on
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+
+import re,json,zlib,time,hashlib,threading,email.utils
+
+try: from sqlite3 import dbapi2 as database
+except: from pysqlite2 import dbapi2 as database
+
+from resources.lib.modules import control
+
+
+'''
+Disk cache of HTTP responses for client.request(..., cached=...). Freshness
+comes from Cache-Control and Expires, or from a TTL given by the caller;
+stale entries with an ETag or Last-Modified are revalidated and a 304
+serves the stored body. Bodies are kept zlib compressed and the least
+recently used entries go once the cache passes size_limit bytes.
+'''
+
+size_limit = 32 * 1024 * 1024
+
+# Request headers that do not change the answer; User-Agent is random
+ignored_headers = ['user-agent', 'host', 'if-none-match', 'if-modified-since']
+
+# Response headers not worth keeping, or no longer true of the decoded body
+dropped_headers = ['content-encoding', 'content-length', 'transfer-encoding', 'connection', 'keep-alive', 'set-cookie']
+
+_lock = threading.RLock()
+_connection = None
+
+
+def _connect():
+    global _connection
+
+    if _connection == None:
+        control.makeFile(control.dataPath)
+        dbcon = database.connect(control.httpcacheFile, timeout=30, check_same_thread=False)
+        dbcon.execute("PRAGMA journal_mode=WAL")
+        dbcon.execute("PRAGMA synchronous=NORMAL")
+        dbcon.execute("CREATE TABLE IF NOT EXISTS http (""key TEXT PRIMARY KEY, ""url TEXT, ""code INTEGER, ""headers TEXT, ""body BLOB, ""size INTEGER, ""etag TEXT, ""modified TEXT, ""expires INTEGER, ""accessed REAL"");")
+        dbcon.execute("CREATE INDEX IF NOT EXISTS http_accessed ON http (accessed)")
+        dbcon.commit()
+        _connection = dbcon
+
+    return _connection
+
+
+def key(url, headers):
+    headers = sorted([(k.lower(), v) for k, v in (headers or {}).items() if not k.lower() in ignored_headers])
+    return hashlib.md5(repr((url, headers))).hexdigest()
+
+
+def get(key):
+    '''
+    The cached entry for key as a dict with body, code, headers, etag,
+    modified and fresh, or None.
+    '''
+    try:
+        with _lock:
+            dbcon = _connect()
+            match = dbcon.execute("SELECT code, headers, body, etag, modified, expires FROM http WHERE key = ?", (key,)).fetchone()
+            if match == None: return None
+            dbcon.execute("UPDATE http SET accessed = ? WHERE key = ?", (time.time(), key))
+            dbcon.commit()
+
+        return {'code': match[0], 'headers': json.loads(match[1]), 'body': zlib.decompress(str(match[2])),
+                'etag': match[3], 'modified': match[4], 'fresh': int(time.time()) < match[5]}
+    except:
+        return None
+
+
+def insert(key, url, code, headers, body, ttl=None):
+    '''
+    Store a 200 response. headers is the response's mimetools.Message; ttl
+    in seconds overrides whatever freshness the headers give.
+    '''
+    try:
+        expires = _expires(headers, ttl)
+        if expires == None: return
+
+        etag = headers.getheader('ETag')
+        modified = headers.getheader('Last-Modified')
+
+        # Already stale and nothing to revalidate with, so never of use
+        if expires <= int(time.time()) and etag == None and modified == None: return
+
+        h = json.dumps(dict([(k.title(), v) for k, v in headers.items() if not k.lower() in dropped_headers]))
+        body = zlib.compress(body)
+        size = len(body) + len(h) + len(url)
+        if size > size_limit: return
+
+        with _lock:
+            dbcon = _connect()
+            dbcon.execute("INSERT OR REPLACE INTO http Values (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", (key, url, code, h, database.Binary(body), size, etag, modified, expires, time.time()))
+            dbcon.commit()
+            _evict(dbcon)
+    except:
+        pass
+
+
+def revalidated(key, headers, ttl=None):
+    '''
+    A 304 came back for key: the stored body is good for another period
+    taken from the 304's headers.
+    '''
+    try:
+        expires = _expires(headers, ttl)
+        if expires == None: expires = int(time.time())
+
+        with _lock:
+            dbcon = _connect()
+            dbcon.execute("UPDATE http SET expires = ?, accessed = ?, etag = coalesce(?, etag) WHERE key = ?", (expires, time.time(), headers.getheader('ETag'), key))
+            dbcon.commit()
+    except:
+        pass
+
+
+def _evict(dbcon):
+    total = dbcon.execute("SELECT sum(size) FROM http").fetchone()[0] or 0
+    if total <= size_limit: return
+
+    # Down to 90% so a full cache does not evict on every write
+    target = total - int(size_limit * 0.9)
+    dropped = []
+    for k, size in dbcon.execute("SELECT key, size FROM http ORDER BY accessed").fetchall():
+        if target <= 0: break
+        dropped.append((k,)) ; target -= size
+
+    dbcon.executemany("DELETE FROM http WHERE key = ?", dropped)
+    dbcon.commit()
+
+
+def _expires(headers, ttl=None):
+    '''
+    Unix time the response stops being fresh, or None when it must not be
+    stored at all.
+    '''
+    now = int(time.time())
+
+    if not ttl == None: return now + int(ttl)
+
+    cc = dict([(i.group(1).lower(), i.group(2)) for i in re.finditer(r'([\w-]+)\s*(?:=\s*"?([^",]*)"?)?', headers.getheader('Cache-Control') or '')])
+
+    if 'no-store' in cc: return None
+    if 'no-cache' in cc: return now
+
+    age = 0
+    try: age = int(headers.getheader('Age'))
+    except: pass
+
+    try: return now + int(cc['max-age']) - age
+    except: pass
+
+    try:
+        expires = email.utils.mktime_tz(email.utils.parsedate_tz(headers.getheader('Expires')))
+        # Measured against the server's clock, not ours
+        try: expires = now + expires - email.utils.mktime_tz(email.utils.parsedate_tz(headers.getheader('Date')))
+        except: pass
+        return expires
+    except:
+        pass
+
+    return now
+
+
+def clear():
+    global _connection
+
+    with _lock:
+        try:
+            dbcon = _connect()
+            dbcon.execute("DROP TABLE IF EXISTS http")
+            dbcon.commit()
+            dbcon.execute("VACUUM")
+            dbcon.close()
+        except:
+            pass
+        _connection = None
@@ -0,0 +1,679 @@
+# -*- coding: utf-8 -*-
+
+'''
+    Covenant Add-on
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+
+import os,time,errno,socket,select,threading
+
+try: import ssl
+except ImportError: ssl = None
+
+try: import urlparse
+except ImportError: import urllib.parse as urlparse
+
+from resources.lib.modules import dnscache
+from resources.lib.modules import hostguard
+
+
+'''
+Event loop HTTP engine: many requests in flight on one thread, each with
+its own connect, read and total deadlines. Engine multiplexes non-blocking
+sockets with poll (select where there is no poll) and keeps connections
+alive per host. open() is what client.open_url calls when client.engine is
+'loop': provider threads hand their exchange to one shared engine thread
+and wait for it, so none of them sits in a blocking socket call.
+'''
+
+# Connections open at once per host, and how long an idle one is kept
+host_connections = 10
+max_idle = 30
+
+# Same cap client.request reads up to
+body_limit = 5242880
+
+max_redirects = 10
+
+_recv_size = 64 * 1024
+
+_in_progress = (errno.EINPROGRESS, errno.EWOULDBLOCK, errno.EALREADY, getattr(errno, 'WSAEWOULDBLOCK', 10035))
+
+
+class Exchange:
+    '''
+    One request and, when done is set, its response: status, reason,
+    headers as (name, value) pairs and body, or error.
+    '''
+    def __init__(self, url, method='GET', headers=None, body=None, timeout=30, connect_timeout=None, deadline=None, limit=None):
+        u = urlparse.urlsplit(url)
+        self.url = url
+        self.scheme = u.scheme.lower()
+        self.host = u.hostname
+        self.port = u.port or (443 if self.scheme == 'https' else 80)
+        self.selector = (u.path or '/') + ('?' + u.query if u.query else '')
+        self.method = method
+        self.headers = dict(headers or {})
+        self.data = body
+        self.timeout = float(timeout)
+        self.connect_timeout = float(connect_timeout or timeout)
+        self.deadline = deadline
+        self.limit = body_limit if limit == None else limit
+
+        self.status = None
+        self.reason = ''
+        self.response_headers = []
+        self.body = None
+        self.error = None
+        self.cancelled = False
+        self.retried = False
+        self.done = threading.Event()
+
+    def key(self):
+        return (self.scheme, self.host, self.port)
+
+    def header(self, name):
+        name = name.lower()
+        for k, v in self.response_headers:
+            if k.lower() == name: return v
+
+    def message(self):
+        '''
+        The request bytes.
+        '''
+        headers = dict([(k.title(), v) for k, v in self.headers.items()])
+        if not 'Host' in headers: headers['Host'] = self.host if self.port in [80, 443] else '%s:%s' % (self.host, self.port)
+        if not self.data == None: headers['Content-Length'] = str(len(self.data))
+        head = '%s %s HTTP/1.1\r\n%s\r\n' % (self.method, self.selector, ''.join(['%s: %s\r\n' % i for i in headers.items()]))
+        return _bytes(head) + (_bytes(self.data) if self.data else b'')
+
+    def _deadline(self, timeout):
+        t = time.time() + timeout
+        return t if self.deadline == None else min(t, self.deadline)
+
+
+class _parser:
+    '''
+    Incremental HTTP/1.x response parser; feed() returns True once the
+    response is complete.
+    '''
+    def __init__(self, exchange):
+        self.exchange = exchange
+        self.buffer = b''
+        self.state = 'head'
+        self.remaining = None
+        self.parts = []
+        self.size = 0
+        self.keep = False
+        self.started = False
+
+    def feed(self, data):
+        self.started = True
+        self.buffer += data
+        while True:
+            if self.state == 'head':
+                i = self.buffer.find(b'\r\n\r\n')
+                if i < 0:
+                    if len(self.buffer) > 65536: raise ValueError('response head too long')
+                    return False
+                head, self.buffer = self.buffer[:i], self.buffer[i + 4:]
+                self._head(_text(head))
+
+            elif self.state in ['length', 'close']:
+                data, self.buffer = self.buffer, b''
+                if self.state == 'length':
+                    self.remaining -= len(data)
+                    if self.remaining < 0: data = data[:len(data) + self.remaining] ; self.remaining = 0
+                if self._add(data): return True
+                if self.state == 'length' and self.remaining == 0: return self._finish()
+                return False
+
+            elif self.state == 'chunk-size':
+                i = self.buffer.find(b'\r\n')
+                if i < 0: return False
+                line, self.buffer = self.buffer[:i], self.buffer[i + 2:]
+                self.remaining = int(line.split(b';')[0].strip() or b'0', 16)
+                self.state = 'chunk' if self.remaining > 0 else 'trailer'
+
+            elif self.state == 'chunk':
+                data = self.buffer[:self.remaining]
+                self.buffer = self.buffer[len(data):]
+                self.remaining -= len(data)
+                if self._add(data): return True
+                if self.remaining > 0: return False
+                self.state = 'chunk-end'
+
+            elif self.state == 'chunk-end':
+                if len(self.buffer) < 2: return False
+                self.buffer = self.buffer[2:]
+                self.state = 'chunk-size'
+
+            elif self.state == 'trailer':
+                i = self.buffer.find(b'\r\n')
+                if i < 0: return False
+                line, self.buffer = self.buffer[:i], self.buffer[i + 2:]
+                if not line: return self._finish()
+
+            else:
+                return True
+
+    def eof(self):
+        '''
+        The connection closed; True when that ends the response.
+        '''
+        if self.state == 'close': return self._finish(keep=False)
+        return False
+
+    def _head(self, head):
+        lines = head.split('\r\n')
+        version, status = lines[0].split(' ', 2)[:2]
+        reason = lines[0].split(' ', 2)[2] if len(lines[0].split(' ', 2)) > 2 else ''
+
+        headers = []
+        for line in lines[1:]:
+            if line[:1] in [' ', '\t'] and headers: headers[-1] = (headers[-1][0], headers[-1][1] + ' ' + line.strip())
+            elif ':' in line: headers.append((line.split(':', 1)[0].strip(), line.split(':', 1)[1].strip()))
+
+        status = int(status)
+        if 100 <= status < 200: return
+
+        e = self.exchange
+        e.status, e.reason, e.response_headers = status, reason, headers
+
+        connection = (e.header('Connection') or '').lower()
+        self.keep = (version == 'HTTP/1.1' and not connection == 'close') or connection == 'keep-alive'
+
+        if e.method == 'HEAD' or status in [204, 304]:
+            self.state = 'length' ; self.remaining = 0
+        elif 'chunked' in (e.header('Transfer-Encoding') or '').lower():
+            self.state = 'chunk-size'
+        elif not e.header('Content-Length') == None:
+            self.state = 'length' ; self.remaining = int(e.header('Content-Length'))
+        else:
+            self.state = 'close' ; self.keep = False
+
+        if self.state == 'length' and self.remaining == 0: self._finish()
+
+    def _add(self, data):
+        if data: self.parts.append(data) ; self.size += len(data)
+        if self.size >= self.exchange.limit:
+            # Cut short; whatever is left on the wire makes the connection useless
+            return self._finish(keep=False)
+        return False
+
+    def _finish(self, keep=True):
+        self.exchange.body = b''.join(self.parts)[:self.exchange.limit]
+        self.keep = self.keep and keep
+        self.state = 'done'
+        return True
+
+
+class _connection:
+    '''
+    A non-blocking socket going through resolve, connect, handshake, send
+    and receive for one exchange at a time.
+    '''
+    def __init__(self, engine, key):
+        self.engine = engine
+        self.key = key
+        self.sock = None
+        self.exchange = None
+        self.state = None
+        self.reused = False
+        self.idle_since = None
+
+    def start(self, exchange):
+        self.exchange = exchange
+        self.parser = _parser(exchange)
+        self.out = exchange.message()
+        self.deadline = exchange._deadline(exchange.connect_timeout)
+        if self.sock == None:
+            self.state = 'resolve'
+            self.addresses = None
+            self.step()
+        else:
+            self.reused = True
+            self.state = 'send'
+            self.deadline = exchange._deadline(exchange.timeout)
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def wants(self):
+        if self.state in ['connect', 'send', 'handshake-write']: return 'w'
+        if self.state in ['handshake-read', 'receive']: return 'r'
+
+    def step(self):
+        '''
+        Move on as far as the socket allows; raises on failure.
+        '''
+        if self.state == 'resolve':
+            try: self.addresses = dnscache.resolve(self.key[1], self.key[2], 0)
+            except socket.timeout: return
+            self._connect()
+
+        if self.state == 'connect':
+            err = self.sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+            if err in _in_progress: return
+            if not err == 0: raise socket.error(err, errno.errorcode.get(err, 'connect failed'))
+            if self.key[0] == 'https':
+                self.sock = self.engine._wrap(self.sock, self.key[1])
+                self.state = 'handshake-write'
+            else:
+                self.state = 'send'
+
+        if self.state in ['handshake-read', 'handshake-write']:
+            try:
+                self.sock.do_handshake()
+                self.state = 'send'
+            except Exception as e:
+                want = _want(e)
+                if want == None: raise
+                self.state = 'handshake-' + want
+                return
+
+        if self.state == 'send':
+            try:
+                sent = self.sock.send(self.out)
+                self.out = self.out[sent:]
+            except Exception as e:
+                if _want(e) == None and not getattr(e, 'errno', None) in _in_progress: raise
+                return
+            if self.out: return
+            self.state = 'receive'
+            self.deadline = self.exchange._deadline(self.exchange.timeout)
+
+        if self.state == 'receive':
+            while True:
+                try:
+                    data = self.sock.recv(_recv_size)
+                except Exception as e:
+                    if _want(e) == None and not getattr(e, 'errno', None) in _in_progress: raise
+                    return
+                if not data:
+                    if self.parser.eof(): return self._done()
+                    raise socket.error(errno.ECONNRESET, 'connection closed mid response')
+                self.deadline = self.exchange._deadline(self.exchange.timeout)
+                if self.parser.feed(data): return self._done()
+                # TLS may hold more decrypted data than the socket shows
+                if not getattr(self.sock, 'pending', lambda: 0)(): return
+
+    def _connect(self):
+        if not self.addresses: raise socket.gaierror('no address for %s' % self.key[1])
+        family, socktype, proto, canonname, address = self.addresses.pop(0)
+        self.sock = socket.socket(family, socktype, proto)
+        self.sock.setblocking(0)
+        try: self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        except: pass
+        err = self.sock.connect_ex(address)
+        if not err == 0 and not err in _in_progress: raise socket.error(err, errno.errorcode.get(err, 'connect failed'))
+        self.state = 'connect'
+
+    def _done(self):
+        e = self.exchange
+        self.exchange = None
+        self.reused = False
+        self.engine._finished(self, e, self.parser.keep)
+
+    def close(self):
+        try: self.sock.close()
+        except: pass
+        self.sock = None
+
+
+class Engine:
+    '''
+    Runs exchanges on whichever thread calls step(), run() or
+    as_completed(), or on a thread of its own after start(). add() and
+    cancel() are safe from any thread.
+    '''
+    def __init__(self, max_per_host=None, context=None):
+        self.max_per_host = max_per_host or host_connections
+        self.context = context
+        self.pid = os.getpid()
+        self.lock = threading.Lock()
+        self.incoming = []
+        self.queued = []
+        self.active = []
+        self.idle = {}
+        self.counts = {}
+        self.completed = []
+        self.waker = None
+        self.thread = None
+
+    def add(self, exchange):
+        with self.lock: self.incoming.append(exchange)
+        self._wake()
+        return exchange
+
+    def cancel(self, exchange):
+        exchange.cancelled = True
+        self._wake()
+
+    def busy(self):
+        return bool(self.incoming or self.queued or self.active)
+
+    def step(self, timeout=0.5):
+        '''
+        Wait up to timeout for socket events, act on them and return the
+        exchanges that finished.
+        '''
+        with self.lock:
+            incoming, self.incoming = self.incoming, []
+        self.queued += incoming
+
+        self._assign()
+
+        now = time.time()
+        readers, writers, waiting = [], [], False
+        for c in self.active:
+            want = c.wants()
+            if want == 'r': readers.append(c)
+            elif want == 'w': writers.append(c)
+            else: waiting = True
+            timeout = min(timeout, max(c.deadline - now, 0))
+        # Lookups run on dnscache threads; look again shortly
+        if waiting: timeout = min(timeout, 0.02)
+        if not self.waker == None: readers.append(self.waker[0])
+        elif not self.thread == None: timeout = min(timeout, 0.05)
+
+        for c in _poll(readers, writers, timeout):
+            if c is self.waker[0] if self.waker else False:
+                try: c.recv(4096)
+                except: pass
+                continue
+            self._step(c)
+
+        now = time.time()
+        for c in list(self.active):
+            if c.exchange == None: continue
+            if c.exchange.cancelled: self._fail(c, socket.error('cancelled'))
+            elif c.state == 'resolve': self._step(c)
+            elif c.deadline <= now: self._fail(c, socket.timeout('timed out'))
+
+        completed, self.completed = self.completed, []
+        return completed
+
+    def run(self, exchanges=(), deadline=None):
+        '''
+        Run until every exchange has finished or deadline passes; returns
+        the exchanges.
+        '''
+        return list(self.as_completed(exchanges, deadline))
+
+    def as_completed(self, exchanges, deadline=None):
+        '''
+        Add exchanges and yield each as it finishes. Those still running at
+        deadline are cancelled and yielded with a timeout error.
+        '''
+        left = set([id(i) for i in exchanges])
+        for i in exchanges: self.add(i)
+
+        while left:
+            timeout = 0.5 if deadline == None else max(0, min(0.5, deadline - time.time()))
+            for i in self.step(timeout):
+                if id(i) in left:
+                    left.discard(id(i))
+                    yield i
+            if not deadline == None and time.time() >= deadline and left:
+                for i in exchanges:
+                    if id(i) in left: i.cancelled = True ; i.timed_out = True
+
+    def start(self):
+        '''
+        Run the loop on a daemon thread from now on.
+        '''
+        with self.lock:
+            if not self.thread == None: return
+            try: self.waker = socket.socketpair()
+            except: self.waker = None
+            self.thread = threading.Thread(target=self._forever)
+            self.thread.daemon = True
+            self.thread.start()
+
+    def _forever(self):
+        while True:
+            try: self.step(0.5)
+            except: time.sleep(0.05)
+
+    def _wake(self):
+        if not self.waker == None:
+            try: self.waker[1].send(b'x')
+            except: pass
+
+    def _assign(self):
+        now = time.time()
+        queued, self.queued = self.queued, []
+        for e in queued:
+            if e.cancelled:
+                self._complete(e, socket.error('cancelled'))
+                continue
+
+            key = e.key()
+            c = None
+            while self.idle.get(key):
+                i = self.idle[key].pop()
+                if now - i.idle_since < max_idle: c = i ; break
+                self._drop(i)
+
+            if c == None and self.counts.get(key, 0) < self.max_per_host:
+                c = _connection(self, key)
+                self.counts[key] = self.counts.get(key, 0) + 1
+
+            if c == None:
+                self.queued.append(e)
+                continue
+
+            self.active.append(c)
+            try: c.start(e)
+            except Exception as err: self._fail(c, err)
+
+    def _step(self, c):
+        try: c.step()
+        except Exception as err:
+            # A connect that failed may still have other addresses to try
+            if c.state == 'connect' and c.addresses:
+                c.close()
+                try: c._connect() ; return
+                except Exception as err2: err = err2
+            self._fail(c, err)
+
+    def _fail(self, c, err):
+        e = c.exchange
+        c.exchange = None
+        if c in self.active: self.active.remove(c)
+        retry = c.reused and not c.parser.started and not e.retried and not e.cancelled and not isinstance(err, socket.timeout)
+        self._drop(c)
+        if e == None: return
+        if retry:
+            # The server closed a kept connection before answering; once more on a new one
+            e.retried = True
+            self.queued.append(e)
+            return
+        if getattr(e, 'timed_out', False): err = socket.timeout('deadline passed')
+        # Never got through to the host, which is what hostguard counts
+        if c.state in ['resolve', 'connect']: err = hostguard.ConnectError(*err.args)
+        self._complete(e, err)
+
+    def _finished(self, c, e, keep):
+        self.active.remove(c)
+        if keep:
+            c.idle_since = time.time()
+            self.idle.setdefault(c.key, []).append(c)
+        else:
+            self._drop(c)
+        self._complete(e, None)
+
+    def _drop(self, c):
+        c.close()
+        self.counts[c.key] = max(0, self.counts.get(c.key, 0) - 1)
+
+    def _complete(self, e, err):
+        e.error = err
+        e.done.set()
+        self.completed.append(e)
+
+    def _wrap(self, sock, host):
+        if ssl == None: raise socket.error('no ssl support')
+        # httplib's default, as keepalive uses when client passes no context
+        if self.context == None and hasattr(ssl, '_create_default_https_context'):
+            self.context = ssl._create_default_https_context()
+        if self.context == None:
+            return ssl.wrap_socket(sock, do_handshake_on_connect=False)
+        return self.context.wrap_socket(sock, server_hostname=host, do_handshake_on_connect=False)
+
+
+def _want(e):
+    '''
+    'read' or 'write' when e only means a non-blocking TLS socket has to
+    wait, else None.
+    '''
+    if ssl == None: return None
+    if isinstance(e, getattr(ssl, 'SSLWantReadError', ())): return 'read'
+    if isinstance(e, getattr(ssl, 'SSLWantWriteError', ())): return 'write'
+    if isinstance(e, ssl.SSLError) and e.args:
+        if e.args[0] == ssl.SSL_ERROR_WANT_READ: return 'read'
+        if e.args[0] == ssl.SSL_ERROR_WANT_WRITE: return 'write'
+    return None
+
+
+def _poll(readers, writers, timeout):
+    if not readers and not writers:
+        time.sleep(timeout)
+        return []
+
+    if hasattr(select, 'poll'):
+        p = select.poll()
+        fds = {}
+        for i in readers: fds[i.fileno()] = i ; p.register(i, select.POLLIN | select.POLLPRI)
+        for i in writers: fds[i.fileno()] = i ; p.register(i, select.POLLOUT)
+        try: events = p.poll(timeout * 1000)
+        except select.error: return []
+        return [fds[fd] for fd, event in events if fd in fds]
+
+    try: r, w, x = select.select(readers, writers, writers, timeout)
+    except select.error: return []
+    # Windows reports a refused connect as an exception, not as writable
+    return list(set(r + w + x))
+
+
+def _bytes(s):
+    if isinstance(s, bytes): return s
+    return s.encode('latin-1') if not str is bytes else s.encode('utf-8')
+
+
+def _text(b):
+    return b if str is bytes else b.decode('latin-1')
+
+
+shared = None
+shared_lock = threading.Lock()
+
+
+def engine(context=None):
+    '''
+    The shared engine thread behind open(), started anew in a forked
+    process.
+    '''
+    global shared
+
+    if not shared == None and not shared.pid == os.getpid(): forked()
+
+    with shared_lock:
+        if shared == None:
+            shared = Engine(context=context)
+            shared.start()
+        return shared
+
+
+def forked():
+    '''
+    Drop what a forked process inherits but cannot use: the shared engine,
+    whose thread stayed in the parent, the keep-alive pools, whose sockets
+    the parent goes on using, and host lookups running on parent threads.
+    '''
+    global shared, shared_lock
+
+    from resources.lib.modules import keepalive
+
+    shared, shared_lock = None, threading.Lock()
+    keepalive.forked()
+    dnscache.forked()
+
+
+def open(request, data=None, timeout=30, redirect=True, context=None):
+    '''
+    urllib2 OpenerDirector.open() on the shared engine: follows redirects
+    when redirect is True, keeps request.cookiejar up to date, returns an
+    addinfourl and raises HTTPError and URLError as urllib2 does.
+    '''
+    import urllib,urllib2,mimetools,StringIO
+    from resources.lib.modules import workers
+
+    if isinstance(request, basestring): request = urllib2.Request(request)
+    if not data == None: request.add_data(data)
+
+    for hop in range(max_redirects + 1):
+        jar = getattr(request, 'cookiejar', None)
+        if not jar == None: jar.add_cookie_header(request)
+
+        headers = dict(request.header_items())
+        if request.has_data() and not 'Content-type' in headers: headers['Content-type'] = 'application/x-www-form-urlencoded'
+
+        url = request.get_full_url()
+        e = Exchange(url, request.get_method(), headers, request.get_data(), timeout, getattr(request, 'connect_timeout', None), getattr(request, 'deadline', None), getattr(request, 'read_limit', None))
+        loop = engine(context)
+        loop.add(e)
+
+        while not e.done.wait(0.1):
+            if workers.cancelled(): loop.cancel(e)
+
+        if not e.error == None: raise urllib2.URLError(e.error)
+
+        info = mimetools.Message(StringIO.StringIO(''.join(['%s: %s\r\n' % i for i in e.response_headers])))
+        response = urllib.addinfourl(StringIO.StringIO(e.body), info, url, e.status)
+        response.msg = e.reason
+        if not jar == None: jar.extract_cookies(response, request)
+
+        location = info.getheader('Location') or info.getheader('Uri')
+        if e.status in [301, 302, 303, 307, 308] and location:
+            if not redirect == True: return response
+            new = _redirect(request, e.status, urlparse.urljoin(url, location))
+            if not new == None:
+                request = new
+                continue
+
+        if 200 <= e.status < 300: return response
+        raise urllib2.HTTPError(url, e.status, e.reason, info, StringIO.StringIO(e.body))
+
+    raise urllib2.URLError('too many redirects: %s' % request.get_full_url())
+
+
+def _redirect(request, code, newurl):
+    import urllib2
+
+    method = request.get_method()
+    if code in [307, 308]: data = request.get_data()
+    elif method in ['GET', 'HEAD'] or code in [301, 302, 303]: data = None
+    else: return None
+
+    newurl = newurl.replace(' ', '%20')
+    dropped = ['content-length', 'content-type'] if data == None else []
+    headers = dict([(k, v) for k, v in request.headers.items() if not k.lower() in dropped])
+    new = urllib2.Request(newurl, data=data, headers=headers, origin_req_host=request.get_origin_req_host(), unverifiable=True)
+    for i in ['cookiejar', 'connect_timeout', 'deadline', 'read_limit']:
+        if hasattr(request, i): setattr(new, i, getattr(request, i))
+    return new
@@ -21,6 +21,12 @@
 #  - fix for digest auth (inspired from urllib2.py @ Python v2.4)
 # Modified by Dirkjan Ochtman:
 #  - import md5 function from a local util module
+# Modified for Covenant:
+#  - HTTPS handler, connect timeouts, per host connection cap, idle eviction
+#  - only connections whose response was read to the end are reused
+#  - separate connect and read timeouts, host lookups through dnscache
+#  - sockets registered with the running workers job, so cancelling it
+#    stops a connect or a wait for the answer
 
 """An HTTP handler for urllib2 that supports HTTP 1.1 and keepalive.
 
@@ -110,6 +116,12 @@ import urllib2
 import httplib
 import socket
 import thread
+import time
+import weakref
+
+from resources.lib.modules import dnscache
+from resources.lib.modules import hostguard
+from resources.lib.modules import workers
 
 DEBUG = None
 
@@ -127,6 +139,7 @@ class ConnectionManager:
         self._hostmap = {} # map hosts to a list of connections
         self._connmap = {} # map connections to host
         self._readymap = {} # map connection to ready state
+        self._idlemap = {} # map connection to the time it became ready
 
     def add(self, host, connection, ready):
         self._lock.acquire()
@@ -148,37 +161,78 @@ class ConnectionManager:
             else:
                 del self._connmap[connection]
                 del self._readymap[connection]
+                self._idlemap.pop(connection, None)
                 self._hostmap[host].remove(connection)
                 if not self._hostmap[host]: del self._hostmap[host]
         finally:
             self._lock.release()
 
     def set_ready(self, connection, ready):
-        try: self._readymap[connection] = ready
-        except KeyError: pass
+        """returns False for a connection that is not pooled"""
+        self._lock.acquire()
+        try:
+            if not connection in self._readymap: return False
+            self._readymap[connection] = ready
+            if ready: self._idlemap[connection] = time.time()
+            return True
+        finally:
+            self._lock.release()
 
-    def get_ready_conn(self, host):
+    def get_ready_conn(self, host, max_idle=None):
+        """a ready connection to host, closing any idle for more than
+        max_idle seconds on the way"""
         conn = None
+        stale = []
         self._lock.acquire()
         try:
             if host in self._hostmap:
-                for c in self._hostmap[host]:
-                    if self._readymap[c]:
-                        self._readymap[c] = 0
-                        conn = c
-                        break
+                now = time.time()
+                for c in list(self._hostmap[host]):
+                    if not self._readymap[c]: continue
+                    if max_idle and now - self._idlemap.get(c, now) > max_idle:
+                        stale.append(c)
+                        continue
+                    self._readymap[c] = 0
+                    conn = c
+                    break
         finally:
             self._lock.release()
+        for c in stale:
+            self.remove(c)
+            c.close()
         return conn
 
+    def count(self, host):
+        self._lock.acquire()
+        try: return len(self._hostmap.get(host, []))
+        finally: self._lock.release()
+
     def get_all(self, host=None):
         if host:
             return list(self._hostmap.get(host, []))
         else:
             return dict(self._hostmap)
 
+# every handler made, so a forked process can drop their pools
+_handlers = []
+
+def forked():
+    for h in _handlers: h.forget_all()
+
 class KeepAliveHandler:
-    def __init__(self):
+    def __init__(self, max_per_host=None, max_idle=None):
+        """max_per_host caps pooled connections to one host (busy requests
+        past the cap get a connection of their own that is not kept);
+        connections idle for more than max_idle seconds are closed instead
+        of reused"""
+        self._cm = ConnectionManager()
+        self._max_per_host = max_per_host
+        self._max_idle = max_idle
+        _handlers.append(self)
+
+    def forget_all(self):
+        """drop every pooled connection without closing it, for a forked
+        process whose parent still talks over the same sockets"""
         self._cm = ConnectionManager()
 
     #### Connection Management
@@ -202,10 +256,25 @@ class KeepAliveHandler:
                 self._cm.remove(h)
                 h.close()
 
-    def _request_closed(self, request, host, connection):
+    def _request_closed(self, request, host, connection, complete=True):
         """tells us that this request is now closed and the the
         connection is ready for another request"""
-        self._cm.set_ready(connection, 1)
+        connection._response = None
+        if complete and self._cm.set_ready(connection, 1):
+            # back in the pool for any job, so no longer this one's to abort
+            workers.release(connection.sock)
+            return
+        # unread body or an unpooled connection: nothing to keep
+        self._cm.remove(connection)
+        connection.close()
+
+    def _response_dropped(self, connection, ref):
+        """the response was collected without being closed: its body was
+        never read to the end, so the connection can't go back to the pool"""
+        if not getattr(connection, '_response', None) is ref: return
+        connection._response = None
+        self._cm.remove(connection)
+        connection.close()
 
     def _remove_connection(self, host, connection, close=0):
         if close: connection.close()
@@ -215,13 +284,23 @@ class KeepAliveHandler:
     def http_open(self, req):
         return self.do_open(HTTPConnection, req)
 
+    def _new_connection(self, http_class, host, req):
+        connect, read = _timeouts(req)
+        if connect is None: h = http_class(host)
+        else: h = http_class(host, timeout=connect)
+        h.read_timeout = read
+        return h
+
     def do_open(self, http_class, req):
         host = req.get_host()
         if not host:
             raise urllib2.URLError('no host given')
 
+        # http and https connections to one host are pooled apart
+        key = '%s://%s' % (req.get_type(), host)
+
         try:
-            h = self._cm.get_ready_conn(host)
+            h = self._cm.get_ready_conn(key, self._max_idle)
             while h:
                 r = self._reuse_connection(h, req, host)
 
@@ -233,13 +312,14 @@ class KeepAliveHandler:
                 # discard it and ask for the next free connection
                 h.close()
                 self._cm.remove(h)
-                h = self._cm.get_ready_conn(host)
+                h = self._cm.get_ready_conn(key, self._max_idle)
             else:
                 # no (working) free connections were found.  Create a new one.
-                h = http_class(host)
+                h = self._new_connection(http_class, host, req)
                 if DEBUG: DEBUG.info("creating new connection to %s (%d)",
                                      host, id(h))
-                self._cm.add(host, h, 0)
+                if not self._max_per_host or self._cm.count(key) < self._max_per_host:
+                    self._cm.add(key, h, 0)
                 self._start_transaction(h, req)
                 r = h.getresponse()
         except (socket.error, httplib.HTTPException), err:
@@ -248,9 +328,15 @@ class KeepAliveHandler:
         # if not a persistent connection, don't try to reuse it
         if r.will_close: self._cm.remove(h)
 
+        # a response dropped without close() would hold its connection busy
+        # against max_per_host for good; httplib's own reference to it keeps
+        # it alive through the pool, so leave the tracking to a weakref
+        h._HTTPConnection__response = None
+        h._response = weakref.ref(r, lambda ref: self._response_dropped(h, ref))
+
         if DEBUG: DEBUG.info("STATUS: %s, %s", r.status, r.reason)
         r._handler = self
-        r._host = host
+        r._host = key
         r._url = req.get_full_url()
         r._connection = h
         r.code = r.status
@@ -271,6 +357,10 @@ class KeepAliveHandler:
         will close and remove the connection before re-raising.
         """
         try:
+            timeout = _timeouts(req)[1]
+            if h.sock and not timeout is None:
+                h.sock.settimeout(timeout)
+            if h.sock: workers.register(h.sock)
             self._start_transaction(h, req)
             r = h.getresponse()
             # note: just because we got something back doesn't mean it
@@ -317,7 +407,22 @@ class KeepAliveHandler:
             raise urllib2.URLError(err)
 
 class HTTPHandler(KeepAliveHandler, urllib2.HTTPHandler):
-    pass
+    def __init__(self, max_per_host=None, max_idle=None):
+        KeepAliveHandler.__init__(self, max_per_host, max_idle)
+        urllib2.HTTPHandler.__init__(self)
+
+class HTTPSHandler(KeepAliveHandler, urllib2.HTTPSHandler):
+    def __init__(self, max_per_host=None, max_idle=None, context=None):
+        KeepAliveHandler.__init__(self, max_per_host, max_idle)
+        urllib2.HTTPSHandler.__init__(self)
+        self._context = context
+
+    def https_open(self, req):
+        return self.do_open(self._https_connection, req)
+
+    def _https_connection(self, host, **kwargs):
+        if self._context is not None: kwargs['context'] = self._context
+        return HTTPSConnection(host, **kwargs)
 
 class HTTPResponse(httplib.HTTPResponse):
     # we need to subclass HTTPResponse in order to
@@ -357,11 +462,26 @@ class HTTPResponse(httplib.HTTPResponse):
 
     def close(self):
         if self.fp:
+            # httplib closes the response itself once the body has been read
+            complete = self.length == 0 or (self.chunked and self._in_chunked)
             self.fp.close()
             self.fp = None
             if self._handler:
                 self._handler._request_closed(self, self._host,
-                                              self._connection)
+                                              self._connection, complete)
+
+    _in_chunked = False
+
+    def _read_chunked(self, amt):
+        # httplib closes from in here once the last chunk and trailer are read
+        self._in_chunked = True
+        try:
+            return httplib.HTTPResponse._read_chunked(self, amt)
+        except httplib.IncompleteRead:
+            if self._handler: self._handler._remove_connection(self._host, self._connection, close=1)
+            raise
+        finally:
+            self._in_chunked = False
 
     def close_connection(self):
         self._handler._remove_connection(self._host, self._connection, close=1)
@@ -417,9 +537,89 @@ class HTTPResponse(httplib.HTTPResponse):
         return list
 
 
+def _timeouts(req):
+    """(connect, read) timeouts for req: a connect_timeout it carries or
+    its timeout, and its timeout, both cut to what is left before its
+    deadline"""
+    timeout = getattr(req, 'timeout', None)
+    if timeout is socket._GLOBAL_DEFAULT_TIMEOUT: timeout = None
+    connect = getattr(req, 'connect_timeout', None) or timeout
+
+    deadline = getattr(req, 'deadline', None)
+    if deadline is not None:
+        left = max(deadline - time.time(), 0.01)
+        if connect is None or connect > left: connect = left
+        if timeout is None or timeout > left: timeout = left
+
+    return connect, timeout
+
+def create_connection(address, timeout=socket._GLOBAL_DEFAULT_TIMEOUT,
+                      source_address=None):
+    """socket.create_connection with the host looked up through dnscache;
+    the lookup counts against timeout like the connect does.  Failures
+    raise hostguard.ConnectError"""
+    host, port = address
+    lookup = None if timeout is socket._GLOBAL_DEFAULT_TIMEOUT else timeout
+    err = None
+    try: addresses = dnscache.resolve(host, port, lookup)
+    except socket.error, e: raise hostguard.ConnectError(*e.args)
+    for af, socktype, proto, canonname, sa in addresses:
+        sock = None
+        try:
+            sock = socket.socket(af, socktype, proto)
+            # before connecting, so a cancelled job stops the connect too
+            workers.register(sock)
+            if not timeout is socket._GLOBAL_DEFAULT_TIMEOUT:
+                sock.settimeout(timeout)
+            if source_address: sock.bind(source_address)
+            sock.connect(sa)
+            return sock
+        except socket.error, e:
+            err = e
+            if sock is not None: sock.close()
+
+    # none of the addresses took, so look the host up again next time
+    dnscache.forget(host)
+    if err is None: raise hostguard.ConnectError('getaddrinfo returns an empty list')
+    raise hostguard.ConnectError(*err.args)
+
 class HTTPConnection(httplib.HTTPConnection):
     # use the modified response class
     response_class = HTTPResponse
+    read_timeout = None
+
+    def __init__(self, *args, **kwargs):
+        httplib.HTTPConnection.__init__(self, *args, **kwargs)
+        self._create_connection = create_connection
+
+    def connect(self):
+        # timeout covers the connect, read_timeout every read after it
+        httplib.HTTPConnection.connect(self)
+        if self.read_timeout is not None: self.sock.settimeout(self.read_timeout)
+
+class HTTPSConnection(httplib.HTTPSConnection):
+    response_class = HTTPResponse
+    read_timeout = None
+    _raw = None
+
+    def __init__(self, *args, **kwargs):
+        httplib.HTTPSConnection.__init__(self, *args, **kwargs)
+        self._create_connection = self._create_raw
+
+    def _create_raw(self, *args):
+        self._raw = create_connection(*args)
+        return self._raw
+
+    def connect(self):
+        # the TLS handshake is part of connecting
+        httplib.HTTPSConnection.connect(self)
+        # the wrapped socket is a different object over the same one, so
+        # the job must hold the socket pooling releases later
+        if not self.sock is self._raw:
+            workers.release(self._raw)
+            workers.register(self.sock)
+        self._raw = None
+        if self.read_timeout is not None: self.sock.settimeout(self.read_timeout)
 
 #########################################################################
 #####   TEST FUNCTIONS
@@ -555,6 +755,48 @@ def test_timeout(url):
 
     DEBUG = dbbackup
 
+def test_release(url):
+    # a job done with a pooled connection must not hold its socket, or
+    # cancelling the job later breaks whichever job uses the connection next
+    if url.startswith('https'): handler = HTTPSHandler()
+    else: handler = HTTPHandler()
+    opener = urllib2.build_opener(handler)
+    held = []
+    def fetch():
+        fo = opener.open(url)
+        fo.read()
+        fo.close()
+        held.extend([i.fileno() for i in workers.current().resources
+                     if isinstance(i, socket.socket)])
+    pool = workers.Pool(1)
+    pool.submit(fetch)
+    pool.start()
+    pool.wait()
+    pooled = [c.sock.fileno() for conns in handler._cm.get_all().values()
+              for c in conns if c.sock]
+    if not pooled:
+        print '  ERROR: CONNECTION NOT POOLED'
+    elif [i for i in held if i in pooled]:
+        print '  ERROR: JOB STILL HOLDS THE POOLED SOCKET'
+    else:
+        print '  pooled socket released from the job'
+    handler.close_all()
+
+
+def test_dropped(url, N=4):
+    # responses dropped unread must give up their place against
+    # max_per_host, or the host ends up stuck at the cap
+    if url.startswith('https'): handler = HTTPSHandler(N)
+    else: handler = HTTPHandler(N)
+    opener = urllib2.build_opener(handler)
+    for i in range(N * 2): opener.open(url).read(1)
+    busy = sum([len(conns) for conns in handler._cm.get_all().values()])
+    if busy:
+        print '  ERROR: %d DROPPED CONNECTIONS STILL POOLED' % busy
+    else:
+        print '  dropped responses left the pool'
+    handler.close_all()
+
 
 def test(url, N=10):
     print "checking error hander (do this on a non-200)"
@@ -571,6 +813,12 @@ def test(url, N=10):
     print
     print "performing dropped-connection check"
     test_timeout(url)
+    print
+    print "performing job release check"
+    test_release(url)
+    print
+    print "performing dropped response check"
+    test_dropped(url)
 
 if __name__ == '__main__':
     import time
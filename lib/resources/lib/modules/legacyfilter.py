@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+
+'''
+    Covenant Add-on
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+
+import re,random
+
+from resources.lib.modules import control
+from resources.lib.modules import debrid
+from resources.lib.modules import source_utils
+
+
+# sources.sourcesFilter as it was before the single pass rewrite, kept so
+# covenant-bench --filter can check the two still agree. Call it with a
+# sources instance in place of self.
+
+
+def sourcesFilter(self):
+    provider = control.setting('hosts.sort.provider')
+    if provider == '': provider = 'false'
+    
+    quality = control.setting('hosts.quality')
+    if quality == '': quality = '0'
+
+    captcha = control.setting('hosts.captcha')
+    if captcha == '': captcha = 'true'
+
+    HEVC = control.setting('HEVC')
+
+    random.shuffle(self.sources)
+
+    if provider == 'true':
+        self.sources = sorted(self.sources, key=lambda k: k['provider'])
+
+    for i in self.sources:
+        if 'checkquality' in i and i['checkquality'] == True:
+            if not i['source'].lower() in self.hosthqDict and i['quality'] not in ['SD', 'SCR', 'CAM']: i.update({'quality': 'SD'})
+    
+    local = [i for i in self.sources if 'local' in i and i['local'] == True]
+    for i in local: i.update({'language': self._getPrimaryLang() or 'en'})
+    self.sources = [i for i in self.sources if not i in local]
+
+    filter = []
+    filter += [i for i in self.sources if i['direct'] == True]
+    filter += [i for i in self.sources if i['direct'] == False]
+    self.sources = filter
+
+    filter = []
+    
+
+    for d in debrid.debrid_resolvers:
+        valid_hoster = set([i['source'] for i in self.sources])
+        valid_hoster = [i for i in valid_hoster if d.valid_url('', i)]
+        filter += [dict(i.items() + [('debrid', d.name)]) for i in self.sources if i['source'] in valid_hoster]
+    filter += [i for i in self.sources if not i['source'].lower() in self.hostprDict and i['debridonly'] == False]
+
+    self.sources = filter
+  
+    for i in range(len(self.sources)):
+        q = self.sources[i]['quality']            
+        if q == 'HD': self.sources[i].update({'quality': '720p'})
+
+    filter = []
+    filter += local
+
+    if quality in ['0']: filter += [i for i in self.sources if i['quality'] == '4K' and 'debrid' in i]
+    if quality in ['0']: filter += [i for i in self.sources if i['quality'] == '4K' and not 'debrid' in i and 'memberonly' in i]
+    if quality in ['0']: filter += [i for i in self.sources if i['quality'] == '4K' and not 'debrid' in i and not 'memberonly' in i]
+
+    if quality in ['0', '1']: filter += [i for i in self.sources if i['quality'] == '1440p' and 'debrid' in i]
+    if quality in ['0', '1']: filter += [i for i in self.sources if i['quality'] == '1440p' and not 'debrid' in i and 'memberonly' in i]
+    if quality in ['0', '1']: filter += [i for i in self.sources if i['quality'] == '1440p' and not 'debrid' in i and not 'memberonly' in i]
+
+    if quality in ['0', '1', '2']: filter += [i for i in self.sources if i['quality'] == '1080p' and 'debrid' in i]
+    if quality in ['0', '1', '2']: filter += [i for i in self.sources if i['quality'] == '1080p' and not 'debrid' in i and 'memberonly' in i]
+    if quality in ['0', '1', '2']: filter += [i for i in self.sources if i['quality'] == '1080p' and not 'debrid' in i and not 'memberonly' in i]
+
+    if quality in ['0', '1', '2', '3']: filter += [i for i in self.sources if i['quality'] == '720p' and 'debrid' in i]
+    if quality in ['0', '1', '2', '3']: filter += [i for i in self.sources if i['quality'] == '720p' and not 'debrid' in i and 'memberonly' in i]
+    if quality in ['0', '1', '2', '3']: filter += [i for i in self.sources if i['quality'] == '720p' and not 'debrid' in i and not 'memberonly' in i]
+
+    filter += [i for i in self.sources if i['quality'] in ['SD', 'SCR', 'CAM']]
+    self.sources = filter
+
+    if not captcha == 'true':
+        filter = [i for i in self.sources if i['source'].lower() in self.hostcapDict and not 'debrid' in i]
+        self.sources = [i for i in self.sources if not i in filter]
+
+    filter = [i for i in self.sources if i['source'].lower() in self.hostblockDict and not 'debrid' in i]
+    self.sources = [i for i in self.sources if not i in filter]
+    
+    multi = [i['language'] for i in self.sources]
+    multi = [x for y,x in enumerate(multi) if x not in multi[:y]]
+    multi = True if len(multi) > 1 else False
+
+    if multi == True:
+        self.sources = [i for i in self.sources if not i['language'] == 'en'] + [i for i in self.sources if i['language'] == 'en']
+    
+    self.sources = self.sources[:2000]
+
+    extra_info = control.setting('sources.extrainfo')
+    prem_identify = control.setting('prem.identify')
+    if prem_identify == '': prem_identify = 'blue'
+    prem_identify = self.getPremColor(prem_identify)        
+    
+    for i in range(len(self.sources)):
+                   
+        if extra_info == 'true': t = source_utils.getFileType(self.sources[i]['url'])
+        else: t = None
+        
+        u = self.sources[i]['url']
+
+        p = self.sources[i]['provider']
+
+        q = self.sources[i]['quality']
+
+        s = self.sources[i]['source']
+        
+        s = s.rsplit('.', 1)[0]
+
+        l = self.sources[i]['language']
+
+        try: f = (' | '.join(['[I]%s [/I]' % info.strip() for info in self.sources[i]['info'].split('|')]))
+        except: f = ''
+
+        try: d = self.sources[i]['debrid']
+        except: d = self.sources[i]['debrid'] = ''
+
+        if d.lower() == 'real-debrid': d = 'RD'
+
+        if not d == '': label = '%02d | [B]%s | %s[/B] | ' % (int(i+1), d, p)
+        else: label = '%02d | [B]%s[/B] | ' % (int(i+1), p)
+
+        if multi == True and not l == 'en': label += '[B]%s[/B] | ' % l
+
+        if t:
+            if q in ['4K', '1440p', '1080p', '720p']: label += '%s | [B][I]%s [/I][/B] | [I]%s[/I] | %s' % (s, q, t, f)
+            elif q == 'SD': label += '%s | %s | [I]%s[/I]' % (s, f, t)
+            else: label += '%s | %s | [I]%s [/I] | [I]%s[/I]' % (s, f, q, t)
+        else:
+            if q in ['4K', '1440p', '1080p', '720p']: label += '%s | [B][I]%s [/I][/B] | %s' % (s, q, f)
+            elif q == 'SD': label += '%s | %s' % (s, f)
+            else: label += '%s | %s | [I]%s [/I]' % (s, f, q)
+        label = label.replace('| 0 |', '|').replace(' | [I]0 [/I]', '')
+        label = re.sub('\[I\]\s+\[/I\]', ' ', label)
+        label = re.sub('\|\s+\|', '|', label)
+        label = re.sub('\|(?:\s+|)$', '', label)
+        
+        if d: 
+            if not prem_identify == 'nocolor':
+                self.sources[i]['label'] = ('[COLOR %s]' % (prem_identify)) + label.upper() + '[/COLOR]'
+            else: self.sources[i]['label'] = label.upper()
+        else: self.sources[i]['label'] = label.upper()
+
+    try: 
+        if not HEVC == 'true': self.sources = [i for i in self.sources if not 'HEVC' in i['label']]
+    except: pass
+        
+    self.sources = [i for i in self.sources if 'label' in i]
+
+    return self.sources
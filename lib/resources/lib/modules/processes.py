@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+
+'''
+    Covenant Add-on
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+
+import os,threading
+
+from resources.lib.modules import workers
+
+
+# Provider methods that run in a worker process; everything else stays local
+remote_calls = ['movie', 'tvshow', 'episode', 'sources']
+
+# Provider instances by name; worker processes inherit them when forked
+instances = {}
+
+
+def available():
+    '''
+    Worker processes are forked so they inherit the loaded providers; Kodi
+    cannot spawn a fresh interpreter on platforms without fork.
+    '''
+    try:
+        import multiprocessing
+        return hasattr(os, 'fork')
+    except:
+        return False
+
+
+class worker:
+    def __init__(self):
+        import multiprocessing
+        self.conn, child = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(target=_serve, args=(child,))
+        self.process.daemon = True
+        self.process.start()
+        child.close()
+        self.killed = False
+
+    def call(self, name, method, args):
+        self.conn.send((name, method, args))
+        return self.conn.recv()
+
+    def close(self):
+        # Registered with the running Job, so cancelling a stuck provider kills its process
+        self.killed = True
+        try: self.process.terminate()
+        except: pass
+        try: self.conn.close()
+        except: pass
+
+    def reap(self):
+        self.close()
+        try: self.process.join(1)
+        except: pass
+
+
+class pool:
+    '''
+    Runs provider calls in up to processes worker processes, one call per
+    process at a time. Threads calling in block on the pipe, not the GIL.
+    start() forks every worker up front. A worker that dies or is killed is
+    not replaced, as forking again would happen with the scrape's threads
+    running; once none are left, calls run in this process instead.
+    '''
+    def __init__(self, processes):
+        self.processes = processes
+        self.changed = threading.Condition(threading.Lock())
+        self.idle = []
+        self.alive = 0
+        self.closed = False
+
+    def start(self):
+        '''
+        Fork the workers. Call it before starting any thread: a child gets a
+        copy of every lock another thread held at that moment, held for good.
+        Kodi itself runs other threads in the same interpreter, which is why
+        the mode is off unless scrapers.processes is set.
+        '''
+        for i in range(self.processes):
+            try: self.idle.append(worker())
+            except: pass
+        self.alive = len(self.idle)
+
+    def call(self, name, method, *args):
+        with self.changed:
+            while not self.idle and self.alive > 0 and not workers.cancelled():
+                self.changed.wait(0.25)
+            if not self.idle: w = None
+            else: w = self.idle.pop()
+
+        if w == None:
+            if workers.cancelled():
+                workers.fail()
+                return None
+            return _local(name, method, args)
+
+        workers.register(w)
+
+        try:
+            r, failed = w.call(name, method, args)
+            if failed: workers.fail()
+            broken = False
+        except:
+            r = None
+            broken = True
+
+        # Idle again for any job, so cancelling this one must not kill it
+        workers.release(w)
+
+        with self.changed:
+            # A pipe that hit EOF or broke would fail every later call too
+            dropped = broken or w.killed or self.closed
+            if dropped: self.alive -= 1
+            else: self.idle.append(w)
+            self.changed.notify()
+
+        if dropped: w.reap()
+        if broken or w.killed:
+            workers.fail()
+            return None
+        return r
+
+    def close(self):
+        '''
+        Stop idle workers now; busy ones stop when their call returns.
+        '''
+        with self.changed:
+            self.closed = True
+            idle, self.idle = self.idle, []
+            self.alive -= len(idle)
+            self.changed.notify_all()
+        for w in idle: w.reap()
+
+
+class remote:
+    '''
+    Stands in for a provider instance, forwarding the scraping calls to the
+    pool and reading anything else from the local instance.
+    '''
+    def __init__(self, pool, name, call):
+        self.pool = pool
+        self.name = name
+        self.call = call
+        instances[name] = call
+
+    def __getattr__(self, attr):
+        if attr in remote_calls and not self.pool.closed:
+            return lambda *args: self.pool.call(self.name, attr, *args)
+        return getattr(self.call, attr)
+
+
+def _local(name, method, args):
+    try:
+        return getattr(instances[name], method)(*args)
+    except:
+        workers.fail()
+        return None
+
+
+def _serve(conn):
+    from resources.lib.sources import load
+    from resources.lib.modules import httploop
+
+    # Pooled connections and lookups in flight belong to the parent
+    httploop.forked()
+
+    while True:
+        try: name, method, args = conn.recv()
+        except: break
+
+        workers.failed(reset=True)
+        try:
+            if not name in instances: instances[name] = load([name])[0][1]
+            r = getattr(instances[name], method)(*args)
+        except:
+            workers.fail()
+            r = None
+
+        # Anything that does not pickle reads as a failed call
+        try: conn.send((r, workers.failed()))
+        except: conn.send((None, True))
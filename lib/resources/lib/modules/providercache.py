@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+
+'''
+    Covenant Add-on
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+
+
+import json,threading,time
+
+try: from sqlite3 import dbapi2 as database
+except: from pysqlite2 import dbapi2 as database
+
+from resources.lib.modules import control
+
+
+'''
+Provider result cache (rel_url, rel_src) on one shared WAL connection.
+Reads run on the caller's thread; writes are queued and committed in
+batches by a single writer thread, so concurrent provider threads never
+contend for the database lock.
+'''
+
+# Seconds a cached source list is served without re-scraping
+source_ttl = 3600
+
+# Seconds the writer waits for more writes before committing a batch, and idles before exiting
+batch_delay = 0.1
+idle_exit = 0.5
+
+_lock = threading.RLock()
+_changed = threading.Condition(_lock)
+_connection = None
+_queue = []
+_writer = None
+
+
+def _connect():
+    global _connection
+
+    if _connection == None:
+        control.makeFile(control.dataPath)
+        dbcon = database.connect(control.providercacheFile, timeout=30, check_same_thread=False)
+        dbcon.execute("PRAGMA journal_mode=WAL")
+        dbcon.execute("PRAGMA synchronous=NORMAL")
+        dbcon.execute("CREATE TABLE IF NOT EXISTS rel_url (""source TEXT, ""imdb_id TEXT, ""season TEXT, ""episode TEXT, ""rel_url TEXT, ""UNIQUE(source, imdb_id, season, episode)"");")
+        dbcon.execute("CREATE TABLE IF NOT EXISTS rel_src (""source TEXT, ""imdb_id TEXT, ""season TEXT, ""episode TEXT, ""hosts TEXT, ""added INTEGER, ""UNIQUE(source, imdb_id, season, episode)"");")
+        dbcon.execute("CREATE INDEX IF NOT EXISTS rel_src_title ON rel_src (imdb_id, season, episode)")
+        dbcon.execute("CREATE TABLE IF NOT EXISTS rel_neg (""source TEXT, ""imdb_id TEXT, ""season TEXT, ""episode TEXT, ""added INTEGER, ""UNIQUE(source, imdb_id, season, episode)"");")
+        dbcon.execute("CREATE INDEX IF NOT EXISTS rel_neg_title ON rel_neg (imdb_id, season, episode)")
+        dbcon.commit()
+        _connection = dbcon
+
+    return _connection
+
+
+def _fetch(query, args):
+    with _lock:
+        dbcur = _connect().cursor()
+        dbcur.execute(query, args)
+        return dbcur.fetchone()
+
+
+def prepare():
+    try:
+        with _lock: _connect()
+        return True
+    except:
+        return False
+
+
+def get_url(source, imdb, season='', episode=''):
+    try:
+        match = _fetch("SELECT rel_url FROM rel_url WHERE source = ? AND imdb_id = ? AND season = ? AND episode = ?", (source, imdb, season, episode))
+        return json.loads(match[0])
+    except:
+        return None
+
+
+def get_sources(source, imdb, season='', episode='', ttl=None):
+    '''
+    Cached source list for a provider and title, or None when missing or
+    older than ttl seconds (source_ttl by default).
+    '''
+    sources, age = lookup(source, imdb, season, episode)
+    if sources == None or age > (source_ttl if ttl == None else ttl): return None
+    return sources
+
+
+def lookup(source, imdb, season='', episode=''):
+    '''
+    (sources, age in seconds) of the cached row whatever its age, or
+    (None, None) when there is none.
+    '''
+    try:
+        match = _fetch("SELECT hosts, added FROM rel_src WHERE source = ? AND imdb_id = ? AND season = ? AND episode = ?", (source, imdb, season, episode))
+        return json.loads(match[0]), abs(int(time.time()) - int(match[1]))
+    except:
+        return None, None
+
+
+def set_url(source, imdb, season, episode, url):
+    try: _write("INSERT OR REPLACE INTO rel_url Values (?, ?, ?, ?, ?)", (source, imdb, season, episode, json.dumps(url)))
+    except: pass
+
+
+def set_sources(source, imdb, season, episode, sources):
+    try: _write("INSERT OR REPLACE INTO rel_src Values (?, ?, ?, ?, ?, ?)", (source, imdb, season, episode, json.dumps(sources), int(time.time())))
+    except: pass
+
+
+def set_negative(source, imdb, season='', episode=''):
+    '''
+    Remember that a provider found nothing for a title.
+    '''
+    _write("INSERT OR REPLACE INTO rel_neg Values (?, ?, ?, ?, ?)", (source, imdb, season, episode, int(time.time())))
+
+
+def get_negatives(imdb, season='', episode='', ttl=1800):
+    '''
+    Providers that found nothing for a title within the last ttl seconds.
+    '''
+    try:
+        with _lock:
+            dbcur = _connect().cursor()
+            dbcur.execute("SELECT source FROM rel_neg WHERE imdb_id = ? AND season = ? AND episode = ? AND added > ?", (imdb, season, episode, int(time.time()) - ttl))
+            return set([i[0] for i in dbcur.fetchall()])
+    except:
+        return set()
+
+
+def clear_negatives(imdb, season='', episode=''):
+    _write("DELETE FROM rel_neg WHERE imdb_id = ? AND season = ? AND episode = ?", (imdb, season, episode))
+    flush()
+
+
+def delete(source, imdb, season='', episode=''):
+    _write("DELETE FROM rel_src WHERE source = ? AND imdb_id = ? AND season = ? AND episode = ?", (source, imdb, season, episode))
+    _write("DELETE FROM rel_url WHERE source = ? AND imdb_id = ? AND season = ? AND episode = ?", (source, imdb, season, episode))
+
+
+def _write(query, args):
+    global _writer
+
+    with _lock:
+        _queue.append((query, args))
+        if _writer == None:
+            _writer = threading.Thread(target=_write_worker)
+            _writer.start()
+        _changed.notify_all()
+
+
+def _write_worker():
+    global _writer, _queue
+
+    while True:
+        with _lock:
+            if not _queue: _changed.wait(idle_exit)
+            if not _queue:
+                _writer = None
+                _changed.notify_all()
+                return
+        time.sleep(batch_delay)
+
+        with _lock:
+            batch, _queue = _queue, []
+            try:
+                dbcon = _connect()
+                for query, args in batch: dbcon.execute(query, args)
+                dbcon.commit()
+            except:
+                try: dbcon.rollback()
+                except: pass
+            _changed.notify_all()
+
+
+def flush(timeout=10):
+    '''
+    Wait until every queued write has been committed.
+    '''
+    deadline = time.time() + timeout
+    with _lock:
+        while _queue and time.time() < deadline:
+            _changed.wait(deadline - time.time())
+
+
+def clear():
+    '''
+    Empty the whole providers database: cached results and misses, and the
+    provider health (providerstats) and debrid host answers kept beside
+    them, so a provider written off as dead gets another chance.
+    '''
+    global _connection
+
+    flush()
+    with _lock:
+        try:
+            dbcon = _connect()
+            for table in ['rel_src', 'rel_url', 'rel_neg', 'rel_stats', 'rel_debrid']:
+                dbcon.execute("DROP TABLE IF EXISTS %s" % table)
+            dbcon.commit()
+            dbcon.execute("VACUUM")
+            dbcon.close()
+        except:
+            pass
+        _connection = None
@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+
+'''
+    Covenant Add-on
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+
+
+import time,threading
+
+try: from sqlite3 import dbapi2 as database
+except: from pysqlite2 import dbapi2 as database
+
+from resources.lib.modules import control
+from resources.lib.modules import workers
+
+
+# Weight of the newest sample in the moving averages
+alpha = 0.3
+
+# Providers whose recent runs nearly all fail (raise, time out or cannot
+# reach their site) are skipped, and retried once a day. Runs that simply
+# find nothing do not count: niche titles are not a provider fault.
+dead_failures = 0.95
+dead_retry = 24 * 3600
+
+# Providers below this recent rate of runs with sources are pushed to the back of the queue
+weak_rate = 0.25
+
+pending = []
+lock = threading.Lock()
+
+# When a list, every recorded sample is also kept here (covenant-scrape --report)
+history = None
+
+
+def _table(dbcur):
+    dbcur.execute("CREATE TABLE IF NOT EXISTS rel_stats (""source TEXT, ""call TEXT, ""runs INTEGER, ""errors INTEGER, ""items INTEGER, ""time REAL, ""rate REAL, ""added INTEGER, ""empty INTEGER, ""failing REAL, ""UNIQUE(source, call)"");")
+
+    # Tables from before empty runs were told apart from failures
+    columns = [i[1] for i in dbcur.execute("PRAGMA table_info(rel_stats)").fetchall()]
+    if not 'failing' in columns:
+        dbcur.execute("ALTER TABLE rel_stats ADD COLUMN empty INTEGER DEFAULT 0")
+        dbcur.execute("ALTER TABLE rel_stats ADD COLUMN failing REAL DEFAULT 0")
+
+
+def record(source, call, seconds, items=None, error=False):
+    '''
+    Queue one sample for a provider call (movie, tvshow, episode, sources,
+    resolve, or scrape for a whole uncached provider run). items is the
+    number of sources returned (1 or 0 for a lookup); error marks a call that
+    raised, timed out or could not reach its site. A call with items 0 and no
+    error found nothing. Samples are written by flush().
+    '''
+    with lock:
+        pending.append((source, call, seconds, items, error))
+        if not history == None: history.append((source, call, seconds, items, error))
+
+
+def timed(source, call, function, *args):
+    t = time.time()
+    try:
+        r = function(*args)
+    except:
+        workers.fail()
+        r = None
+    items = len(r) if isinstance(r, list) else int(bool(r))
+    record(source, call, time.time() - t, items, workers.failed())
+    return r
+
+
+def flush():
+    global pending
+
+    with lock:
+        samples, pending = pending, []
+    if not samples: return
+
+    try:
+        control.makeFile(control.dataPath)
+        dbcon = database.connect(control.providercacheFile)
+        dbcur = dbcon.cursor()
+        _table(dbcur)
+
+        now = int(time.time())
+        for source, call, seconds, items, error in samples:
+            ok = 0.0 if error or items == 0 else 1.0
+            failed = 1.0 if error else 0.0
+            empty = int(not error and items == 0)
+            dbcur.execute("SELECT runs, errors, items, time, rate, empty, failing FROM rel_stats WHERE source = ? AND call = ?", (source, call))
+            match = dbcur.fetchone()
+            if match == None:
+                dbcur.execute("INSERT INTO rel_stats Values (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", (source, call, 1, int(error), items or 0, seconds, ok, now, empty, failed))
+            else:
+                runs, errors, total, avg, rate, empties, failing = match
+                dbcur.execute("UPDATE rel_stats SET runs = ?, errors = ?, items = ?, time = ?, rate = ?, added = ?, empty = ?, failing = ? WHERE source = ? AND call = ?", (runs + 1, errors + int(error), total + (items or 0), avg + alpha * (seconds - avg), rate + alpha * (ok - rate), now, empties + empty, failing + alpha * (failed - failing), source, call))
+
+        dbcon.commit()
+    except:
+        pass
+
+
+def fetch():
+    '''
+    Returns {source: {call: {'runs', 'errors', 'empty', 'items', 'time', 'rate', 'failing', 'added'}}}.
+    '''
+    try:
+        dbcon = database.connect(control.providercacheFile)
+        dbcur = dbcon.cursor()
+        _table(dbcur)
+        dbcur.execute("SELECT source, call, runs, errors, empty, items, time, rate, failing, added FROM rel_stats")
+        stats = {}
+        for source, call, runs, errors, empty, items, seconds, rate, failing, added in dbcur.fetchall():
+            stats.setdefault(source, {})[call] = {'runs': runs, 'errors': errors, 'empty': empty, 'items': items, 'time': seconds, 'rate': rate, 'failing': failing, 'added': added}
+        return stats
+    except:
+        return {}
+
+
+def timeout(stats, default):
+    '''
+    Per provider time budget: three times its usual scrape duration plus slack
+    for a slow first request, capped at default. default without history.
+    '''
+    try:
+        seconds = stats['scrape']['time']
+        return int(min(default, max(5, 3 * seconds + 3)))
+    except:
+        return default
+
+
+def health(stats):
+    '''
+    'dead' from the recent rate of failed scrapes, else 'weak' or 'ok' from
+    the recent rate of scrapes that found sources.
+    '''
+    try:
+        s = stats['scrape']
+        if s['runs'] < 5: return 'ok'
+        if s['failing'] > dead_failures:
+            if int(time.time()) - s['added'] < dead_retry: return 'dead'
+            return 'ok'
+        if s['rate'] < weak_rate: return 'weak'
+        return 'ok'
+    except:
+        return 'ok'
+
+
+def clear():
+    try:
+        dbcon = database.connect(control.providercacheFile)
+        dbcur = dbcon.cursor()
+        dbcur.execute("DROP TABLE IF EXISTS rel_stats")
+        dbcon.commit()
+    except:
+        pass
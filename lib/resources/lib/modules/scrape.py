@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -*-
+
+'''
+    Covenant Add-on
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+
+import sys,json,time,threading,optparse
+
+from resources.lib.modules import headless
+
+
+usage = '''%prog [options] ID [ID ...]
+
+Scrape titles outside Kodi to warm the provider cache. Each ID is one of
+
+    tt0111161               a movie by imdb id
+    tt0944947:1:2           an episode by the show's imdb id
+    tvdb:121361:1:2         an episode by the show's tvdb id
+
+IDs are also read one per line from --input ("-" for stdin). An ID may
+instead be a JSON object with title, year, imdb, tvdb, season, episode,
+tvshowtitle and premiered, which skips the trakt lookup.
+
+--map sends a provider's domain to a local server (for example one serving
+recorded pages), --providers leaves out every other provider, and --report prints per provider timings, wall time,
+peak threads and peak RSS, which makes for a repeatable benchmark.'''
+
+
+def title(id):
+    '''
+    The getSources arguments for an ID, looked up on trakt.
+    '''
+    from resources.lib.modules import trakt
+
+    if isinstance(id, dict):
+        item = dict([(k, id.get(k)) for k in ['title', 'year', 'imdb', 'tvdb', 'season', 'episode', 'tvshowtitle', 'premiered']])
+        if item['tvdb'] == None and item['tvshowtitle'] == None: item['tvdb'] = '0'
+        return item
+
+    id = id.strip().split(':')
+
+    if len(id) == 1:
+        r = trakt.getMovieSummary(id[0])
+        return {'title': r['title'], 'year': str(r['year']), 'imdb': id[0], 'tvdb': '0', 'season': None, 'episode': None, 'tvshowtitle': None, 'premiered': None}
+
+    if id[0] == 'tvdb':
+        show = trakt.IdLookup('show', 'tvdb', id[1])['imdb']
+        id = [show] + id[2:]
+
+    show, season, episode = id
+    r = trakt.getTVShowSummary(show)
+    e = trakt.getTraktAsJson('/shows/%s/seasons/%s/episodes/%s?extended=full' % (show, season, episode))
+
+    premiered = (e.get('first_aired') or '')[:10] or '0'
+    return {'title': e['title'], 'year': str(r['year']), 'imdb': show, 'tvdb': str(r['ids']['tvdb']), 'season': season, 'episode': episode, 'tvshowtitle': r['title'], 'premiered': premiered}
+
+
+def scrape(item, quality, timeout):
+    from resources.lib.modules import sources
+
+    return sources.sources().getSources(item['title'], item['year'], item['imdb'], item['tvdb'], item['season'], item['episode'], item['tvshowtitle'], item['premiered'], quality, timeout) or []
+
+
+def run(ids, output, titles=2, quality='HD', timeout=30):
+    '''
+    Scrape ids, titles at a time. Sources land in the provider cache as
+    usual and one JSON line per title is written to output.
+    '''
+    from resources.lib.modules import workers
+    from resources.lib.modules import providercache
+    from resources.lib.modules import log_utils
+
+    lock = threading.Lock()
+
+    def job(id):
+        try:
+            item = title(id)
+        except Exception as e:
+            log_utils.log('Could not look up %s: %s' % (id, e), log_utils.LOGERROR)
+            item = None
+
+        result = scrape(item, quality, timeout) if not item == None else []
+
+        line = dict(item or {'id': id}, sources=[dict([(k, v) for k, v in i.items() if not k == 'label']) for i in result])
+        with lock:
+            output.write(json.dumps(line) + '\n')
+            output.flush()
+        return len(result)
+
+    pool = workers.Pool(titles)
+    jobs = [pool.submit(job, i) for i in ids]
+    pool.start()
+    pool.wait()
+
+    providercache.flush()
+
+    return [i.result for i in jobs]
+
+
+def main(argv=None):
+    parser = optparse.OptionParser(usage=usage)
+    parser.add_option('-i', '--input', help='read IDs from FILE, one per line', metavar='FILE')
+    parser.add_option('-o', '--output', default='-', help='write JSON lines to FILE (default stdout)', metavar='FILE')
+    parser.add_option('-s', '--settings', help='Kodi style settings.xml to read settings from', metavar='FILE')
+    parser.add_option('-p', '--profile', help='directory standing in for special://profile (default ~/.covenant)', metavar='DIR')
+    parser.add_option('-j', '--titles', type='int', default=2, help='titles scraped at once (default 2)')
+    parser.add_option('-q', '--quality', default='HD', help='quality passed to getSources (default HD)')
+    parser.add_option('-t', '--timeout', type='int', default=30, help='scrape timeout per title in seconds (default 30)')
+    parser.add_option('-m', '--map', action='append', default=[], help='send requests for HOST to URL, e.g. rlsbb.ru=http://127.0.0.1:8000', metavar='HOST=URL')
+    parser.add_option('--record', help='append all HTTP traffic to the cassette FILE', metavar='FILE')
+    parser.add_option('--replay', action='append', default=[], help='answer HTTP requests from the cassette FILE instead of the network (repeatable)', metavar='FILE')
+    parser.add_option('-P', '--providers', help='scrape with only these providers, e.g. releasebb,primewire', metavar='NAMES')
+    parser.add_option('-r', '--report', action='store_true', default=False, help='print per provider timings, wall time, peak threads and RSS')
+    options, args = parser.parse_args(argv)
+
+    lines = list(args)
+    if options.input:
+        f = sys.stdin if options.input == '-' else open(options.input)
+        lines += [i.strip() for i in f]
+
+    ids = [json.loads(i) if i.startswith('{') else i for i in lines if i and not i.startswith('#')]
+
+    if not ids: parser.error('no IDs given')
+
+    headless.install(options.settings, options.profile)
+
+    if options.providers:
+        from resources.lib.sources import manifest
+        names = [i.strip() for i in options.providers.split(',')]
+        for i in manifest():
+            if not i['name'] in names: headless.settings_store['provider.' + i['name']] = 'false'
+
+    from resources.lib.modules import client
+    for i in options.map:
+        try: host, target = i.split('=', 1)
+        except: parser.error('--map takes HOST=URL, not %s' % i)
+        client.map_host(host, target)
+
+    if options.record or options.replay:
+        from resources.lib.modules import cassette
+        if options.record: cassette.record(options.record)
+        else: cassette.replay(*options.replay)
+
+    if options.report:
+        from resources.lib.modules import providerstats
+        providerstats.history = []
+        monitor = _monitor()
+
+    output = sys.stdout if options.output == '-' else open(options.output, 'a')
+    try:
+        counts = run(ids, output, options.titles, options.quality, options.timeout)
+    finally:
+        if not output == sys.stdout: output.close()
+        if options.record or options.replay: cassette.stop()
+
+    sys.stderr.write('%s titles, %s sources\n' % (len(counts), sum([i or 0 for i in counts])))
+
+    if options.report:
+        monitor.stop()
+        report(providerstats.history, monitor, sys.stderr)
+
+    return 0
+
+
+class _monitor:
+    '''
+    Wall time and the highest thread count seen while scraping.
+    '''
+    def __init__(self):
+        self.start = time.time()
+        self.threads = threading.active_count()
+        self.running = True
+        t = threading.Thread(target=self.run)
+        t.daemon = True
+        t.start()
+
+    def run(self):
+        while self.running:
+            self.threads = max(self.threads, threading.active_count())
+            time.sleep(0.05)
+
+    def stop(self):
+        self.running = False
+        self.wall = time.time() - self.start
+
+
+def report(samples, monitor, out):
+    '''
+    Per provider: runs, seconds spent in each call (the sources call is
+    mostly parsing when pages come from a local server), items found, runs
+    that found nothing and runs that failed.
+    '''
+    providers = {}
+    for source, call, seconds, items, error in samples:
+        p = providers.setdefault(source, {'runs': 0, 'items': 0, 'errors': 0, 'empty': 0})
+        p[call] = p.get(call, 0) + seconds
+        if call == 'scrape':
+            p['runs'] += 1 ; p['items'] += items or 0 ; p['errors'] += 1 if error else 0 ; p['empty'] += 1 if not error and not items else 0
+
+    out.write('%-20s %5s %6s %6s %6s %9s %9s %9s\n' % ('provider', 'runs', 'items', 'empty', 'errors', 'lookup s', 'sources s', 'total s'))
+    for source in sorted(providers, key=lambda i: -providers[i].get('scrape', 0)):
+        p = providers[source]
+        lookup = p.get('movie', 0) + p.get('tvshow', 0) + p.get('episode', 0)
+        out.write('%-20s %5d %6d %6d %6d %9.3f %9.3f %9.3f\n' % (source[:20], p['runs'], p['items'], p['empty'], p['errors'], lookup, p.get('sources', 0), p.get('scrape', 0)))
+
+    try:
+        import resource
+        # Linux reports kilobytes, OS X bytes
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        rss = rss / 1024.0 if sys.platform == 'darwin' else rss
+        rss = '%.1f MB' % (rss / 1024.0)
+    except:
+        rss = 'unknown'
+
+    out.write('wall %.2f s, peak threads %d, peak RSS %s\n' % (monitor.wall, monitor.threads, rss))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
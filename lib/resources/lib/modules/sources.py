@@ -18,7 +18,7 @@
 '''
 
 
-import sys,re,json,urllib,urlparse,random,datetime,time
+import sys,re,json,urllib,urlparse,random,time,threading
 
 from resources.lib.modules import trakt
 from resources.lib.modules import tvmaze
@@ -28,23 +28,34 @@ from resources.lib.modules import cleantitle
 from resources.lib.modules import client
 from resources.lib.modules import debrid
 from resources.lib.modules import workers
+from resources.lib.modules import providerstats
+from resources.lib.modules import hostregistry
+from resources.lib.modules import processes
+from resources.lib.modules import providercache
+from resources.lib.modules import dnscache
 from resources.lib.modules import source_utils
 from resources.lib.modules import log_utils
 from resources.lib.modules import thexem
 
-try: from sqlite3 import dbapi2 as database
-except: from pysqlite2 import dbapi2 as database
-
 try: import urlresolver
 except: pass
 
 try: import xbmc
 except: pass
 
+label_empty = re.compile('\[I\]\s+\[/I\]')
+label_pipes = re.compile('\|\s+\|')
+label_trail = re.compile('\|(?:\s+|)$')
+
+
 class sources:
     def __init__(self):
         self.getConstants()
         self.sources = []
+        self.changed = threading.Condition(threading.RLock())
+        self.sourceCounts = {}
+        self.debridCounts = {}
+        self.stopped = False
 
     def play(self, title, year, imdb, tvdb, season, episode, tvshowtitle, premiered, meta, select):
         try:
@@ -226,6 +237,8 @@ class sources:
 
             block = None
 
+            self.resolveStart()
+
             for i in range(len(items)):
                 try:
                     try:
@@ -236,17 +249,16 @@ class sources:
 
                     if items[i]['source'] == block: raise Exception()
 
-                    w = workers.Thread(self.sourcesResolve, items[i])
-                    w.start()
+                    w = self.resolveJob(items, i, block)
 
-                    offset = 60 * 2 if items[i].get('source') in self.hostcapDict else 0
+                    offset = 60 * 2 if self.hostRegistry.flags(items[i].get('source')) & hostregistry.CAPTCHA else 0
 
                     m = ''
 
                     for x in range(3600):
                         try:
                             if xbmc.abortRequested == True: return sys.exit()
-                            if progressDialog.iscanceled(): return progressDialog.close()
+                            if progressDialog.iscanceled(): self.resolveStop() ; return progressDialog.close()
                         except:
                             pass
 
@@ -256,24 +268,32 @@ class sources:
                         k = control.condVisibility('Window.IsActive(yesnoDialog)')
                         if k: m += '1'; m = m[-1]
                         if (w.is_alive() == False or x > 30 + offset) and not k: break
-                        time.sleep(0.5)
+                        w.wait(0.5)
 
 
                     for x in range(30):
                         try:
                             if xbmc.abortRequested == True: return sys.exit()
-                            if progressDialog.iscanceled(): return progressDialog.close()
+                            if progressDialog.iscanceled(): self.resolveStop() ; return progressDialog.close()
                         except:
                             pass
 
                         if m == '': break
                         if w.is_alive() == False: break
-                        time.sleep(0.5)
+                        w.wait(0.5)
+
+
+                    if w.is_alive() == True:
+                        block = items[i]['source']
+                        # or a stuck serial resolve holds up every later one
+                        w.cancel()
 
+                    url = w.result if w.is_alive() == False else None
 
-                    if w.is_alive() == True: block = items[i]['source']
+                    if url == None: raise Exception()
 
-                    if self.url == None: raise Exception()
+                    self.resolveStop()
+                    self.url = url
 
                     try: progressDialog.close()
                     except: pass
@@ -283,12 +303,14 @@ class sources:
                     control.execute('Dialog.Close(yesnoDialog)')
 
                     from resources.lib.modules.player import player
-                    player().run(title, year, season, episode, imdb, tvdb, self.url, meta)
+                    player().run(title, year, season, episode, imdb, tvdb, url, meta)
 
-                    return self.url
+                    return url
                 except:
                     pass
 
+            self.resolveStop()
+
             try: progressDialog.close()
             except: pass
 
@@ -304,48 +326,96 @@ class sources:
 
         self.prepareSources()
 
-        sourceDict = self.sourceDict
+        sourceDict = [(i['name'], i) for i in self.sourceManifest]
         
         progressDialog.update(0, control.lang(32600).encode('utf-8'))
 
         content = 'movie' if tvshowtitle == None else 'episode'
         if content == 'movie':
-            sourceDict = [(i[0], i[1], getattr(i[1], 'movie', None)) for i in sourceDict]
+            sourceDict = [(i[0], i[1], i[1]['movie']) for i in sourceDict]
             genres = trakt.getGenre('movie', 'imdb', imdb)
         else:
-            sourceDict = [(i[0], i[1], getattr(i[1], 'tvshow', None)) for i in sourceDict]
+            sourceDict = [(i[0], i[1], i[1]['tvshow']) for i in sourceDict]
             genres = trakt.getGenre('show', 'tvdb', tvdb)
         
-        sourceDict = [(i[0], i[1], i[2]) for i in sourceDict if not hasattr(i[1], 'genre_filter') or not i[1].genre_filter or any(x in i[1].genre_filter for x in genres)]
-        sourceDict = [(i[0], i[1]) for i in sourceDict if not i[2] == None]
+        sourceDict = [(i[0], i[1], i[2]) for i in sourceDict if not i[1]['genre_filter'] or any(x in i[1]['genre_filter'] for x in genres)]
+        sourceDict = [(i[0], i[1]) for i in sourceDict if i[2] == True]
 
         language = self.getLanguage()
-        sourceDict = [(i[0], i[1], i[1].language) for i in sourceDict]
+        sourceDict = [(i[0], i[1], i[1]['language']) for i in sourceDict]
         sourceDict = [(i[0], i[1]) for i in sourceDict if any(x in i[2] for x in language)]
 
         try: sourceDict = [(i[0], i[1], control.setting('provider.' + i[0])) for i in sourceDict]
         except: sourceDict = [(i[0], i[1], 'true') for i in sourceDict]
         sourceDict = [(i[0], i[1]) for i in sourceDict if not i[2] == 'false']
 
-        sourceDict = [(i[0], i[1], i[1].priority) for i in sourceDict]
+        sourceDict = [(i[0], i[1], i[1]['priority']) for i in sourceDict]
+
+        try: timeout = int(control.setting('scrapers.timeout.1'))
+        except: pass
+
+        adaptive = not control.setting('scrapers.adaptive') == 'false'
+        stats = providerstats.fetch() if adaptive else {}
+
+        if adaptive:
+            health = dict([(i[0], providerstats.health(stats.get(i[0], {}))) for i in sourceDict])
+            sourceDict = [(i[0], i[1], i[2] + 10 if health[i[0]] == 'weak' else i[2]) for i in sourceDict if not health[i[0]] == 'dead']
+
+        try: negative = int(control.setting('scrapers.cache.negative')) * 60
+        except: negative = 30 * 60
+
+        if not imdb == '0':
+            season_key, episode_key = ('', '') if content == 'movie' else (season, episode)
+            if control.window.getProperty(self.rescrapeProperty) == imdb:
+                control.window.clearProperty(self.rescrapeProperty)
+                providercache.clear_negatives(imdb, season_key, episode_key)
+            elif negative > 0:
+                negatives = providercache.get_negatives(imdb, season_key, episode_key, negative)
+                sourceDict = [i for i in sourceDict if not i[0] in negatives]
+
+        # Only now import the providers that will actually run
+        calls = dict(self.getSourceDict([i[0] for i in sourceDict]))
+        sourceDict = [(i[0], calls[i[0]], i[2]) for i in sourceDict if i[0] in calls]
 
         random.shuffle(sourceDict)
         sourceDict = sorted(sourceDict, key=lambda i: i[2])
 
         threads = []
 
+        processCount = self.getProcessCount()
+        if processCount > 0:
+            processPool = processes.pool(processCount)
+            sourceDict = [(i[0], processes.remote(processPool, i[0], i[1]), i[2]) for i in sourceDict]
+            # Forked now, before this scrape starts threads of its own
+            processPool.start()
+            pool = workers.Pool(processCount, self.changed)
+        else:
+            processPool = None
+            pool = workers.Pool(self.getThreadCount(), self.changed)
+
+        # 'loop' multiplexes the providers' requests on one engine thread
+        client.engine = 'loop' if control.setting('scrapers.engine') == 'loop' else None
+
+        self.refreshPool = workers.Pool(2)
+        self.refreshPool.start()
+
+        try: self.cacheFresh = int(control.setting('scrapers.cache.fresh')) * 60
+        except: self.cacheFresh = providercache.source_ttl
+        try: self.cacheStale = int(control.setting('scrapers.cache.stale')) * 3600
+        except: self.cacheStale = 0
+
         if content == 'movie':
             title = self.getTitle(title)
             localtitle = self.getLocalTitle(title, imdb, tvdb, content)
             aliases = self.getAliasTitles(imdb, localtitle, content)
-            for i in sourceDict: threads.append(workers.Thread(self.getMovieSource, title, localtitle, aliases, year, imdb, i[0], i[1]))
+            for i in sourceDict: threads.append(pool.submit(self.getMovieSource, title, localtitle, aliases, year, imdb, i[0], i[1], priority=i[2], timeout=providerstats.timeout(stats.get(i[0], {}), timeout)))
         else:
             tvshowtitle = self.getTitle(tvshowtitle)
             localtvshowtitle = self.getLocalTitle(tvshowtitle, imdb, tvdb, content)
             aliases = self.getAliasTitles(imdb, localtvshowtitle, content)
             #Disabled on 11/11/17 due to hang. Should be checked in the future and possible enabled again.
             #season, episode = thexem.get_scene_episode_number(tvdb, season, episode)
-            for i in sourceDict: threads.append(workers.Thread(self.getEpisodeSource, title, year, imdb, tvdb, season, episode, tvshowtitle, localtvshowtitle, aliases, premiered, i[0], i[1]))
+            for i in sourceDict: threads.append(pool.submit(self.getEpisodeSource, title, year, imdb, tvdb, season, episode, tvshowtitle, localtvshowtitle, aliases, premiered, i[0], i[1], priority=i[2], timeout=providerstats.timeout(stats.get(i[0], {}), timeout)))
 
         s = [i[0] + (i[1],) for i in zip(sourceDict, threads)]
         s = [(i[3].getName(), i[0], i[2]) for i in s]
@@ -353,7 +423,7 @@ class sources:
         mainsourceDict = [i[0] for i in s if i[2] == 0]
         sourcelabelDict = dict([(i[0], i[1].upper()) for i in s])
 
-        [i.start() for i in threads]
+        pool.start()
 
         string1 = control.lang(32404).encode('utf-8')
         string2 = control.lang(32405).encode('utf-8')
@@ -362,9 +432,6 @@ class sources:
         string5 = control.lang(32602).encode('utf-8')
         string6 = control.lang(32606).encode('utf-8')
         string7 = control.lang(32607).encode('utf-8')
-
-        try: timeout = int(control.setting('scrapers.timeout.1'))
-        except: pass
         
         quality = control.setting('hosts.quality')
         if quality == '': quality = '0'
@@ -377,14 +444,21 @@ class sources:
         source_sd = d_source_sd = 0
         total = d_total = 0
         
-        debrid_list = debrid.debrid_resolvers
         debrid_status = debrid.status()
+
+        stop_policy = self.getStopPolicy()
         
         total_format = '[COLOR %s][B]%s[/B][/COLOR]'
         pdiag_format = ' 4K: %s | 1080p: %s | 720p: %s | SD: %s | %s: %s'.split('|')
         pdiag_bg_format = '4K:%s(%s)|1080p:%s(%s)|720p:%s(%s)|SD:%s(%s)|T:%s(%s)'.split('|')
         
-        for i in range(0, 4 * timeout):
+        start_time = time.time()
+        last_state = None
+
+        while True:
+            i = int((time.time() - start_time) * 2)
+            if i >= 4 * timeout: break
+
             try:
                 if xbmc.abortRequested == True: return sys.exit()
 
@@ -393,55 +467,24 @@ class sources:
                 except:
                     pass
 
+                pool.expire()
+
                 if len(self.sources) > 0:
-                    if quality in ['0']:
-                        source_4k = len([e for e in self.sources if e['quality'] == '4K' and e['debridonly'] == False])
-                        source_1080 = len([e for e in self.sources if e['quality'] in ['1440p','1080p'] and e['debridonly'] == False])
-                        source_720 = len([e for e in self.sources if e['quality'] in ['720p','HD'] and e['debridonly'] == False])
-                        source_sd = len([e for e in self.sources if e['quality'] == 'SD' and e['debridonly'] == False])
-                    elif quality in ['1']:
-                        source_1080 = len([e for e in self.sources if e['quality'] in ['1440p','1080p'] and e['debridonly'] == False])
-                        source_720 = len([e for e in self.sources if e['quality'] in ['720p','HD'] and e['debridonly'] == False])
-                        source_sd = len([e for e in self.sources if e['quality'] == 'SD' and e['debridonly'] == False])
-                    elif quality in ['2']:
-                        source_1080 = len([e for e in self.sources if e['quality'] in ['1080p'] and e['debridonly'] == False])
-                        source_720 = len([e for e in self.sources if e['quality'] in ['720p','HD'] and e['debridonly'] == False])
-                        source_sd = len([e for e in self.sources if e['quality'] == 'SD' and e['debridonly'] == False])
-                    elif quality in ['3']:
-                        source_720 = len([e for e in self.sources if e['quality'] in ['720p','HD'] and e['debridonly'] == False])
-                        source_sd = len([e for e in self.sources if e['quality'] == 'SD' and e['debridonly'] == False])
-                    else:
-                        source_sd = len([e for e in self.sources if e['quality'] == 'SD' and e['debridonly'] == False])
-                    
+                    counts, d_counts = self.getSourceCounts()
+
+                    source_4k, source_1080, source_720, source_sd = self.getQualityTiers(counts, quality)
                     total = source_4k + source_1080 + source_720 + source_sd
 
                     if debrid_status:
-                        if quality in ['0']:
-                            for d in debrid_list:
-                                d_source_4k = len([e for e in self.sources if e['quality'] == '4K' and d.valid_url('', e['source'])])
-                                d_source_1080 = len([e for e in self.sources if e['quality'] in ['1440p','1080p'] and d.valid_url('', e['source'])])
-                                d_source_720 = len([e for e in self.sources if e['quality'] in ['720p','HD'] and d.valid_url('', e['source'])])
-                                d_source_sd = len([e for e in self.sources if e['quality'] == 'SD' and d.valid_url('', e['source'])])
-                        elif quality in ['1']:
-                            for d in debrid_list:
-                                d_source_1080 = len([e for e in self.sources if e['quality'] in ['1440p','1080p'] and d.valid_url('', e['source'])])
-                                d_source_720 = len([e for e in self.sources if e['quality'] in ['720p','HD'] and d.valid_url('', e['source'])])
-                                d_source_sd = len([e for e in self.sources if e['quality'] == 'SD' and d.valid_url('', e['source'])])
-                        elif quality in ['2']:
-                            for d in debrid_list:
-                                d_source_1080 = len([e for e in self.sources if e['quality'] in ['1080p'] and d.valid_url('', e['source'])])
-                                d_source_720 = len([e for e in self.sources if e['quality'] in ['720p','HD'] and d.valid_url('', e['source'])])
-                                d_source_sd = len([e for e in self.sources if e['quality'] == 'SD' and d.valid_url('', e['source'])])
-                        elif quality in ['3']:
-                            for d in debrid_list:
-                                d_source_720 = len([e for e in self.sources if e['quality'] in ['720p','HD'] and d.valid_url('', e['source'])])
-                                d_source_sd = len([e for e in self.sources if e['quality'] == 'SD' and d.valid_url('', e['source'])])
-                        else:
-                            for d in debrid_list:
-                                d_source_sd = len([e for e in self.sources if e['quality'] == 'SD' and d.valid_url('', e['source'])])
-                                 
+                        d_source_4k, d_source_1080, d_source_720, d_source_sd = self.getQualityTiers(d_counts, quality)
                         d_total = d_source_4k + d_source_1080 + d_source_720 + d_source_sd
 
+                    mainleft = [x for x in threads if x.is_alive() == True and x.getName() in mainsourceDict]
+                    if self.stopScraping(stop_policy, d_counts if debrid_status else counts, quality, len(mainleft) == 0):
+                        self.stopped = True
+                        pool.cancel()
+                        break
+
                 if debrid_status:
                     d_4k_label = total_format % ('red', d_source_4k) if d_source_4k == 0 else total_format % ('lime', d_source_4k)
                     d_1080_label = total_format % ('red', d_source_1080) if d_source_1080 == 0 else total_format % ('lime', d_source_1080)
@@ -538,11 +581,22 @@ class sources:
                             progressDialog.update(max(1, percent), line1, line2)
                     except:
                         break
-                        
-                time.sleep(0.5)
             except:
                 pass
 
+            # Sleep until a provider adds sources or finishes, refreshing at least every 0.5s
+            with self.changed:
+                state = (len(self.sources), len(pool.alive()))
+                if state == last_state: self.changed.wait(0.5)
+                last_state = (len(self.sources), len(pool.alive()))
+
+        pool.cancel(running=False)
+        if not processPool == None: processPool.close()
+
+        providerstats.flush()
+        debrid.save_hosts()
+        dnscache.save()
+
         if control.addonInfo('id') == 'plugin.video.bennu':
             try:
                 if progressDialog: progressDialog.update(100, control.lang(30726).encode('utf-8'), control.lang(30731).encode('utf-8'))
@@ -593,152 +647,202 @@ class sources:
             return self.sources
 
     def prepareSources(self):
-        try:
-            control.makeFile(control.dataPath)
+        providercache.prepare()
 
-            self.sourceFile = control.providercacheFile
-
-            dbcon = database.connect(self.sourceFile)
-            dbcur = dbcon.cursor()
-            dbcur.execute("CREATE TABLE IF NOT EXISTS rel_url (""source TEXT, ""imdb_id TEXT, ""season TEXT, ""episode TEXT, ""rel_url TEXT, ""UNIQUE(source, imdb_id, season, episode)"");")
-            dbcur.execute("CREATE TABLE IF NOT EXISTS rel_src (""source TEXT, ""imdb_id TEXT, ""season TEXT, ""episode TEXT, ""hosts TEXT, ""added TEXT, ""UNIQUE(source, imdb_id, season, episode)"");")
-        except:
-            pass
 
-
-    def getMovieSource(self, title, localtitle, aliases, year, imdb, source, call):
-    
-        try:
-            dbcon = database.connect(self.sourceFile)
-            dbcur = dbcon.cursor()
-        except:
-            pass
+    def getMovieSource(self, title, localtitle, aliases, year, imdb, source, call, refresh=False):
+        start = time.time()
 
         ''' Fix to stop items passed with a 0 IMDB id pulling old unrelated sources from the database. '''
         if imdb == '0':
-            try:
-                dbcur.execute("DELETE FROM rel_src WHERE source = '%s' AND imdb_id = '%s' AND season = '%s' AND episode = '%s'" % (source, imdb, '', ''))
-                dbcur.execute("DELETE FROM rel_url WHERE source = '%s' AND imdb_id = '%s' AND season = '%s' AND episode = '%s'" % (source, imdb, '', ''))
-                dbcon.commit()
-            except:
-                pass
+            providercache.delete(source, imdb, '', '')
         ''' END '''
-        
-        try:
-            sources = []
-            dbcur.execute("SELECT * FROM rel_src WHERE source = '%s' AND imdb_id = '%s' AND season = '%s' AND episode = '%s'" % (source, imdb, '', ''))
-            match = dbcur.fetchone()
-            t1 = int(re.sub('[^0-9]', '', str(match[5])))
-            t2 = int(datetime.datetime.now().strftime("%Y%m%d%H%M"))
-            update = abs(t2 - t1) > 60
-            if update == False:
-                sources = eval(match[4].encode('utf-8'))
-                return self.sources.extend(sources)
-        except:
-            pass
 
-        try:
-            url = None
-            dbcur.execute("SELECT * FROM rel_url WHERE source = '%s' AND imdb_id = '%s' AND season = '%s' AND episode = '%s'" % (source, imdb, '', ''))
-            url = dbcur.fetchone()
-            url = eval(url[4].encode('utf-8'))
-        except:
-            pass
+        if not imdb == '0' and refresh == False:
+            sources, age = providercache.lookup(source, imdb, '', '')
+            fresh, stale = self.getCacheTTL(call)
+            if not sources == None and age <= fresh:
+                return self.addSources(sources)
+            if not sources == None and age <= stale:
+                self.refreshPool.submit(self.getMovieSource, title, localtitle, aliases, year, imdb, source, call, True)
+                return self.addSources(sources)
+
+        url = providercache.get_url(source, imdb, '', '') if not imdb == '0' else None
 
         try:
-            if url == None: url = call.movie(imdb, title, localtitle, aliases, year)
+            if url == None: url = providerstats.timed(source, 'movie', call.movie, imdb, title, localtitle, aliases, year)
             if url == None: raise Exception()
-            dbcur.execute("DELETE FROM rel_url WHERE source = '%s' AND imdb_id = '%s' AND season = '%s' AND episode = '%s'" % (source, imdb, '', ''))
-            dbcur.execute("INSERT INTO rel_url Values (?, ?, ?, ?, ?)", (source, imdb, '', '', repr(url)))
-            dbcon.commit()
+            providercache.set_url(source, imdb, '', '', url)
         except:
             pass
 
         try:
             sources = []
-            sources = call.sources(url, self.hostDict, self.hostprDict)
+            if not url == None: sources = providerstats.timed(source, 'sources', call.sources, url, self.hostDict, self.hostprDict)
             if sources == None or sources == []: raise Exception()
             sources = [json.loads(t) for t in set(json.dumps(d, sort_keys=True) for d in sources)]
             for i in sources: i.update({'provider': source})
-            self.sources.extend(sources)
-            dbcur.execute("DELETE FROM rel_src WHERE source = '%s' AND imdb_id = '%s' AND season = '%s' AND episode = '%s'" % (source, imdb, '', ''))
-            dbcur.execute("INSERT INTO rel_src Values (?, ?, ?, ?, ?, ?)", (source, imdb, '', '', repr(sources), datetime.datetime.now().strftime("%Y-%m-%d %H:%M")))
-            dbcon.commit()
+            if refresh == False: self.addSources(sources)
+            if workers.cancelled(): raise Exception()
+            providercache.set_sources(source, imdb, '', '', sources)
         except:
             pass
 
+        self.recordScrape(source, start, sources)
+        if refresh == True: providerstats.flush()
 
-    def getEpisodeSource(self, title, year, imdb, tvdb, season, episode, tvshowtitle, localtvshowtitle, aliases, premiered, source, call):
-        try:
-            dbcon = database.connect(self.sourceFile)
-            dbcur = dbcon.cursor()
-        except:
-            pass
+        # Only an answer from the provider is worth remembering, not an outage
+        if not sources and not imdb == '0' and not workers.cancelled() and not workers.failed():
+            providercache.set_negative(source, imdb, '', '')
 
-        try:
-            sources = []
-            dbcur.execute("SELECT * FROM rel_src WHERE source = '%s' AND imdb_id = '%s' AND season = '%s' AND episode = '%s'" % (source, imdb, season, episode))
-            match = dbcur.fetchone()
-            t1 = int(re.sub('[^0-9]', '', str(match[5])))
-            t2 = int(datetime.datetime.now().strftime("%Y%m%d%H%M"))
-            update = abs(t2 - t1) > 60
-            if update == False:
-                sources = eval(match[4].encode('utf-8'))
-                return self.sources.extend(sources)
-        except:
-            pass
 
-        try:
-            url = None
-            dbcur.execute("SELECT * FROM rel_url WHERE source = '%s' AND imdb_id = '%s' AND season = '%s' AND episode = '%s'" % (source, imdb, '', ''))
-            url = dbcur.fetchone()
-            url = eval(url[4].encode('utf-8'))
-        except:
-            pass
+    def getEpisodeSource(self, title, year, imdb, tvdb, season, episode, tvshowtitle, localtvshowtitle, aliases, premiered, source, call, refresh=False):
+        start = time.time()
+
+        if refresh == False:
+            sources, age = providercache.lookup(source, imdb, season, episode)
+            fresh, stale = self.getCacheTTL(call)
+            if not sources == None and age <= fresh:
+                return self.addSources(sources)
+            if not sources == None and age <= stale:
+                self.refreshPool.submit(self.getEpisodeSource, title, year, imdb, tvdb, season, episode, tvshowtitle, localtvshowtitle, aliases, premiered, source, call, True)
+                return self.addSources(sources)
+
+        url = providercache.get_url(source, imdb, '', '')
 
         try:
-            if url == None: url = call.tvshow(imdb, tvdb, tvshowtitle, localtvshowtitle, aliases, year)
+            if url == None: url = providerstats.timed(source, 'tvshow', call.tvshow, imdb, tvdb, tvshowtitle, localtvshowtitle, aliases, year)
             if url == None: raise Exception()
-            dbcur.execute("DELETE FROM rel_url WHERE source = '%s' AND imdb_id = '%s' AND season = '%s' AND episode = '%s'" % (source, imdb, '', ''))
-            dbcur.execute("INSERT INTO rel_url Values (?, ?, ?, ?, ?)", (source, imdb, '', '', repr(url)))
-            dbcon.commit()
+            providercache.set_url(source, imdb, '', '', url)
         except:
             pass
 
-        try:
-            ep_url = None
-            dbcur.execute("SELECT * FROM rel_url WHERE source = '%s' AND imdb_id = '%s' AND season = '%s' AND episode = '%s'" % (source, imdb, season, episode))
-            ep_url = dbcur.fetchone()
-            ep_url = eval(ep_url[4].encode('utf-8'))
-        except:
-            pass
+        ep_url = providercache.get_url(source, imdb, season, episode)
 
         try:
             if url == None: raise Exception()
-            if ep_url == None: ep_url = call.episode(url, imdb, tvdb, title, premiered, season, episode)
+            if ep_url == None: ep_url = providerstats.timed(source, 'episode', call.episode, url, imdb, tvdb, title, premiered, season, episode)
             if ep_url == None: raise Exception()
-            dbcur.execute("DELETE FROM rel_url WHERE source = '%s' AND imdb_id = '%s' AND season = '%s' AND episode = '%s'" % (source, imdb, season, episode))
-            dbcur.execute("INSERT INTO rel_url Values (?, ?, ?, ?, ?)", (source, imdb, season, episode, repr(ep_url)))
-            dbcon.commit()
+            providercache.set_url(source, imdb, season, episode, ep_url)
         except:
             pass
 
         try:
             sources = []
-            sources = call.sources(ep_url, self.hostDict, self.hostprDict)
+            if not ep_url == None: sources = providerstats.timed(source, 'sources', call.sources, ep_url, self.hostDict, self.hostprDict)
             if sources == None or sources == []: raise Exception()
             sources = [json.loads(t) for t in set(json.dumps(d, sort_keys=True) for d in sources)]
             for i in sources: i.update({'provider': source})
-            self.sources.extend(sources)
-            dbcur.execute("DELETE FROM rel_src WHERE source = '%s' AND imdb_id = '%s' AND season = '%s' AND episode = '%s'" % (source, imdb, season, episode))
-            dbcur.execute("INSERT INTO rel_src Values (?, ?, ?, ?, ?, ?)", (source, imdb, season, episode, repr(sources), datetime.datetime.now().strftime("%Y-%m-%d %H:%M")))
-            dbcon.commit()
+            if refresh == False: self.addSources(sources)
+            if workers.cancelled(): raise Exception()
+            providercache.set_sources(source, imdb, season, episode, sources)
         except:
             pass
 
+        self.recordScrape(source, start, sources)
+        if refresh == True: providerstats.flush()
+
+        # Only an answer from the provider is worth remembering, not an outage
+        if not sources and not workers.cancelled() and not workers.failed():
+            providercache.set_negative(source, imdb, season, episode)
+
+
+    def getCacheTTL(self, call):
+        '''
+        (fresh, stale) ages in seconds for a provider's cached sources. Fresh
+        rows are served as they are; stale ones are served while a background
+        scrape refreshes them. Providers may set cache_fresh/cache_stale.
+        '''
+        fresh = getattr(call, 'cache_fresh', self.cacheFresh)
+        stale = getattr(call, 'cache_stale', self.cacheStale)
+        return fresh, max(fresh, stale)
+
+
+    def recordScrape(self, source, start, sources):
+        # Providers cut short by the stop policy say nothing about their health
+        if self.stopped and workers.cancelled(): return
+        # Timed out or failed is an error; finding nothing is not
+        providerstats.record(source, 'scrape', time.time() - start, len(sources or []), workers.failed() or workers.cancelled())
+
+
+    def addSources(self, sources):
+        # A provider cancelled by the stop policy may still return after the list was filtered
+        if workers.cancelled(): return
+
+        debrid_status = debrid.status()
+
+        with self.changed:
+            for i in sources:
+                try:
+                    q = i['quality']
+
+                    if i.get('debridonly', False) == False:
+                        self.sourceCounts[q] = self.sourceCounts.get(q, 0) + 1
+
+                    if debrid_status and debrid.valid(i['source']):
+                        self.debridCounts[q] = self.debridCounts.get(q, 0) + 1
+                except:
+                    pass
+
+            self.sources.extend(sources)
+            self.changed.notify_all()
+
+
+    def getSourceCounts(self):
+        with self.changed:
+            return dict(self.sourceCounts), dict(self.debridCounts)
+
+
+    def getQualityTiers(self, counts, quality):
+        c = lambda *q: sum(counts.get(x, 0) for x in q)
+
+        if quality in ['0']: return c('4K'), c('1440p', '1080p'), c('720p', 'HD'), c('SD')
+        elif quality in ['1']: return 0, c('1440p', '1080p'), c('720p', 'HD'), c('SD')
+        elif quality in ['2']: return 0, c('1080p'), c('720p', 'HD'), c('SD')
+        elif quality in ['3']: return 0, 0, c('720p', 'HD'), c('SD')
+        else: return 0, 0, 0, c('SD')
+
+
+    def getStopPolicy(self):
+        '''
+        Targets that end the scrape early: minimum source counts at 1080p+ and
+        720p+ (all set targets must be met), or a minimum number of playable
+        sources once every priority 0 provider has finished. Counts are taken
+        from debrid sources when a debrid account is active. 0 disables a target.
+        '''
+        if not control.setting('scrapers.stop') == 'true': return None
+
+        policy = {}
+        for key in ['1080', '720', 'total']:
+            try: policy[key] = int(control.setting('scrapers.stop.' + key))
+            except: policy[key] = 0
+
+        if not any(policy.values()): return None
+        return policy
+
+
+    def stopScraping(self, policy, counts, quality, maindone):
+        if not policy: return False
+
+        tiers = self.getQualityTiers(counts, quality)
+        hd = tiers[0] + tiers[1]
+        total = sum(tiers)
+
+        targets = [(policy['1080'], hd), (policy['720'], hd + tiers[2])]
+        targets = [i for i in targets if i[0] > 0]
+        if targets and all(i[1] >= i[0] for i in targets): return True
+
+        if policy['total'] > 0 and maindone and total >= policy['total']: return True
+
+        return False
+
 
     def alterSources(self, url, meta):
         try:
+            # Choosing how to play an item again rescrapes providers that recently found nothing
+            try: control.window.setProperty(self.rescrapeProperty, json.loads(meta)['imdb'])
+            except: pass
+
             if control.setting('hosts.mode') == '2': url += '&select=1'
             else: url += '&select=2'
             control.execute('RunPlugin(%s)' % url)
@@ -753,13 +857,7 @@ class sources:
             yes = control.yesnoDialog(control.lang(32407).encode('utf-8'), '', '')
             if not yes: return
 
-            control.makeFile(control.dataPath)
-            dbcon = database.connect(control.providercacheFile)
-            dbcur = dbcon.cursor()
-            dbcur.execute("DROP TABLE IF EXISTS rel_src")
-            dbcur.execute("DROP TABLE IF EXISTS rel_url")
-            dbcur.execute("VACUUM")
-            dbcon.commit()
+            providercache.clear()
 
             control.infoDialog(control.lang(32408).encode('utf-8'), sound=True, icon='INFO')
         except:
@@ -783,65 +881,49 @@ class sources:
         if provider == 'true':
             self.sources = sorted(self.sources, key=lambda k: k['provider'])
 
-        for i in self.sources:
-            if 'checkquality' in i and i['checkquality'] == True:
-                if not i['source'].lower() in self.hosthqDict and i['quality'] not in ['SD', 'SCR', 'CAM']: i.update({'quality': 'SD'})
-        
-        local = [i for i in self.sources if 'local' in i and i['local'] == True]
-        for i in local: i.update({'language': self._getPrimaryLang() or 'en'})
-        self.sources = [i for i in self.sources if not i in local]
+        flags = self.hostRegistry.flags
+        exclude = hostregistry.BLOCKED if captcha == 'true' else hostregistry.BLOCKED | hostregistry.CAPTCHA
 
-        filter = []
-        filter += [i for i in self.sources if i['direct'] == True]
-        filter += [i for i in self.sources if i['direct'] == False]
-        self.sources = filter
+        local = [] ; direct = [] ; indirect = []
 
-        filter = []
-        
+        for i in self.sources:
+            if 'checkquality' in i and i['checkquality'] == True:
+                if not flags(i['source']) & hostregistry.HQ and i['quality'] not in ['SD', 'SCR', 'CAM']: i.update({'quality': 'SD'})
 
-        for d in debrid.debrid_resolvers:
-            valid_hoster = set([i['source'] for i in self.sources])
-            valid_hoster = [i for i in valid_hoster if d.valid_url('', i)]
-            filter += [dict(i.items() + [('debrid', d.name)]) for i in self.sources if i['source'] in valid_hoster]
-        filter += [i for i in self.sources if not i['source'].lower() in self.hostprDict and i['debridonly'] == False]
+            if 'local' in i and i['local'] == True:
+                i.update({'language': self._getPrimaryLang() or 'en'})
+                local.append(i)
+            elif i['direct'] == True: direct.append(i)
+            elif i['direct'] == False: indirect.append(i)
 
-        self.sources = filter
-      
-        for i in range(len(self.sources)):
-            q = self.sources[i]['quality']            
-            if q == 'HD': self.sources[i].update({'quality': '720p'})
+        self.sources = direct + indirect
 
         filter = []
-        filter += local
 
-        if quality in ['0']: filter += [i for i in self.sources if i['quality'] == '4K' and 'debrid' in i]
-        if quality in ['0']: filter += [i for i in self.sources if i['quality'] == '4K' and not 'debrid' in i and 'memberonly' in i]
-        if quality in ['0']: filter += [i for i in self.sources if i['quality'] == '4K' and not 'debrid' in i and not 'memberonly' in i]
+        for d in debrid.debrid_resolvers:
+            filter += [dict(i.items() + [('debrid', d.name)]) for i in self.sources if debrid.valid(i['source'], d.name)]
+        filter += [i for i in self.sources if not flags(i['source']) & hostregistry.PREMIUM and i['debridonly'] == False]
 
-        if quality in ['0', '1']: filter += [i for i in self.sources if i['quality'] == '1440p' and 'debrid' in i]
-        if quality in ['0', '1']: filter += [i for i in self.sources if i['quality'] == '1440p' and not 'debrid' in i and 'memberonly' in i]
-        if quality in ['0', '1']: filter += [i for i in self.sources if i['quality'] == '1440p' and not 'debrid' in i and not 'memberonly' in i]
+        # Bucket by (quality, debrid, memberonly) in one pass, in the order they are listed
+        tiers = ['4K', '1440p', '1080p', '720p'][int(quality):] if quality in ['0', '1', '2', '3'] else []
+        buckets = dict([(q, ([], [], [])) for q in tiers])
+        low = []
 
-        if quality in ['0', '1', '2']: filter += [i for i in self.sources if i['quality'] == '1080p' and 'debrid' in i]
-        if quality in ['0', '1', '2']: filter += [i for i in self.sources if i['quality'] == '1080p' and not 'debrid' in i and 'memberonly' in i]
-        if quality in ['0', '1', '2']: filter += [i for i in self.sources if i['quality'] == '1080p' and not 'debrid' in i and not 'memberonly' in i]
+        for i in filter:
+            if i['quality'] == 'HD': i.update({'quality': '720p'})
 
-        if quality in ['0', '1', '2', '3']: filter += [i for i in self.sources if i['quality'] == '720p' and 'debrid' in i]
-        if quality in ['0', '1', '2', '3']: filter += [i for i in self.sources if i['quality'] == '720p' and not 'debrid' in i and 'memberonly' in i]
-        if quality in ['0', '1', '2', '3']: filter += [i for i in self.sources if i['quality'] == '720p' and not 'debrid' in i and not 'memberonly' in i]
+            if not 'debrid' in i and flags(i['source']) & exclude: continue
 
-        filter += [i for i in self.sources if i['quality'] in ['SD', 'SCR', 'CAM']]
-        self.sources = filter
+            q = i['quality']
+            if q in buckets: buckets[q][0 if 'debrid' in i else 1 if 'memberonly' in i else 2].append(i)
+            elif q in ['SD', 'SCR', 'CAM']: low.append(i)
 
-        if not captcha == 'true':
-            filter = [i for i in self.sources if i['source'].lower() in self.hostcapDict and not 'debrid' in i]
-            self.sources = [i for i in self.sources if not i in filter]
+        self.sources = [i for i in local if 'debrid' in i or not flags(i['source']) & exclude]
+        for q in tiers:
+            for b in buckets[q]: self.sources += b
+        self.sources += low
 
-        filter = [i for i in self.sources if i['source'].lower() in self.hostblockDict and not 'debrid' in i]
-        self.sources = [i for i in self.sources if not i in filter]
-        
-        multi = [i['language'] for i in self.sources]
-        multi = [x for y,x in enumerate(multi) if x not in multi[:y]]
+        multi = set([i['language'] for i in self.sources])
         multi = True if len(multi) > 1 else False
 
         if multi == True:
@@ -852,56 +934,34 @@ class sources:
         extra_info = control.setting('sources.extrainfo')
         prem_identify = control.setting('prem.identify')
         if prem_identify == '': prem_identify = 'blue'
-        prem_identify = self.getPremColor(prem_identify)        
-        
+        prem_identify = self.getPremColor(prem_identify)
+
+        labels = {}
+
         for i in range(len(self.sources)):
                        
             if extra_info == 'true': t = source_utils.getFileType(self.sources[i]['url'])
             else: t = None
-            
-            u = self.sources[i]['url']
 
             p = self.sources[i]['provider']
 
             q = self.sources[i]['quality']
 
             s = self.sources[i]['source']
-            
-            s = s.rsplit('.', 1)[0]
 
             l = self.sources[i]['language']
 
-            try: f = (' | '.join(['[I]%s [/I]' % info.strip() for info in self.sources[i]['info'].split('|')]))
-            except: f = ''
+            f = self.sources[i].get('info')
+            if not isinstance(f, basestring): f = None
 
             try: d = self.sources[i]['debrid']
             except: d = self.sources[i]['debrid'] = ''
 
-            if d.lower() == 'real-debrid': d = 'RD'
-
-            if not d == '': label = '%02d | [B]%s | %s[/B] | ' % (int(i+1), d, p)
-            else: label = '%02d | [B]%s[/B] | ' % (int(i+1), p)
+            # Labels only differ by their number, so build each distinct one once
+            key = (p, q, s, l, f, d, t)
+            if not key in labels: labels[key] = self.sourceLabel(p, q, s, l, f, d, t, multi, prem_identify)
 
-            if multi == True and not l == 'en': label += '[B]%s[/B] | ' % l
-
-            if t:
-                if q in ['4K', '1440p', '1080p', '720p']: label += '%s | [B][I]%s [/I][/B] | [I]%s[/I] | %s' % (s, q, t, f)
-                elif q == 'SD': label += '%s | %s | [I]%s[/I]' % (s, f, t)
-                else: label += '%s | %s | [I]%s [/I] | [I]%s[/I]' % (s, f, q, t)
-            else:
-                if q in ['4K', '1440p', '1080p', '720p']: label += '%s | [B][I]%s [/I][/B] | %s' % (s, q, f)
-                elif q == 'SD': label += '%s | %s' % (s, f)
-                else: label += '%s | %s | [I]%s [/I]' % (s, f, q)
-            label = label.replace('| 0 |', '|').replace(' | [I]0 [/I]', '')
-            label = re.sub('\[I\]\s+\[/I\]', ' ', label)
-            label = re.sub('\|\s+\|', '|', label)
-            label = re.sub('\|(?:\s+|)$', '', label)
-            
-            if d: 
-                if not prem_identify == 'nocolor':
-                    self.sources[i]['label'] = ('[COLOR %s]' % (prem_identify)) + label.upper() + '[/COLOR]'
-                else: self.sources[i]['label'] = label.upper()
-            else: self.sources[i]['label'] = label.upper()
+            self.sources[i]['label'] = labels[key].replace('\x00', '%02d' % int(i+1), 1)
 
         try: 
             if not HEVC == 'true': self.sources = [i for i in self.sources if not 'HEVC' in i['label']]
@@ -912,17 +972,62 @@ class sources:
         return self.sources
 
 
+    def sourceLabel(self, p, q, s, l, f, d, t, multi, prem_identify):
+        s = s.rsplit('.', 1)[0]
+
+        try: f = (' | '.join(['[I]%s [/I]' % info.strip() for info in f.split('|')]))
+        except: f = ''
+
+        if d.lower() == 'real-debrid': d = 'RD'
+
+        if not d == '': label = '\x00 | [B]%s | %s[/B] | ' % (d, p)
+        else: label = '\x00 | [B]%s[/B] | ' % (p)
+
+        if multi == True and not l == 'en': label += '[B]%s[/B] | ' % l
+
+        if t:
+            if q in ['4K', '1440p', '1080p', '720p']: label += '%s | [B][I]%s [/I][/B] | [I]%s[/I] | %s' % (s, q, t, f)
+            elif q == 'SD': label += '%s | %s | [I]%s[/I]' % (s, f, t)
+            else: label += '%s | %s | [I]%s [/I] | [I]%s[/I]' % (s, f, q, t)
+        else:
+            if q in ['4K', '1440p', '1080p', '720p']: label += '%s | [B][I]%s [/I][/B] | %s' % (s, q, f)
+            elif q == 'SD': label += '%s | %s' % (s, f)
+            else: label += '%s | %s | [I]%s [/I]' % (s, f, q)
+        label = label.replace('| 0 |', '|').replace(' | [I]0 [/I]', '')
+        label = label_empty.sub(' ', label)
+        label = label_pipes.sub('|', label)
+        label = label_trail.sub('', label)
+
+        if d:
+            if not prem_identify == 'nocolor':
+                return ('[COLOR %s]' % (prem_identify)) + label.upper() + '[/COLOR]'
+            else: return label.upper()
+        else: return label.upper()
+
+
     def sourcesResolve(self, item, info=False):
-        try:
-            self.url = None
+        self.url = None
+        url = self.resolveItem(item)
+        if url == None and info == True: self.errorForSources()
+        self.url = url
+        return url
 
+
+    def resolveItem(self, item):
+        '''
+        sourcesResolve without touching self.url, for resolve jobs running
+        next to each other. Returns the playable url or None.
+        '''
+        start = time.time()
+
+        try:
             u = url = item['url']
 
             d = item['debrid'] ; direct = item['direct']
             local = item.get('local', False)
 
             provider = item['provider']
-            call = [i[1] for i in self.sourceDict if i[0] == provider][0]
+            call = self.getSourceDict([provider])[0][1]
             u = url = call.resolve(url)
 
             if url == None or (not '://' in str(url) and not local): raise Exception()
@@ -963,13 +1068,23 @@ class sources:
                 if result == None: raise Exception()
 
 
-            self.url = url
+            self.recordResolve(item, start, True)
             return url
         except:
-            if info == True: self.errorForSources()
+            self.recordResolve(item, start, False)
             return
 
 
+    def recordResolve(self, item, start, resolved):
+        # A resolve cut short by resolveStop says nothing about the provider
+        if workers.cancelled(): return
+        try:
+            providerstats.record(item['provider'], 'resolve', time.time() - start, error=not resolved)
+            providerstats.flush()
+        except:
+            pass
+
+
     def sourcesDialog(self, items):
         try:
             
@@ -993,12 +1108,13 @@ class sources:
 
             block = None
 
+            self.resolveStart()
+
             for i in range(len(items)):
                 try:
                     if items[i]['source'] == block: raise Exception()
 
-                    w = workers.Thread(self.sourcesResolve, items[i])
-                    w.start()
+                    w = self.resolveJob(items, i, block)
 
                     try:
                         if progressDialog.iscanceled(): break
@@ -1011,7 +1127,7 @@ class sources:
                     for x in range(3600):
                         try:
                             if xbmc.abortRequested == True: return sys.exit()
-                            if progressDialog.iscanceled(): return progressDialog.close()
+                            if progressDialog.iscanceled(): self.resolveStop() ; return progressDialog.close()
                         except:
                             pass
 
@@ -1021,24 +1137,32 @@ class sources:
                         k = control.condVisibility('Window.IsActive(yesnoDialog)')
                         if k: m += '1'; m = m[-1]
                         if (w.is_alive() == False or x > 30) and not k: break
-                        time.sleep(0.5)
+                        w.wait(0.5)
 
 
                     for x in range(30):
                         try:
                             if xbmc.abortRequested == True: return sys.exit()
-                            if progressDialog.iscanceled(): return progressDialog.close()
+                            if progressDialog.iscanceled(): self.resolveStop() ; return progressDialog.close()
                         except:
                             pass
 
                         if m == '': break
                         if w.is_alive() == False: break
-                        time.sleep(0.5)
+                        w.wait(0.5)
+
+
+                    if w.is_alive() == True:
+                        block = items[i]['source']
+                        # or a stuck serial resolve holds up every later one
+                        w.cancel()
 
+                    url = w.result if w.is_alive() == False else None
 
-                    if w.is_alive() == True: block = items[i]['source']
+                    if url == None: raise Exception()
 
-                    if self.url == None: raise Exception()
+                    self.resolveStop()
+                    self.url = url
 
                     self.selectedSource = items[i]['label']
 
@@ -1047,10 +1171,12 @@ class sources:
 
                     control.execute('Dialog.Close(virtualkeyboard)')
                     control.execute('Dialog.Close(yesnoDialog)')
-                    return self.url
+                    return url
                 except:
                     pass
 
+            self.resolveStop()
+
             try: progressDialog.close()
             except: pass
 
@@ -1061,10 +1187,10 @@ class sources:
 
 
     def sourcesDirect(self, items):
-        filter = [i for i in items if i['source'].lower() in self.hostcapDict and i['debrid'] == '']
+        filter = [i for i in items if self.hostRegistry.flags(i['source']) & hostregistry.CAPTCHA and i['debrid'] == '']
         items = [i for i in items if not i in filter]
 
-        filter = [i for i in items if i['source'].lower() in self.hostblockDict and i['debrid'] == '']
+        filter = [i for i in items if self.hostRegistry.flags(i['source']) & hostregistry.BLOCKED and i['debrid'] == '']
         items = [i for i in items if not i in filter]
 
         items = [i for i in items if ('autoplay' in i and i['autoplay'] == True) or not 'autoplay' in i]
@@ -1074,11 +1200,13 @@ class sources:
 
         u = None
 
+        self.resolveStart()
+
         header = control.addonInfo('name')
         header2 = header.upper()
 
         try:
-            control.sleep(1000)
+            control.sleep(200)
 
             progressDialog = control.progressDialog if control.setting('progress.dialog') == '0' else control.progressDialogBG
             progressDialog.create(header, '')
@@ -1096,17 +1224,63 @@ class sources:
             try:
                 if xbmc.abortRequested == True: return sys.exit()
 
-                url = self.sourcesResolve(items[i])
+                w = self.resolveJob(items, i)
+                while w.is_alive() == True:
+                    if xbmc.abortRequested == True: self.resolveStop() ; return sys.exit()
+                    w.wait(0.5)
+
+                url = w.result
                 if u == None: u = url
                 if not url == None: break
             except:
                 pass
 
+        self.resolveStop()
+        self.url = u
+
         try: progressDialog.close()
         except: pass
 
         return u
 
+    def resolveStart(self):
+        try: ahead = int(control.setting('resolve.ahead'))
+        except: ahead = 3
+
+        self.resolveJobs = {}
+        self.resolvePool = workers.Pool(max(1, ahead))
+        self.resolvePool.start()
+        self.resolveSerial = workers.Pool(1)
+        self.resolveSerial.start()
+
+
+    def resolveJob(self, items, i, block=None):
+        '''
+        Returns the resolve job for items[i], first queueing it and the next
+        candidates so they resolve while items[i] is polled. Captcha hosts
+        prompt the user and debrid resolvers share one logged in instance
+        per account that may ask to authorise, so both only resolve in their
+        own turn, one at a time; any dialog then belongs to the item polled.
+        '''
+        for x in range(i, min(len(items), i + self.resolvePool.max_workers)):
+            if x in self.resolveJobs or items[x]['source'] == block: continue
+
+            if not items[x].get('debrid', '') == '' or self.hostRegistry.flags(items[x]['source']) & hostregistry.CAPTCHA:
+                if x == i: self.resolveJobs[x] = self.resolveSerial.submit(self.resolveItem, items[x], priority=x)
+            else:
+                self.resolveJobs[x] = self.resolvePool.submit(self.resolveItem, items[x], priority=x)
+
+        return self.resolveJobs[i]
+
+
+    def resolveStop(self):
+        try:
+            self.resolvePool.cancel()
+            self.resolveSerial.cancel()
+        except:
+            pass
+
+
     def errorForSources(self):
         control.infoDialog(control.lang(32401).encode('utf-8'), sound=False, icon='INFO')
 
@@ -1146,34 +1320,57 @@ class sources:
         lang = langDict.get(name)
         return lang
 
+    def getThreadCount(self):
+        try: count = int(control.setting('scrapers.threads'))
+        except: count = 0
+        if count > 0: return count
+        try:
+            import multiprocessing
+            return max(10, 5 * multiprocessing.cpu_count())
+        except:
+            return 10
+
+    def getProcessCount(self):
+        '''
+        Worker processes for provider calls; 0, the default, keeps them on
+        threads. Forking from Kodi's threaded interpreter can leave a child
+        stuck on a lock copied mid use, so processes are only an opt in.
+        '''
+        try: count = int(control.setting('scrapers.processes'))
+        except: count = 0
+        if count <= 0 or not processes.available(): return 0
+        return count
+
     def getTitle(self, title):
         title = cleantitle.normalize(title)
         return title
 
+    def getSourceDict(self, names):
+        from resources.lib.sources import load
+        return load(names)
+
     def getConstants(self):
         self.itemProperty = 'plugin.video.covenant.container.items'
 
         self.metaProperty = 'plugin.video.covenant.container.meta'
 
-        from resources.lib.sources import sources
+        self.rescrapeProperty = 'plugin.video.covenant.rescrape'
 
-        self.sourceDict = sources()
+        from resources.lib.sources import manifest
 
-        try:
-            self.hostDict = urlresolver.relevant_resolvers(order_matters=True)
-            self.hostDict = [i.domains for i in self.hostDict if not '*' in i.domains]
-            self.hostDict = [i.lower() for i in reduce(lambda x, y: x+y, self.hostDict)]
-            self.hostDict = [x for y,x in enumerate(self.hostDict) if x not in self.hostDict[:y]]
-        except:
-            self.hostDict = []
+        self.sourceManifest = manifest()
+
+        self.hostRegistry = hostregistry.load()
+
+        self.hostDict = self.hostRegistry.hostDict
 
-        self.hostprDict = ['1fichier.com', 'oboom.com', 'rapidgator.net', 'rg.to', 'uploaded.net', 'uploaded.to', 'ul.to', 'filefactory.com', 'nitroflare.com', 'turbobit.net', 'uploadrocket.net']
+        self.hostprDict = self.hostRegistry.hostprDict
 
-        self.hostcapDict = ['hugefiles.net', 'kingfiles.net', 'openload.io', 'openload.co', 'oload.tv', 'thevideo.me', 'vidup.me', 'streamin.to', 'torba.se']
+        self.hostcapDict = self.hostRegistry.hostcapDict
 
-        self.hosthqDict = ['gvideo', 'google.com', 'openload.io', 'openload.co', 'oload.tv', 'thevideo.me', 'rapidvideo.com', 'raptu.com', 'filez.tv', 'uptobox.com', 'uptobox.com', 'uptostream.com', 'xvidstage.com', 'streamango.com']
+        self.hosthqDict = self.hostRegistry.hosthqDict
 
-        self.hostblockDict = []
+        self.hostblockDict = self.hostRegistry.hostblockDict
 
     def getPremColor(self, n):
         if n == '0': n = 'blue'
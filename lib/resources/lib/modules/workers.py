@@ -18,7 +18,8 @@
 '''
 
 
-import threading
+
+import copy,heapq,itertools,threading,time
 
 
 class Thread(threading.Thread):
@@ -29,3 +30,297 @@ class Thread(threading.Thread):
     def run(self):
         self._target(*self._args)
 
+
+class Job:
+    '''
+    A unit of work queued on a Pool. Exposes the same getName()/is_alive()
+    interface as Thread so callers polling a list of threads keep working.
+    '''
+    _counter = itertools.count(1)
+
+    def __init__(self, pool, target, args, priority=0, name=None, timeout=None):
+        self.pool = pool
+        self.target = target
+        self.args = args
+        self.priority = priority
+        self.timeout = timeout
+        self.name = name or 'Job-%d' % next(self._counter)
+        self.state = 'pending'
+        self.result = None
+        self.error = None
+        self.started = None
+        self.finished = None
+        self.resources = []
+        self.failed = False
+
+    def getName(self):
+        return self.name
+
+    def is_alive(self):
+        return self.state in ['pending', 'running']
+
+    def is_cancelled(self):
+        return self.state == 'cancelled' or (self.state == 'running' and self.pool.is_cancelled(self))
+
+    def cancel(self):
+        return self.pool.cancel(self)
+
+    def wait(self, timeout=None):
+        '''
+        Block until the job finishes or timeout seconds pass. Returns True
+        once it has finished.
+        '''
+        deadline = None if timeout == None else time.time() + timeout
+        with self.pool.changed:
+            while self.is_alive():
+                if deadline == None: self.pool.changed.wait()
+                elif deadline > time.time(): self.pool.changed.wait(deadline - time.time())
+                else: break
+            return not self.is_alive()
+
+    def register(self, resource):
+        '''
+        Track an open connection or socket (anything with close()) so
+        cancelling the job can close it instead of waiting for the connect
+        or the transfer to finish.
+        '''
+        self.resources.append(resource)
+        if self.is_cancelled(): _abort(resource)
+
+    def release(self, resource):
+        try: self.resources.remove(resource)
+        except ValueError: pass
+
+    def abort(self):
+        for i in list(self.resources): _abort(i)
+
+
+class Pool:
+    '''
+    Bounded worker pool. Jobs run in ascending priority order (ties keep
+    submission order) on at most max_workers threads. Worker threads exit as
+    soon as the queue is empty, so an idle pool holds no threads. The changed
+    condition is notified whenever a job finishes or is cancelled; pass one in
+    to share it with other producers.
+    '''
+    def __init__(self, max_workers=10, changed=None):
+        self.max_workers = max(1, int(max_workers))
+        self.changed = changed or threading.Condition(threading.RLock())
+        self._queue = []
+        self._jobs = []
+        self._seq = itertools.count()
+        self._cancelled = set()
+        self._workers = 0
+        self._started = False
+
+    def submit(self, target, *args, **kwargs):
+        job = Job(self, target, args, kwargs.get('priority', 0), kwargs.get('name'), kwargs.get('timeout'))
+        with self.changed:
+            self._jobs.append(job)
+            heapq.heappush(self._queue, (job.priority, next(self._seq), job))
+            if self._started: self._spawn()
+        return job
+
+    def start(self):
+        with self.changed:
+            self._started = True
+            self._spawn()
+
+    def cancel(self, job=None, running=True):
+        '''
+        Cancel one job, or every unfinished job when job is None. Pending jobs
+        are dropped from the queue. Unless running is False, running jobs are
+        flagged so the target can check cancelled() and bail out early, and
+        the connections they registered are closed.
+        '''
+        aborted = []
+        with self.changed:
+            jobs = self._jobs if job == None else [job]
+            for j in jobs:
+                if j.state == 'pending':
+                    j.state = 'cancelled'
+                    j.finished = time.time()
+                elif j.state == 'running' and running == True:
+                    self._cancelled.add(j)
+                    aborted.append(j)
+            self._queue = [i for i in self._queue if i[2].state == 'pending']
+            heapq.heapify(self._queue)
+            self.changed.notify_all()
+
+        for j in aborted: j.abort()
+
+    def expire(self):
+        '''
+        Cancel running jobs that have exceeded their own timeout.
+        '''
+        now = time.time()
+        with self.changed:
+            expired = [i for i in self._jobs if i.state == 'running' and not i.timeout == None and now - i.started > i.timeout and not i in self._cancelled]
+        for i in expired: self.cancel(i)
+        return expired
+
+    def is_cancelled(self, job):
+        return job in self._cancelled
+
+    def jobs(self):
+        return list(self._jobs)
+
+    def alive(self):
+        return [i for i in self._jobs if i.is_alive()]
+
+    def done(self):
+        return len(self.alive()) == 0
+
+    def wait(self, timeout=None):
+        '''
+        Block until a job finishes or timeout seconds pass. Returns True when
+        every job has finished.
+        '''
+        with self.changed:
+            if not self.done(): self.changed.wait(timeout)
+            return self.done()
+
+    def _spawn(self):
+        while self._workers < min(self.max_workers, len(self._queue)):
+            self._workers += 1
+            t = Thread(self._worker)
+            t.start()
+
+    def _worker(self):
+        while True:
+            with self.changed:
+                if len(self._queue) == 0:
+                    self._workers -= 1
+                    return
+                job = heapq.heappop(self._queue)[2]
+                job.state = 'running'
+                job.started = time.time()
+
+            _local.job = job
+            try: job.result = job.target(*job.args)
+            except Exception as e: job.error = e
+            _local.job = None
+
+            with self.changed:
+                job.state = 'cancelled' if job in self._cancelled else 'done'
+                job.finished = time.time()
+                job.resources = []
+                self._cancelled.discard(job)
+                self.changed.notify_all()
+
+
+class Flights:
+    '''
+    Single-flight calls. While one thread runs the call for a key, threads
+    asking for the same key wait for its result instead of repeating it.
+    Waiters get a copy, so nobody mutates another caller's result; when the
+    running call was cancelled a waiter that was not makes the call itself.
+    '''
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+
+    def call(self, key, target, *args):
+        while True:
+            with self.lock:
+                flight = self.calls.get(key)
+                if flight == None:
+                    flight = self.calls[key] = _flight()
+                    break
+
+            while not flight.done.wait(0.25):
+                if cancelled(): return None
+
+            if flight.cancelled and not cancelled(): continue
+            if flight.failed: fail()
+            if not flight.error == None: raise flight.error
+            try: return copy.deepcopy(flight.result)
+            except: return flight.result
+
+        try:
+            flight.result = target(*args)
+            return flight.result
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            flight.cancelled = cancelled()
+            flight.failed = failed()
+            with self.lock: del self.calls[key]
+            flight.done.set()
+
+
+class _flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.cancelled = False
+        self.failed = False
+
+
+_local = threading.local()
+
+
+def current():
+    '''
+    The Job running on the calling thread, or None outside a Pool.
+    '''
+    return getattr(_local, 'job', None)
+
+
+def cancelled():
+    job = current()
+    return job != None and job.is_cancelled()
+
+
+def fail():
+    '''
+    Note that the calling job hit a network error or an exception, so an
+    empty result from it says nothing about what it was looking for.
+    '''
+    job = current()
+    if job != None: job.failed = True
+    else: _local.failed = True
+
+
+def failed(reset=False):
+    '''
+    Whether fail() was called by the running job, or outside a Pool by this
+    thread since the last reset.
+    '''
+    job = current()
+    if job != None: return job.failed
+    r = getattr(_local, 'failed', False)
+    if reset: _local.failed = False
+    return r
+
+
+def register(resource):
+    job = current()
+    if job != None: job.register(resource)
+
+
+def release(resource):
+    '''
+    Stop tracking resource, e.g. a connection handed back to a pool where
+    other jobs will use it.
+    '''
+    job = current()
+    if job != None: job.release(resource)
+
+
+def _abort(resource):
+    # urllib2 responses wrap the socket; shutting it down wakes a blocked read
+    import socket
+    try: resource.fp._sock.fp._sock.shutdown(socket.SHUT_RDWR)
+    except: pass
+    # pooled keepalive responses read from the socket directly
+    try: resource.fp._sock.shutdown(socket.SHUT_RDWR)
+    except: pass
+    # sockets registered as they are made, connecting or awaiting the answer
+    try: resource.shutdown(socket.SHUT_RDWR)
+    except: pass
+    try: resource.close()
+    except: pass
+
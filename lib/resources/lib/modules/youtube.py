@@ -22,7 +22,6 @@
 import re,json
 
 from resources.lib.modules import client
-from resources.lib.modules import workers
 
 
 class youtube(object):
@@ -140,12 +139,8 @@ class youtube(object):
             u = [','.join([self.list[x]['url'] for x in i]) for i in u]
             u = [self.content_link % i + self.key_link for i in u]
 
-            threads = []
-            for i in range(0, len(u)):
-                threads.append(workers.Thread(self.thread, u[i], i))
-                self.data.append('')
-            [i.start() for i in threads]
-            [i.join() for i in threads]
+            results = dict(client.request_many(u))
+            self.data = [results[i] for i in u]
 
             items = []
             for i in self.data: items += json.loads(i)['items']
@@ -178,11 +173,3 @@ class youtube(object):
         return self.list
 
 
-    def thread(self, url, i):
-        try:
-            result = client.request(url)
-            self.data[i] = result
-        except:
-            return
-
-
@@ -20,13 +20,22 @@
 
 import pkgutil
 import os.path
+import hashlib
+import json
 
+from resources.lib.modules import control
 from resources.lib.modules import log_utils
 
 __all__ = [x[1] for x in os.walk(os.path.dirname(__file__))][0]
 
+loaded = {}
 
-def sources():
+# Providers that failed to import are kept in the manifest and tried once
+# more per process, as what they were missing may have been installed since
+retried = False
+
+
+def sources(names=None):
     try:
         sourceDict = []
         for i in __all__:
@@ -34,9 +43,14 @@ def sources():
                 if is_pkg:
                     continue
 
+                if not names == None and not module_name in names:
+                    continue
+
                 try:
-                    module = loader.find_module(module_name).load_module(module_name)
-                    sourceDict.append((module_name, module.source()))
+                    if not module_name in loaded:
+                        module = loader.find_module(module_name).load_module(module_name)
+                        loaded[module_name] = module.source()
+                    sourceDict.append((module_name, loaded[module_name]))
                 except Exception as e:
                     log_utils.log('Could not load "%s": %s' % (module_name, e), log_utils.LOGDEBUG)
         return sourceDict
@@ -44,3 +58,107 @@ def sources():
         return []
 
 
+def load(names):
+    '''
+    Import only the named providers, using the manifest to find them.
+    '''
+    try:
+        sourceDict = []
+        paths = dict([(i['name'], i['path']) for i in manifest()])
+        for name in names:
+            try:
+                if not name in loaded:
+                    path = os.path.join(os.path.dirname(__file__), paths[name])
+                    module = pkgutil.get_importer(path).find_module(name).load_module(name)
+                    loaded[name] = module.source()
+                sourceDict.append((name, loaded[name]))
+            except Exception as e:
+                log_utils.log('Could not load "%s": %s' % (name, e), log_utils.LOGDEBUG)
+        return sourceDict
+    except:
+        return []
+
+
+def manifest():
+    '''
+    Describe every provider without importing it. The manifest is rebuilt,
+    importing everything once, only when a provider file is added, removed
+    or changed. Providers that failed to import are retried once a process.
+    '''
+    global retried
+
+    signature = _signature()
+
+    try:
+        f = open(control.providermanifestFile, 'r')
+        try: data = json.load(f)
+        finally: f.close()
+        if data['signature'] == signature:
+            if retried or not data.get('failed'): return data['providers']
+            retried = True
+            providers, failed = _describe(data['providers'], data['failed'])
+            if len(failed) < len(data['failed']): _save(signature, providers, failed)
+            return providers
+    except:
+        pass
+
+    retried = True
+    found = []
+    for i in __all__:
+        for loader, module_name, is_pkg in pkgutil.walk_packages([os.path.join(os.path.dirname(__file__), i)]):
+            if not is_pkg: found.append([module_name, i])
+
+    providers, failed = _describe([], found)
+    _save(signature, providers, failed)
+    return providers
+
+
+def _describe(providers, names):
+    '''
+    providers plus an entry for each importable [name, path] of names, and
+    the [name, path] pairs that failed.
+    '''
+    providers = list(providers) ; failed = []
+    for name, path in names:
+        try:
+            if not name in loaded:
+                module = pkgutil.get_importer(os.path.join(os.path.dirname(__file__), path)).find_module(name).load_module(name)
+                loaded[name] = module.source()
+            call = loaded[name]
+            providers.append({
+                'name': name,
+                'path': path,
+                'language': list(call.language),
+                'priority': call.priority,
+                'genre_filter': list(getattr(call, 'genre_filter', None) or []),
+                'domains': list(getattr(call, 'domains', None) or []),
+                'movie': hasattr(call, 'movie'),
+                'tvshow': hasattr(call, 'tvshow')})
+        except Exception as e:
+            failed.append([name, path])
+            log_utils.log('Could not load "%s": %s' % (name, e), log_utils.LOGDEBUG)
+    return providers, failed
+
+
+def _save(signature, providers, failed):
+    try:
+        control.makeFile(control.dataPath)
+        f = open(control.providermanifestFile, 'w')
+        try: json.dump({'signature': signature, 'providers': providers, 'failed': failed}, f)
+        finally: f.close()
+    except:
+        pass
+
+
+def _signature():
+    path = os.path.dirname(__file__)
+    files = []
+    for root, dirs, names in os.walk(path):
+        for name in names:
+            if not name.endswith('.py'): continue
+            try:
+                st = os.stat(os.path.join(root, name))
+                files.append((os.path.relpath(os.path.join(root, name), path), int(st.st_mtime), st.st_size))
+            except:
+                pass
+    return hashlib.md5(repr(sorted(files))).hexdigest()
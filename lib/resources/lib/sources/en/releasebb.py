@@ -210,7 +210,7 @@ class source:
                     if i['cat'] == 'tvshow':
                         if not i['quality'] in ['1080p', 'HD']: raise Exception()
                         if not any(i['host'].lower() in x for x in hostDict): raise Exception()
-                        url = client.request(url)
+                        url = client.request(url, stop_when='</ol>')
                         url = client.parseDOM(url, 'ol')[0]
                         url = client.parseDOM(url, 'div', attrs = {'style': '.+?'})[int(data['episode'])-1]
 